@@ -0,0 +1,207 @@
+"""
+Columnar (Parquet) copy of the billing data for analytics.
+
+Writes invoices and invoice lines partitioned by year/period, plus customers and
+properties, so revenue-by-fee-type, rate history and collection-rate queries can run
+in DuckDB/pandas/Spark instead of against the app's database. Requires pyarrow
+(pip install pyarrow), which the web app itself doesn't need.
+
+    python analytics_snapshot.py --out analytics           # incremental
+    python analytics_snapshot.py --out analytics --full    # rebuild from scratch
+
+Runs are incremental: invoices with an id above the last run's watermark, or an
+updated_at after it, are appended. A changed invoice is therefore written again, so
+readers keep the row with the latest updated_at per id. Invoice lines only change by
+being deleted with their invoice, so they are appended by id. Customers and properties
+are small and rewritten on every run.
+
+Deleted invoices can't be read back, so every delete path records a tombstone first
+(record_invoice_deletions) and runs append the new ones to deleted_invoices/. Readers
+drop an invoice, and its lines, when it has a tombstone with a deleted_at later than
+the invoice row's updated_at (SQLite can reuse the id of the last invoice deleted).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+from sqlalchemy import select, or_, insert, literal, DateTime
+
+from models import SessionLocal, Invoice, InvoiceLine, Customer, Property, DeletedInvoice
+
+BATCH_SIZE = 50000
+WATERMARK_FILE = "_watermarks.json"
+
+INVOICE_COLUMNS = [
+    (Invoice.id, "int"), (Invoice.customer_id, "int"), (Invoice.invoice_date, "date"),
+    (Invoice.period_label, "str"), (Invoice.period_start, "date"), (Invoice.period_end, "date"),
+    (Invoice.amount, "float"), (Invoice.total_amount, "float"), (Invoice.status, "str"),
+    (Invoice.paid_date, "date"), (Invoice.updated_at, "datetime"),
+]
+LINE_COLUMNS = [
+    (InvoiceLine.id, "int"), (InvoiceLine.invoice_id, "int"), (Invoice.customer_id, "int"),
+    (Invoice.invoice_date, "date"), (Invoice.period_start, "date"), (InvoiceLine.position, "int"),
+    (InvoiceLine.kind, "str"), (InvoiceLine.fee_type, "str"), (InvoiceLine.description, "str"),
+    (InvoiceLine.amount, "float"),
+]
+CUSTOMER_COLUMNS = [
+    (Customer.id, "int"), (Customer.name, "str"), (Customer.email, "str"), (Customer.property_address, "str"),
+    (Customer.property_city, "str"), (Customer.property_state, "str"), (Customer.property_zip, "str"),
+    (Customer.rate, "float"), (Customer.cadence, "str"), (Customer.fee_type, "str"),
+    (Customer.fee_2_type, "str"), (Customer.fee_2_rate, "float"), (Customer.fee_3_type, "str"),
+    (Customer.fee_3_rate, "float"), (Customer.additional_fee_desc, "str"), (Customer.additional_fee_amount, "float"),
+    (Customer.next_bill_date, "date"),
+]
+PROPERTY_COLUMNS = [
+    (Property.id, "int"), (Property.customer_id, "int"), (Property.address, "str"), (Property.city, "str"),
+    (Property.state, "str"), (Property.zip_code, "str"), (Property.fee_amount, "float"), (Property.is_primary, "bool"),
+]
+DELETED_COLUMNS = [(DeletedInvoice.id, "int"), (DeletedInvoice.invoice_id, "int"), (DeletedInvoice.deleted_at, "datetime")]
+PARTITION_COLUMNS = [("year", "int"), ("period", "str")]
+
+def record_invoice_deletions(session, *criteria):
+    """
+    Record tombstones for the invoices matching `criteria` (all invoices without any),
+    in the caller's transaction, before it deletes them.
+    """
+    stmt = select(Invoice.id, literal(datetime.utcnow(), DateTime)).where(*criteria)
+    session.execute(insert(DeletedInvoice).from_select(["invoice_id", "deleted_at"], stmt))
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("The analytics snapshot needs pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+def _schema(pa, columns, extra=()):
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(), "date": pa.date32(),
+             "datetime": pa.timestamp("us"), "bool": pa.bool_()}
+    fields = [(column.key, kind) for column, kind in columns] + list(extra)
+    return pa.schema([(name, types[kind]) for name, kind in fields])
+
+def _partition(row):
+    """(year, period) partition values: the billing period, or the invoice date when unknown."""
+    period_start = row["period_start"] or row["invoice_date"]
+    return period_start.year, period_start.isoformat()
+
+def _read_batches(session, stmt, id_column, batch_size):
+    """Keyset-paginated reads of `stmt` ordered by id_column, as lists of dicts."""
+    last_id = 0
+    while True:
+        rows = session.execute(stmt.where(id_column > last_id).order_by(id_column).limit(batch_size)).mappings().all()
+        if not rows:
+            return
+        last_id = rows[-1][id_column.key]
+        yield [dict(row) for row in rows]
+
+def _write_partitioned(pa, pq, rows, schema, root, basename):
+    for row in rows:
+        row["year"], row["period"] = _partition(row)
+    pq.write_to_dataset(pa.Table.from_pylist(rows, schema=schema), root_path=root,
+                        partition_cols=["year", "period"], basename_template=basename + "-{i}.parquet")
+
+def _write_table(pa, pq, session, columns, path, batch_size):
+    """Rewrite a whole table into one Parquet file, batch by batch, replacing it atomically."""
+    schema = _schema(pa, columns)
+    tmp_path = path + ".tmp"
+    count = 0
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for rows in _read_batches(session, select(*[c for c, _ in columns]), columns[0][0], batch_size):
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            count += len(rows)
+    os.replace(tmp_path, path)
+    return count
+
+def write_snapshot(out_dir, full=False, batch_size=BATCH_SIZE):
+    """Write or extend the Parquet snapshot in out_dir. Returns row counts per table."""
+    pa, pq = _require_pyarrow()
+    watermark_path = os.path.join(out_dir, WATERMARK_FILE)
+    if full:
+        for name in ("invoices", "invoice_lines", "deleted_invoices"):
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+        if os.path.exists(watermark_path):
+            os.remove(watermark_path)
+    os.makedirs(out_dir, exist_ok=True)
+
+    watermarks = {}
+    if os.path.exists(watermark_path):
+        with open(watermark_path) as f:
+            watermarks = json.load(f)
+    last_invoice_id = watermarks.get("invoice_id", 0)
+    last_updated_at = datetime.fromisoformat(watermarks["updated_at"]) if watermarks.get("updated_at") else None
+    last_line_id = watermarks.get("invoice_line_id", 0)
+    last_deleted_id = watermarks.get("deleted_invoice_id", 0)
+
+    # Rows changed after this point are picked up by the next run
+    started = datetime.utcnow()
+    run_id = started.strftime("%Y%m%dT%H%M%S%f")
+    counts = {"invoices": 0, "invoice_lines": 0, "deleted_invoices": 0}
+
+    session = SessionLocal()
+    try:
+        invoice_stmt = select(*[c for c, _ in INVOICE_COLUMNS])
+        if last_updated_at is not None:
+            invoice_stmt = invoice_stmt.where(or_(Invoice.id > last_invoice_id, Invoice.updated_at > last_updated_at))
+        else:
+            invoice_stmt = invoice_stmt.where(Invoice.id > last_invoice_id)
+        schema = _schema(pa, INVOICE_COLUMNS, PARTITION_COLUMNS)
+        for n, rows in enumerate(_read_batches(session, invoice_stmt, Invoice.id, batch_size)):
+            last_invoice_id = max(last_invoice_id, rows[-1]["id"])
+            _write_partitioned(pa, pq, rows, schema, os.path.join(out_dir, "invoices"), f"{run_id}-{n}")
+            counts["invoices"] += len(rows)
+
+        line_stmt = (
+            select(*[c for c, _ in LINE_COLUMNS])
+            .join(Invoice, InvoiceLine.invoice_id == Invoice.id)
+            .where(InvoiceLine.id > last_line_id)
+        )
+        schema = _schema(pa, LINE_COLUMNS, PARTITION_COLUMNS)
+        for n, rows in enumerate(_read_batches(session, line_stmt, InvoiceLine.id, batch_size)):
+            last_line_id = rows[-1]["id"]
+            _write_partitioned(pa, pq, rows, schema, os.path.join(out_dir, "invoice_lines"), f"{run_id}-{n}")
+            counts["invoice_lines"] += len(rows)
+
+        if full:
+            # A full snapshot only holds live invoices, so earlier tombstones aren't needed
+            last_deleted_id = session.scalar(select(DeletedInvoice.id).order_by(DeletedInvoice.id.desc()).limit(1)) or 0
+        deleted_stmt = select(*[c for c, _ in DELETED_COLUMNS]).where(DeletedInvoice.id > last_deleted_id)
+        schema = _schema(pa, DELETED_COLUMNS)
+        deleted_dir = os.path.join(out_dir, "deleted_invoices")
+        for n, rows in enumerate(_read_batches(session, deleted_stmt, DeletedInvoice.id, batch_size)):
+            last_deleted_id = rows[-1]["id"]
+            os.makedirs(deleted_dir, exist_ok=True)
+            pq.write_table(pa.Table.from_pylist(rows, schema=schema), os.path.join(deleted_dir, f"{run_id}-{n}.parquet"))
+            counts["deleted_invoices"] += len(rows)
+
+        counts["customers"] = _write_table(pa, pq, session, CUSTOMER_COLUMNS, os.path.join(out_dir, "customers.parquet"), batch_size)
+        counts["properties"] = _write_table(pa, pq, session, PROPERTY_COLUMNS, os.path.join(out_dir, "properties.parquet"), batch_size)
+    finally:
+        session.close()
+
+    # Only advance the watermarks once everything above was written
+    with open(watermark_path, "w") as f:
+        json.dump({"invoice_id": last_invoice_id, "updated_at": started.isoformat(), "invoice_line_id": last_line_id,
+                   "deleted_invoice_id": last_deleted_id}, f)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write billing data to partitioned Parquet files for analytics.")
+    parser.add_argument("--out", default="analytics", help="Output directory (default: analytics)")
+    parser.add_argument("--full", action="store_true", help="Discard the existing snapshot and rewrite everything")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    try:
+        counts = write_snapshot(args.out, full=args.full, batch_size=args.batch_size)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(", ".join(f"{name}: {count}" for name, count in counts.items()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
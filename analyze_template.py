@@ -1,5 +1,5 @@
 import os
-from docx import Document
+from docx_text import iter_text
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "invoice_templates")
@@ -11,20 +11,24 @@ def analyze_docx():
         print(f"File not found: {path}")
         return
 
-    doc = Document(path)
+    blocks = list(iter_text(path))
     
     print(f"--- Analyzing {SAMPLE_FILE} ---")
     print("PARAGRAPHS:")
-    for i, p in enumerate(doc.paragraphs):
-        if p.text.strip():
-            print(f"{i}: {p.text}")
+    for block in blocks:
+        if block.kind == "paragraph" and block.text.strip():
+            print(f"{block.position}: {block.text}")
             
     print("\nTABLES:")
-    for i, table in enumerate(doc.tables):
-        print(f"Table {i}:")
-        for row in table.rows:
-            row_text = [cell.text.strip() for cell in row.cells]
-            print(f"  {row_text}")
+    rows = {}
+    for block in blocks:
+        if block.kind == "cell":
+            table, row, _ = block.position
+            rows.setdefault((table, row), []).append(block.text.strip())
+    for (table, row), row_text in rows.items():
+        if row == 0:
+            print(f"Table {table}:")
+        print(f"  {row_text}")
 
 if __name__ == "__main__":
     analyze_docx()
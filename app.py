@@ -1,14 +1,25 @@
 from datetime import date, timedelta
-from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, send_file, jsonify, flash, Response, stream_with_context
 from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
+import io
 import os
 import sys
+import tempfile
 import traceback
+import zipfile
 from models import init_db, SessionLocal, Customer, Invoice, FeeType, Settings
+from reports import invoice_totals, customer_totals, period_revenue, fee_type_revenue, adjust_receivables, receivables_aging, unpaid_by_period
+from analytics_snapshot import record_invoice_deletions
 
 app = Flask(__name__)
 app.secret_key = "supersecretkey"
-from invoice_generator import generate_invoice_for_customer, get_invoice_templates, generate_invoice_with_template, generate_invoice_buffer, get_period_label
+
+from profiling import init_profiling
+# No-op unless INVOICE_PROFILING is set
+init_profiling(app)
+from invoice_generator import generate_invoice_for_customer, get_invoice_templates, generate_invoice_with_template, generate_invoice_archive, generate_merged_documents, write_invoices_pdf, invoices_for_period, invoice_snapshot, invoice_snapshots, invoice_preview, render_key, stored_invoice, store_invoice_documents, manual_invoice_snapshot, get_period_label, get_period_dates
 
 @app.context_processor
 def inject_settings():
@@ -21,6 +32,21 @@ def inject_settings():
     finally:
         session.close()
 
+def invoice_form_fees(form, customer):
+    """Extra fees from the Generate Invoice form, falling back to the customer's defaults where left blank."""
+    def amount(field, default):
+        value = form.get(field)
+        return float(value) if value else default
+
+    return {
+        "fee_2_type": form.get("fee_2_type") or customer.fee_2_type,
+        "fee_2_amount": amount("fee_2_amount", customer.fee_2_rate),
+        "fee_3_type": form.get("fee_3_type") or customer.fee_3_type,
+        "fee_3_amount": amount("fee_3_amount", customer.fee_3_rate),
+        "additional_fee_desc": form.get("additional_fee_desc") or customer.additional_fee_desc,
+        "additional_fee_amount": amount("additional_fee_amount", customer.additional_fee_amount),
+    }
+
 # Initialize DB (safe to run multiple times)
 @app.route("/generate-invoice", methods=["GET", "POST"])
 def generate_invoice():
@@ -38,60 +64,76 @@ def generate_invoice():
             customer = session.query(Customer).get(customer_id)
             
             invoice_date = date.fromisoformat(request.form["invoice_date"])
-            template_name = request.form["template_name"]
-            
-            # Extract fees, falling back to customer defaults if not provided in form
-            fee_2_type = request.form.get("fee_2_type") or customer.fee_2_type
-            
-            fee_2_amount_str = request.form.get("fee_2_amount")
-            if fee_2_amount_str:
-                fee_2_amount = float(fee_2_amount_str)
-            else:
-                fee_2_amount = customer.fee_2_rate
-            
-            fee_3_type = request.form.get("fee_3_type") or customer.fee_3_type
-            
-            fee_3_amount_str = request.form.get("fee_3_amount")
-            if fee_3_amount_str:
-                fee_3_amount = float(fee_3_amount_str)
-            else:
-                fee_3_amount = customer.fee_3_rate
-            
-            additional_fee_desc = request.form.get("additional_fee_desc") or customer.additional_fee_desc
-            
-            additional_fee_amount_str = request.form.get("additional_fee_amount")
-            if additional_fee_amount_str:
-                additional_fee_amount = float(additional_fee_amount_str)
-            else:
-                additional_fee_amount = customer.additional_fee_amount
-            
-            print(f"DEBUG: Final Fees: Fee2={fee_2_type}/${fee_2_amount}, Fee3={fee_3_type}/${fee_3_amount}")
+            template_name = request.form.get("template_name")
+            fees = invoice_form_fees(request.form, customer)
+            print(f"DEBUG: Final Fees: Fee2={fees['fee_2_type']}/${fees['fee_2_amount']}, Fee3={fees['fee_3_type']}/${fees['fee_3_amount']}")
 
             # Pass extra fees as kwargs
-            invoice = generate_invoice_with_template(
-                customer, 
-                invoice_date, 
-                template_name,
-                fee_2_type=fee_2_type,
-                fee_2_amount=fee_2_amount,
-                fee_3_type=fee_3_type,
-                fee_3_amount=fee_3_amount,
-                additional_fee_desc=additional_fee_desc,
-                additional_fee_amount=additional_fee_amount
-            )
+            invoice = generate_invoice_with_template(customer, invoice_date, template_name, **fees)
             return redirect(url_for("list_invoices"))
         return render_template("generate_invoice.html", customers=customers, templates=templates, fee_types=fee_types, date=date)
     finally:
         session.close()
 
+@app.route("/generate-invoice/preview", methods=["POST"])
+def preview_generated_invoice():
+    """Live preview for the Generate Invoice form: the invoice's lines and total as HTML, no document rendered."""
+    session = SessionLocal()
+    try:
+        customer = (
+            session.query(Customer)
+            .options(selectinload(Customer.properties), selectinload(Customer.recurring_fees))
+            .get(request.form.get("customer_id", type=int))
+        )
+        if not customer:
+            return "Customer not found", 404
+        try:
+            invoice_date = date.fromisoformat(request.form["invoice_date"])
+            fees = invoice_form_fees(request.form, customer)
+        except (KeyError, ValueError) as e:
+            return f"Invalid input: {e}", 400
+        settings = session.query(Settings).first()
+        snapshot = manual_invoice_snapshot(customer, invoice_date, request.form.get("template_name"),
+                                           settings.default_template_name if settings else None, **fees)
+        return render_template("invoice_preview_body.html", preview=invoice_preview(snapshot))
+    finally:
+        session.close()
+
 def bill_due_customers():
     """Run once a day: generate invoices for customers whose next_bill_date is today or in the past."""
     session = SessionLocal()
     try:
         today = date.today()
         # Catch up on any missed invoices
-        customers = session.query(Customer).filter(Customer.next_bill_date <= today).all()
+        customers = (
+            session.query(Customer)
+            .options(selectinload(Customer.properties), selectinload(Customer.recurring_fees))
+            .filter(Customer.next_bill_date <= today)
+            .all()
+        )
+        if not customers:
+            return
+
+        settings = session.query(Settings).first()
+        sender_name = settings.sender_name if settings else "Property Manager"
+        default_template = settings.default_template_name if settings else None
+
+        # Load the periods already invoiced for these customers up front so the
+        # duplicate check below doesn't run one query per customer per period.
+        # Only periods ending on/after the earliest due date can collide; rows from
+        # before the period columns existed are matched by label instead.
+        earliest_due = min(c.next_bill_date for c in customers)
+        invoiced_periods = set()
+        existing = session.query(Invoice.customer_id, Invoice.period_label, Invoice.period_start).filter(
+            Invoice.customer_id.in_([c.id for c in customers]),
+            or_(Invoice.period_end >= earliest_due, Invoice.period_end.is_(None))
+        )
+        for customer_id, period_label, period_start in existing:
+            invoiced_periods.add((customer_id, period_label))
+            if period_start:
+                invoiced_periods.add((customer_id, period_start))
         
+        new_invoices = []
         for c in customers:
             # Process all due periods until next_bill_date is in the future
             # Limit iterations to prevent infinite loops in case of logic error
@@ -103,14 +145,15 @@ def bill_due_customers():
                 
                 # Check if invoice already exists for this period
                 period_label = get_period_label(c.next_bill_date, c.cadence)
-                existing_invoice = session.query(Invoice).filter(
-                    Invoice.customer_id == c.id,
-                    Invoice.period_label == period_label
-                ).first()
+                period_start, _ = get_period_dates(c.next_bill_date, c.cadence)
                 
-                if not existing_invoice:
+                if (c.id, period_label) not in invoiced_periods and (c.id, period_start) not in invoiced_periods:
                     print(f"Generating invoice for {c.name} - {period_label}")
-                    generate_invoice_for_customer(c, c.next_bill_date)
+                    # Invoices are added to this session and written in one flush on commit
+                    new_invoices.append(generate_invoice_for_customer(c, c.next_bill_date, session=session, sender_name=sender_name,
+                                                                      default_template=default_template))
+                    invoiced_periods.add((c.id, period_label))
+                    invoiced_periods.add((c.id, period_start))
                 else:
                     print(f"Skipping {c.name} - {period_label} (Invoice already exists)")
 
@@ -142,7 +185,11 @@ def bill_due_customers():
                     c.next_bill_date = c.next_bill_date.replace(year=c.next_bill_date.year + 1)
 
             session.add(c)
+        adjust_receivables(session, new_invoices, 1)
+        # Read before the commit expires them; the documents are stored once billing is saved
+        render_snapshots = [inv.render_snapshot for inv in new_invoices]
         session.commit()
+        store_invoice_documents(render_snapshots)
     finally:
         session.close()
 
@@ -155,7 +202,7 @@ def list_customers():
     session = SessionLocal()
     try:
         customers = session.query(Customer).all()
-        return render_template("customers.html", customers=customers)
+        return render_template("customers.html", customers=customers, totals=customer_totals(session))
     except Exception as e:
         with open("debug.log", "a") as f:
             import traceback
@@ -237,6 +284,30 @@ def new_customer():
     finally:
         session.close()
 
+@app.route("/customers/import", methods=["GET", "POST"])
+def import_customers_route():
+    import io
+    from customer_import import import_customers, summarize
+    if request.method == "GET":
+        return render_template("customer_import.html", report=None)
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Choose a customers CSV to upload.", "error")
+        return redirect(url_for("import_customers_route"))
+
+    dry_run = bool(request.form.get("dry_run"))
+    session = SessionLocal()
+    try:
+        report = import_customers(session, io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline=""), dry_run=dry_run)
+    except Exception as e:
+        session.rollback()
+        flash(f"Error importing customers: {e}", "error")
+        return redirect(url_for("import_customers_route"))
+    finally:
+        session.close()
+    return render_template("customer_import.html", report=report, counts=summarize(report), dry_run=dry_run)
+
 @app.route("/customers/<int:customer_id>/edit", methods=["GET", "POST"])
 def edit_customer(customer_id):
     session = SessionLocal()
@@ -272,12 +343,14 @@ def edit_customer(customer_id):
             customer.additional_fee_desc = request.form.get("additional_fee_desc", "")
             additional_fee_amount_str = request.form.get("additional_fee_amount", "")
             customer.additional_fee_amount = float(additional_fee_amount_str) if additional_fee_amount_str else None
+            customer.template_name = request.form.get("template_name") or None
             
             session.commit()
             return redirect(url_for("list_customers"))
         
         
-        return render_template("edit_customer.html", customer=customer, fee_types=fee_types)
+        return render_template("edit_customer.html", customer=customer, fee_types=fee_types,
+                               templates=get_invoice_templates())
     finally:
         session.close()
 
@@ -320,6 +393,39 @@ def delete_property(customer_id, property_id):
     finally:
         session.close()
 
+@app.route("/customers/<int:customer_id>/add-fee", methods=["POST"])
+def add_recurring_fee(customer_id):
+    from models import CustomerRecurringFee
+    session = SessionLocal()
+    try:
+        amount_str = request.form.get("amount")
+        if amount_str:
+            position = session.query(CustomerRecurringFee).filter_by(customer_id=customer_id).count()
+            session.add(CustomerRecurringFee(
+                customer_id=customer_id,
+                position=position,
+                fee_type=request.form.get("fee_type") or "Fee",
+                description=request.form.get("description") or None,
+                amount=float(amount_str)
+            ))
+            session.commit()
+        return redirect(url_for("edit_customer", customer_id=customer_id))
+    finally:
+        session.close()
+
+@app.route("/customers/<int:customer_id>/delete-fee/<int:fee_id>", methods=["POST"])
+def delete_recurring_fee(customer_id, fee_id):
+    from models import CustomerRecurringFee
+    session = SessionLocal()
+    try:
+        fee = session.query(CustomerRecurringFee).get(fee_id)
+        if fee and fee.customer_id == customer_id:
+            session.delete(fee)
+            session.commit()
+        return redirect(url_for("edit_customer", customer_id=customer_id))
+    finally:
+        session.close()
+
 @app.route("/customers/<int:customer_id>/delete", methods=["POST"])
 def delete_customer(customer_id):
     session = SessionLocal()
@@ -389,17 +495,136 @@ def settings():
     finally:
         session.close()
 
+@app.route("/templates", methods=["GET", "POST"])
+def manage_templates():
+    """List invoice templates with their compiled manifests; POST uploads and compiles a new one."""
+    from werkzeug.utils import secure_filename
+    from template_registry import save_template, template_manifests
+    uploaded = None
+    error = None
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            error = "Choose a .docx template to upload."
+        else:
+            uploaded = secure_filename(upload.filename)
+            try:
+                save_template(uploaded, upload.read())
+            except ValueError as e:
+                error = f"{uploaded} was rejected: {e}"
+            except OSError as e:
+                error = f"Could not save {uploaded}: {e}"
+
+    return render_template("invoice_templates.html", templates=get_invoice_templates(), manifests=template_manifests(),
+                           uploaded=uploaded, error=error)
+
 @app.route("/invoices")
 def list_invoices():
     session = SessionLocal()
     try:
+        # Optional billing-period filter: keep invoices whose period overlaps the range
+        filters = []
+        period_from = request.args.get("period_from")
+        period_to = request.args.get("period_to")
+        try:
+            if period_from:
+                filters.append(Invoice.period_end >= date.fromisoformat(period_from))
+            if period_to:
+                filters.append(Invoice.period_start <= date.fromisoformat(period_to))
+        except ValueError as e:
+            return f"Invalid period: {e}", 400
+        
         # Sort by Customer Name then Invoice Date
         # Use OUTER JOIN so we still see invoices even if the customer is deleted
-        invoices = session.query(Invoice).outerjoin(Customer, Invoice.customer_id == Customer.id).order_by(Customer.name.asc(), Invoice.invoice_date.desc()).all()
+        invoices = (
+            session.query(Invoice)
+            .outerjoin(Customer, Invoice.customer_id == Customer.id)
+            .filter(*filters)
+            .order_by(Customer.name.asc(), Invoice.invoice_date.desc())
+            .all()
+        )
+        totals = invoice_totals(session, *filters)
         
         # For simplicity, join customers manually (or use the join above)
         customers_map = {c.id: c for c in session.query(Customer).all()}
-        return render_template("invoices.html", invoices=invoices, customers=customers_map)
+        return render_template("invoices.html", invoices=invoices, customers=customers_map, totals=totals,
+                               period_from=period_from or "", period_to=period_to or "")
+    finally:
+        session.close()
+
+MIMETYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+}
+# Print-run PDFs up to this size are built in memory, larger ones in a temporary file
+PRINT_SPOOL_SIZE = 8 * 1024 * 1024
+
+def send_merged_documents(documents):
+    """One merged .docx as is; several (one per template) zipped together."""
+    if not documents:
+        return "No invoices to print", 404
+    if len(documents) == 1:
+        filename, buffer = documents[0]
+        return send_file(buffer, as_attachment=True, download_name=filename,
+                         mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        for filename, buffer in documents:
+            zf.writestr(filename, buffer.getvalue())
+    archive.seek(0)
+    return send_file(archive, as_attachment=True, download_name="invoices_print.zip", mimetype="application/zip")
+
+@app.route("/invoices/print")
+def print_invoices():
+    """Every invoice of a billing period in one print-ready .docx, for mailing runs."""
+    session = SessionLocal()
+    try:
+        period_from = request.args.get("period_from")
+        period_to = request.args.get("period_to")
+        try:
+            period_from = date.fromisoformat(period_from) if period_from else None
+            period_to = date.fromisoformat(period_to) if period_to else None
+        except ValueError as e:
+            return f"Invalid period: {e}", 400
+        invoices = invoices_for_period(session, period_from, period_to)
+        if not invoices:
+            return "No invoices in this period", 404
+        name = "Invoices" + "".join(f"_{d.isoformat()}" for d in (period_from, period_to) if d)
+        if request.args.get("format") == "pdf":
+            # A whole period's PDF can be large: past PRINT_SPOOL_SIZE it goes to a temporary
+            # file, which send_file streams and closes (deleting it) when the response ends
+            out = tempfile.SpooledTemporaryFile(max_size=PRINT_SPOOL_SIZE)
+            try:
+                write_invoices_pdf(out, invoices)
+                out.seek(0)
+            except Exception:
+                out.close()
+                raise
+            return send_file(out, as_attachment=True, download_name=f"{name}.pdf", mimetype=MIMETYPES["pdf"])
+        return send_merged_documents(generate_merged_documents(invoices, name))
+    except Exception as e:
+        return f"Error generating invoices: {e}", 500
+    finally:
+        session.close()
+
+@app.route("/reports/revenue")
+def revenue_report():
+    session = SessionLocal()
+    try:
+        periods = period_revenue(session)
+        return render_template("revenue.html", periods=periods, totals=invoice_totals(session),
+                               fee_types=fee_type_revenue(session))
+    finally:
+        session.close()
+
+@app.route("/reports/aging")
+def aging_report():
+    session = SessionLocal()
+    try:
+        rows, totals = receivables_aging(session)
+        customers_map = {c.id: c for c in session.query(Customer).filter(Customer.id.in_([r.customer_id for r in rows]))}
+        return render_template("aging.html", rows=rows, totals=totals, customers=customers_map,
+                               periods=unpaid_by_period(session))
     finally:
         session.close()
 
@@ -416,18 +641,104 @@ def download_invoice(invoice_id):
         if not invoice:
             return "Invoice not found", 404
         
-        filename, buffer = generate_invoice_buffer(invoice)
-        return send_file(
-            buffer,
-            as_attachment=True,
-            download_name=filename,
-            mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        )
+        fmt = request.args.get("format", "docx")
+        if fmt not in MIMETYPES:
+            return f"Unknown format {fmt}", 404
+        # Rendering is deterministic, so the render inputs identify the file: a browser
+        # that already has it gets a 304 before anything is rendered
+        snapshot = invoice_snapshot(invoice)
+        etag = render_key(snapshot, fmt)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            filename, buffer = stored_invoice(snapshot, etag, fmt)
+            response = send_file(
+                buffer,
+                as_attachment=True,
+                download_name=filename,
+                mimetype=MIMETYPES[fmt],
+                etag=etag
+            )
+        response.set_etag(etag)
+        # Invoices aren't shared, and browsers should revalidate rather than reuse them blindly
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
     except Exception as e:
         return f"Error generating invoice: {e}", 500
     finally:
         session.close()
 
+@app.route("/invoices/<int:invoice_id>/preview")
+def preview_invoice(invoice_id):
+    """The invoice's lines and total as a web page, from its render snapshot; no document is rendered."""
+    session = SessionLocal()
+    try:
+        invoice = session.query(Invoice).get(invoice_id)
+        if not invoice:
+            return "Invoice not found", 404
+        snapshot = next((snapshot for _, snapshot in invoice_snapshots([invoice])), None)
+        if snapshot is None:
+            return "Customer not found", 404
+        return render_template("invoice_preview.html", invoice=invoice, preview=invoice_preview(snapshot))
+    finally:
+        session.close()
+
+@app.route("/invoices/reconcile", methods=["GET", "POST"])
+def reconcile_invoices():
+    import io
+    from reconcile import reconcile_payments, write_review_report
+    if request.method == "GET":
+        return render_template("reconcile.html", result=None)
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Choose a payments CSV to upload.", "error")
+        return redirect(url_for("reconcile_invoices"))
+
+    session = SessionLocal()
+    try:
+        # Read the upload as a text stream, row by row
+        lines = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+        matched, unmatched = reconcile_payments(session, lines, dry_run=bool(request.form.get("dry_run")))
+    except Exception as e:
+        session.rollback()
+        flash(f"Error reconciling payments: {e}", "error")
+        return redirect(url_for("reconcile_invoices"))
+    finally:
+        session.close()
+
+    if request.form.get("review_csv") and unmatched:
+        report = io.StringIO()
+        write_review_report(unmatched, report)
+        return send_file(io.BytesIO(report.getvalue().encode("utf-8")), as_attachment=True,
+                         download_name="unmatched_payments.csv", mimetype="text/csv")
+    return render_template("reconcile.html", result={"matched": matched, "unmatched": unmatched,
+                                                     "dry_run": bool(request.form.get("dry_run"))})
+
+@app.route("/export/<kind>")
+def export_data(kind):
+    from exports import EXPORTS, FORMATS, stream_export, export_filename
+    fmt = request.args.get("format", "csv")
+    if kind not in EXPORTS or fmt not in FORMATS:
+        return f"Unknown export {kind}.{fmt}", 404
+    try:
+        filters = {
+            "date_from": date.fromisoformat(request.args["date_from"]) if request.args.get("date_from") else None,
+            "date_to": date.fromisoformat(request.args["date_to"]) if request.args.get("date_to") else None,
+            "status": request.args.get("status") or None,
+            "customer_id": int(request.args["customer_id"]) if request.args.get("customer_id") else None,
+        }
+    except ValueError as e:
+        return f"Invalid filter: {e}", 400
+
+    # Rows are written to the response as they're read, never held in memory together
+    return Response(
+        stream_with_context(stream_export(kind, fmt, **filters)),
+        mimetype=FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={export_filename(kind, fmt)}"},
+    )
+
 @app.route("/seed-data")
 def run_seeding():
     try:
@@ -438,7 +749,8 @@ def run_seeding():
         
         f = io.StringIO()
         with redirect_stdout(f):
-            seed_customers()
+            # Parse in this process: serverless hosts can't start a process pool
+            seed_customers(workers=1)
         
         output = f.getvalue()
         return f"<pre>{output}</pre>"
@@ -447,10 +759,13 @@ def run_seeding():
 
 @app.route('/clear-invoices')
 def clear_invoices_route():
-    from models import Invoice
+    from models import Invoice, InvoiceLine, ReceivableBalance
     session = SessionLocal()
     try:
         count = session.query(Invoice).count()
+        record_invoice_deletions(session)
+        session.query(InvoiceLine).delete()
+        session.query(ReceivableBalance).delete()
         session.query(Invoice).delete()
         session.commit()
         return f'Cleared {count} invoices from the database!', 200
@@ -482,7 +797,12 @@ def run_migration():
                 ("additional_fee_amount", "FLOAT"),
                 ("additional_fee_amount", "FLOAT"),
                 ("status", "VARCHAR"),
-                ("paid_date", "DATE")
+                ("paid_date", "DATE"),
+                ("period_start", "DATE"),
+                ("period_end", "DATE"),
+                ("render_snapshot", "TEXT"),
+                ("total_amount", "FLOAT"),
+                ("updated_at", "TIMESTAMP")
             ]
             
             results = []
@@ -503,7 +823,8 @@ def run_migration():
                 ("fee_3_type", "VARCHAR"),
                 ("fee_3_rate", "FLOAT"),
                 ("additional_fee_desc", "VARCHAR"),
-                ("additional_fee_amount", "FLOAT")
+                ("additional_fee_amount", "FLOAT"),
+                ("template_name", "VARCHAR"),
             ]
             
             for col_name, col_type in customer_columns:
@@ -516,6 +837,23 @@ def run_migration():
                 except Exception as e:
                     results.append(f"Skipped customers.{col_name}: {str(e)}")
             
+            # receivable_balances is derived from invoices (rebuilt by the backfills below), so
+            # a table with the old NULL-unsafe unique constraint is dropped and recreated
+            import warnings
+            from sqlalchemy import inspect
+            from sqlalchemy.exc import SAWarning
+            from models import ReceivableBalance
+            inspector = inspect(conn)
+            with warnings.catch_warnings():
+                # The new key is an expression index, which SQLAlchemy can't reflect (and needn't here)
+                warnings.simplefilter("ignore", SAWarning)
+                old_key = inspector.has_table("receivable_balances") and any(
+                    uc["name"] == "uq_receivable_balances_key" for uc in inspector.get_unique_constraints("receivable_balances"))
+            if old_key:
+                ReceivableBalance.__table__.drop(conn)
+                conn.commit()
+                results.append("Recreated receivable_balances with a NULL-safe key")
+
             # Create properties table
             from models import Base
             Base.metadata.create_all(bind=engine)
@@ -531,10 +869,30 @@ def run_migration():
             except Exception as e:
                 results.append(f"Skipped properties.fee_amount: {str(e)}")
             
+            # Indexes for columns added above (create_all skips tables that already exist)
+            invoice_indexes = [
+                ("ix_invoices_period_start", "period_start"),
+                ("ix_invoices_period_end", "period_end"),
+                ("ix_invoices_customer_period", "customer_id, period_start"),
+                ("ix_invoices_updated_at", "updated_at"),
+            ]
+            for index_name, index_cols in invoice_indexes:
+                try:
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index_name} ON invoices ({index_cols})"))
+                    results.append(f"Ensured index {index_name}")
+                except Exception as e:
+                    results.append(f"Skipped index {index_name}: {str(e)}")
+            
             # Commit all changes
             conn.commit()
+
+        # Populate the new columns for existing rows, in batches
+        from sqlalchemy.orm import Session
+        from backfills import run_backfills
+        with Session(bind=engine) as backfill_session:
+            results.extend(run_backfills(backfill_session))
             
-            return f"Migration results:<br>" + "<br>".join(results)
+        return f"Migration results:<br>" + "<br>".join(results)
     except Exception as e:
         return f"Migration failed: {e}", 500
 
@@ -544,6 +902,9 @@ def delete_invoice(invoice_id):
     try:
         invoice = session.query(Invoice).get(invoice_id)
         if invoice:
+            if invoice.status != "Paid":
+                adjust_receivables(session, [invoice], -1)
+            record_invoice_deletions(session, Invoice.id == invoice.id)
             session.delete(invoice)
             session.commit()
             flash("Invoice deleted successfully.", "success")
@@ -556,6 +917,72 @@ def delete_invoice(invoice_id):
         session.close()
     return redirect(url_for("list_invoices"))
 
+@app.route("/invoices/bulk", methods=["POST"])
+def bulk_invoice_action():
+    from sqlalchemy import update, delete, func
+    from models import InvoiceLine
+    action = request.form.get("action")
+    invoice_ids = request.form.getlist("invoice_ids", type=int)
+    if not invoice_ids:
+        flash("Select at least one invoice.", "error")
+        return redirect(url_for("list_invoices"))
+
+    session = SessionLocal()
+    try:
+        if action in ("regenerate", "regenerate_pdf"):
+            invoices = session.query(Invoice).filter(Invoice.id.in_(invoice_ids)).order_by(Invoice.id).all()
+            archive = generate_invoice_archive(invoices, format="pdf" if action == "regenerate_pdf" else "docx")
+            return send_file(archive, as_attachment=True, download_name="invoices.zip", mimetype="application/zip")
+        if action == "print":
+            invoices = (session.query(Invoice).outerjoin(Customer, Invoice.customer_id == Customer.id)
+                        .filter(Invoice.id.in_(invoice_ids))
+                        .order_by(Customer.name.asc(), Invoice.invoice_date.desc()).all())
+            return send_merged_documents(generate_merged_documents(invoices))
+
+        # Only the invoices whose open/paid state actually changes touch the AR balances
+        is_open = func.coalesce(Invoice.status, "Unpaid") != "Paid"
+        if action == "mark_paid":
+            paid_date_str = request.form.get("paid_date")
+            paid_date = date.fromisoformat(paid_date_str) if paid_date_str else date.today()
+            changed = session.query(Invoice).filter(Invoice.id.in_(invoice_ids), is_open).all()
+            session.execute(
+                update(Invoice)
+                .where(Invoice.id.in_([inv.id for inv in changed]))
+                .values(status="Paid", paid_date=paid_date)
+                .execution_options(synchronize_session=False)
+            )
+            adjust_receivables(session, changed, -1)
+            message = f"Marked {len(changed)} invoices as Paid."
+        elif action == "mark_unpaid":
+            changed = session.query(Invoice).filter(Invoice.id.in_(invoice_ids), ~is_open).all()
+            session.execute(
+                update(Invoice)
+                .where(Invoice.id.in_([inv.id for inv in changed]))
+                .values(status="Unpaid", paid_date=None)
+                .execution_options(synchronize_session=False)
+            )
+            adjust_receivables(session, changed, 1)
+            message = f"Marked {len(changed)} invoices as Unpaid."
+        elif action == "delete":
+            open_invoices = session.query(Invoice).filter(Invoice.id.in_(invoice_ids), is_open).all()
+            adjust_receivables(session, open_invoices, -1)
+            record_invoice_deletions(session, Invoice.id.in_(invoice_ids))
+            session.execute(delete(InvoiceLine).where(InvoiceLine.invoice_id.in_(invoice_ids)))
+            result = session.execute(delete(Invoice).where(Invoice.id.in_(invoice_ids)).execution_options(synchronize_session=False))
+            message = f"Deleted {result.rowcount} invoices."
+        else:
+            flash(f"Unknown action: {action}", "error")
+            return redirect(url_for("list_invoices"))
+
+        session.commit()
+        flash(message, "success")
+    except Exception as e:
+        session.rollback()
+        flash(f"Error updating invoices: {e}", "error")
+    finally:
+        session.close()
+    return redirect(url_for("list_invoices"))
+
 @app.route("/invoices/<int:invoice_id>/toggle-status", methods=["POST"])
 def toggle_invoice_status(invoice_id):
     session = SessionLocal()
@@ -573,7 +1000,9 @@ def toggle_invoice_status(invoice_id):
                     invoice.paid_date = date.today()
             else:
                 invoice.paid_date = None
-                
+            
+            # Paid invoices leave the open balances, re-opened ones go back in
+            adjust_receivables(session, [invoice], -1 if new_status == "Paid" else 1)
             session.commit()
             flash(f"Invoice marked as {new_status}.", "success")
         else:
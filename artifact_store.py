@@ -0,0 +1,189 @@
+"""
+Storage for generated invoice documents.
+
+Documents are stored as blobs keyed by the SHA-256 of their bytes, so identical renders
+are kept once, plus a small ref per render key (see invoice_generator.render_key) naming
+the blob rendered from those inputs. Rendering is deterministic, so a download whose
+render key has a ref streams the stored bytes instead of rendering again, and an edited
+invoice or a new template version gets a new render key and is rendered afresh.
+
+Two backends share the interface: LocalStore, a directory, and S3Store, a bucket on
+S3 or any S3-compatible service (MinIO, R2), which needs boto3 (pip install boto3).
+The store is chosen by environment variables:
+
+    ARTIFACT_STORE=local   ARTIFACT_STORE_DIR=/var/lib/invoices  (default: generated_invoices/store)
+    ARTIFACT_STORE=s3      ARTIFACT_S3_BUCKET=invoices  ARTIFACT_S3_PREFIX=prod/
+                           ARTIFACT_S3_ENDPOINT=http://localhost:9000  (MinIO etc.)
+    ARTIFACT_STORE=none    store nothing; every download renders
+
+On a read-only filesystem (Vercel, Lambda) the local store falls back to /tmp, which
+lasts only as long as the instance; if that can't be written either, nothing is stored.
+"""
+import hashlib
+import io
+import os
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DIR = os.path.join(BASE_DIR, "generated_invoices", "store")
+FALLBACK_DIR = os.path.join("/tmp", "invoice_store")
+
+def content_key(data):
+    """The key a document is stored under: the SHA-256 of its bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+class ArtifactStore:
+    """
+    Content-addressed document blobs plus named refs to them. Backends implement
+    _exists(path), _read(path) (bytes, or None if absent) and _write(path, data).
+    """
+
+    def put(self, data):
+        """Store a document unless one with the same bytes already is. Returns its key."""
+        key = content_key(data)
+        path = self._blob_path(key)
+        if not self._exists(path):
+            self._write(path, data)
+        return key
+
+    def open(self, key):
+        """The stored document `key` as a binary file object, or None if it isn't stored."""
+        data = self._read(self._blob_path(key))
+        return io.BytesIO(data) if data is not None else None
+
+    def get_ref(self, name):
+        """The key the ref `name` points to, or None."""
+        data = self._read(f"refs/{name}")
+        return data.decode("ascii") if data else None
+
+    def set_ref(self, name, key):
+        self._write(f"refs/{name}", key.encode("ascii"))
+
+    def _blob_path(self, key):
+        return f"blobs/{key[:2]}/{key}"
+
+class LocalStore(ArtifactStore):
+    """Documents under a local directory. Writes go through a temporary file, so readers never see part of one."""
+
+    def __init__(self, root=DEFAULT_DIR):
+        self.root = root
+
+    def _path(self, path):
+        return os.path.join(self.root, *path.split("/"))
+
+    def _exists(self, path):
+        return os.path.exists(self._path(path))
+
+    def _read(self, path):
+        try:
+            with open(self._path(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, data):
+        path = self._path(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def open(self, key):
+        # Streamed from disk rather than read into memory
+        try:
+            return open(self._path(self._blob_path(key)), "rb")
+        except FileNotFoundError:
+            return None
+
+def _require_boto3():
+    try:
+        import boto3
+        import botocore.exceptions
+    except ImportError:
+        raise RuntimeError("The S3 artifact store needs boto3: pip install boto3")
+    return boto3, botocore.exceptions
+
+class S3Store(ArtifactStore):
+    """Documents in an S3 bucket under `prefix`. endpoint_url points it at MinIO or another S3-compatible service."""
+
+    def __init__(self, bucket, prefix="", client=None, endpoint_url=None):
+        boto3, self._errors = _require_boto3()
+        self.bucket = bucket
+        self.prefix = prefix
+        # boto3 clients are thread-safe, so one is shared by parallel batch writes
+        self.client = client or boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _exists(self, path):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + path)
+        except self._errors.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def _read(self, path):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + path)
+        except self._errors.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def _write(self, path, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + path, Body=data)
+
+def _local_store(root):
+    """A LocalStore at root, else at FALLBACK_DIR if root can't be written, else None."""
+    for path in (root, FALLBACK_DIR):
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(path, os.W_OK):
+            if path != root:
+                print(f"Artifact store directory {root} is not writable, using {path}")
+            return LocalStore(path)
+    print("No writable artifact store directory; invoices will be rendered on every download")
+    return None
+
+def _configured_store():
+    kind = os.getenv("ARTIFACT_STORE", "local")
+    if kind == "s3":
+        return S3Store(os.environ["ARTIFACT_S3_BUCKET"], os.getenv("ARTIFACT_S3_PREFIX", ""),
+                       endpoint_url=os.getenv("ARTIFACT_S3_ENDPOINT"))
+    if kind == "local":
+        return _local_store(os.getenv("ARTIFACT_STORE_DIR", DEFAULT_DIR))
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown ARTIFACT_STORE: {kind}")
+
+_lock = threading.Lock()
+_store = None
+_configured = False
+
+def get_store():
+    """
+    The configured artifact store (see the module docstring), or None if storing is turned
+    off or misconfigured (a missing bucket, boto3 not installed); the error is logged once.
+    """
+    global _store, _configured
+    with _lock:
+        if not _configured:
+            try:
+                _store = _configured_store()
+            except (KeyError, ValueError, RuntimeError) as e:
+                # Storage is an optimization: a bad setting must not break billing or downloads
+                print(f"Artifact store misconfigured ({type(e).__name__}: {e}); invoices will be rendered on every download")
+                _store = None
+            _configured = True
+        return _store
+
+def set_store(store):
+    """Use `store` (or None for no storage) instead of the configured one."""
+    global _store, _configured
+    with _lock:
+        _store = store
+        _configured = True
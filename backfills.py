@@ -0,0 +1,189 @@
+"""
+Batched data backfills for columns added after invoices already existed.
+
+Each backfill walks the invoices table in primary-key order, BATCH_SIZE rows at a time,
+and commits per batch so it can be interrupted and re-run safely on a live database.
+
+    python backfills.py
+"""
+import json
+from sqlalchemy import select, update, insert
+from sqlalchemy.orm import selectinload
+from models import SessionLocal, Invoice, InvoiceLine, Customer
+from invoice_generator import parse_period_label, build_legacy_snapshot, compute_invoice_total, fee_lines, snapshot_lines
+from reports import rebuild_receivables
+
+BATCH_SIZE = 500
+
+def backfill_invoice_periods(session, batch_size=BATCH_SIZE):
+    """
+    Fill period_start/period_end by parsing period_label. Labels that don't parse
+    (hand-typed legacy values) are left NULL. Returns (updated, unparsed).
+    """
+    updated = 0
+    unparsed = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(Invoice.id, Invoice.period_label)
+            .where(Invoice.period_start.is_(None), Invoice.id > last_id)
+            .order_by(Invoice.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        changes = []
+        for row in rows:
+            period = parse_period_label(row.period_label)
+            if period is None:
+                unparsed += 1
+                continue
+            changes.append({"id": row.id, "period_start": period[0], "period_end": period[1]})
+
+        if changes:
+            session.execute(update(Invoice), changes)
+        session.commit()
+        updated += len(changes)
+    return updated, unparsed
+
+def backfill_render_snapshots(session, batch_size=BATCH_SIZE):
+    """
+    Store a render snapshot on invoices created before snapshots existed, built from
+    their saved fees and period and the customer's current details. Invoices whose
+    customer was deleted are skipped. Returns (updated, skipped).
+    """
+    updated = 0
+    skipped = 0
+    last_id = 0
+    while True:
+        invoices = session.scalars(
+            select(Invoice)
+            .where(Invoice.render_snapshot.is_(None), Invoice.id > last_id)
+            .order_by(Invoice.id)
+            .limit(batch_size)
+        ).all()
+        if not invoices:
+            break
+        last_id = invoices[-1].id
+
+        # One query for the batch's customers and their properties
+        customer_ids = {inv.customer_id for inv in invoices}
+        customers = {
+            c.id: c for c in session.scalars(
+                select(Customer).options(selectinload(Customer.properties)).where(Customer.id.in_(customer_ids))
+            )
+        }
+
+        changes = []
+        for inv in invoices:
+            customer = customers.get(inv.customer_id)
+            if customer is None:
+                skipped += 1
+                continue
+            changes.append({"id": inv.id, "render_snapshot": json.dumps(build_legacy_snapshot(inv, customer))})
+
+        # Drop the loaded objects so the bulk UPDATE below doesn't fight the identity map
+        session.expunge_all()
+        if changes:
+            session.execute(update(Invoice), changes)
+        session.commit()
+        updated += len(changes)
+    return updated, skipped
+
+def backfill_invoice_totals(session, batch_size=BATCH_SIZE):
+    """
+    Fill total_amount from the render snapshot, or from the stored fee columns for
+    invoices without one (their property fees are unknown). Returns the number updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(
+                Invoice.id, Invoice.render_snapshot, Invoice.amount,
+                Invoice.fee_2_amount, Invoice.fee_3_amount, Invoice.additional_fee_amount,
+            )
+            .where(Invoice.total_amount.is_(None), Invoice.id > last_id)
+            .order_by(Invoice.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        changes = []
+        for row in rows:
+            if row.render_snapshot:
+                total = compute_invoice_total(json.loads(row.render_snapshot))
+            else:
+                total = row.amount + (row.fee_2_amount or 0) + (row.fee_3_amount or 0) + (row.additional_fee_amount or 0)
+            changes.append({"id": row.id, "total_amount": total})
+
+        session.execute(update(Invoice), changes)
+        session.commit()
+        updated += len(changes)
+    return updated
+
+def backfill_invoice_lines(session, batch_size=BATCH_SIZE):
+    """
+    Write InvoiceLine rows for invoices that have none, from the render snapshot, or
+    from the stored fee columns for invoices without one. Returns the number of invoices filled.
+    """
+    has_lines = select(InvoiceLine.id).where(InvoiceLine.invoice_id == Invoice.id).exists()
+    updated = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            select(
+                Invoice.id, Invoice.render_snapshot, Invoice.amount,
+                Invoice.fee_2_type, Invoice.fee_2_amount, Invoice.fee_3_type, Invoice.fee_3_amount,
+                Invoice.additional_fee_desc, Invoice.additional_fee_amount,
+            )
+            .where(~has_lines, Invoice.id > last_id)
+            .order_by(Invoice.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        line_rows = []
+        for row in rows:
+            if row.render_snapshot:
+                lines = snapshot_lines(json.loads(row.render_snapshot))
+            else:
+                lines = fee_lines(
+                    "Management Fee", row.amount,
+                    row.fee_2_type, row.fee_2_amount,
+                    row.fee_3_type, row.fee_3_amount,
+                    row.additional_fee_desc, row.additional_fee_amount,
+                )
+            line_rows.extend({"invoice_id": row.id, "position": i, **line} for i, line in enumerate(lines))
+
+        session.execute(insert(InvoiceLine), line_rows)
+        session.commit()
+        updated += len(rows)
+    return updated
+
+def run_backfills(session):
+    """Run every backfill and return human-readable result lines."""
+    updated, unparsed = backfill_invoice_periods(session)
+    results = [f"Backfilled invoice periods: {updated} updated, {unparsed} unparseable labels left empty"]
+    updated, skipped = backfill_render_snapshots(session)
+    results.append(f"Backfilled render snapshots: {updated} updated, {skipped} skipped (customer deleted)")
+    # Runs after the snapshot backfill so totals include property fees wherever possible
+    results.append(f"Backfilled invoice totals: {backfill_invoice_totals(session)} updated")
+    results.append(f"Backfilled invoice lines: {backfill_invoice_lines(session)} invoices")
+    # Totals may have changed above, so recompute the open balances from scratch
+    results.append(f"Rebuilt receivable balances: {rebuild_receivables(session)} rows")
+    return results
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        for line in run_backfills(session):
+            print(line)
+    finally:
+        session.close()
@@ -0,0 +1,244 @@
+"""
+Performance benchmarks for the invoice hot paths.
+
+Builds a synthetic SQLite portfolio per size, then times template rendering, the daily
+batch, invoice downloads and the list pages. Results are written to a JSON file so two
+runs can be compared:
+
+    python benchmark.py run --sizes 1000,10000,100000 --output bench_results.json
+    python benchmark.py compare baseline.json bench_results.json --threshold 0.15
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import selectinload
+
+import models
+from models import SessionLocal, Customer, Invoice
+from synthetic_data import build_dataset
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+def _stats(samples):
+    """Summarise a list of durations (seconds) in milliseconds."""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "samples": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "ops_per_sec": round(len(ordered) / total, 2) if total else None,
+    }
+
+def _time_each(fn, args_list):
+    samples = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def _sample_replacements(customer):
+    return {
+        "{{CUSTOMER_NAME}}": customer.name,
+        "{{CUSTOMER_EMAIL}}": customer.email,
+        "{{PROPERTY_ADDRESS}}": customer.property_address,
+        "{{PROPERTY_CITY}}": customer.property_city or "",
+        "{{PROPERTY_STATE}}": customer.property_state or "",
+        "{{PROPERTY_ZIP}}": customer.property_zip or "",
+        "{{PERIOD}}": "October 2025",
+        "{{PERIOD_DATES}}": "10/01/2025 - 10/31/2025",
+        "{{AMOUNT}}": f"${customer.rate:,.2f}",
+        "{{INVOICE_DATE}}": "10/01/2025",
+        "{{FEE_TYPE}}": customer.fee_type or "Management Fee",
+        "{{TOTAL_AMOUNT}}": f"${customer.rate:,.2f}",
+        "{{FEE_LINE_2}}": "",
+        "{{FEE_LINE_3}}": "",
+        "{{ADDITIONAL_FEE_LINE}}": "",
+    }
+
+def run_size(size, db_dir, iterations, page_iterations, due_customers, properties, invoices):
+    from app import app, bill_due_customers
+    from invoice_generator import (
+        _generate_invoice_logic, fill_invoice_template, generate_invoice_buffer,
+        get_period_dates, get_period_label,
+    )
+    from template_registry import DEFAULT_TEMPLATE, get_template
+
+    db_path = os.path.join(db_dir, f"bench_{size}.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    engine = create_engine(f"sqlite:///{db_path}")
+
+    start = time.perf_counter()
+    counts = build_dataset(
+        engine, size,
+        properties_per_customer=properties,
+        invoices_per_customer=invoices,
+        due_customers=due_customers,
+    )
+    build_seconds = time.perf_counter() - start
+    print(f"[{size}] built dataset {counts} in {build_seconds:.1f}s")
+
+    SessionLocal.configure(bind=engine)
+    results = {"dataset": counts, "build_seconds": round(build_seconds, 2)}
+    try:
+        session = SessionLocal()
+        customers = (
+            session.query(Customer)
+            .options(selectinload(Customer.properties), selectinload(Customer.recurring_fees))
+            .order_by(Customer.id)
+            .limit(iterations)
+            .all()
+        )
+        invoices_sample = session.query(Invoice).order_by(Invoice.id.desc()).limit(iterations).all()
+        session.close()
+
+        invoice_date = date.today().replace(day=1)
+        logic_args = []
+        for i in range(iterations):
+            c = customers[i % len(customers)]
+            start_date, end_date = get_period_dates(invoice_date, c.cadence)
+            period_dates = f"{start_date.strftime('%m/%d/%Y')} - {end_date.strftime('%m/%d/%Y')}"
+            logic_args.append((c, invoice_date, get_period_label(invoice_date, c.cadence), period_dates, c.rate))
+        results["generate_invoice_logic"] = _stats(_time_each(_generate_invoice_logic, logic_args))
+        print(f"[{size}] _generate_invoice_logic: {results['generate_invoice_logic']}")
+
+        # Filling and writing a compiled template, as every render does; loading the
+        # template is cached, so it's done up front
+        template = get_template(DEFAULT_TEMPLATE)
+        def fill_and_save(replacements):
+            doc = template.new_document()
+            fill_invoice_template(doc, replacements)
+            doc.save(io.BytesIO())
+        fill_args = [(_sample_replacements(customers[i % len(customers)]),) for i in range(iterations)]
+        results["fill_template"] = _stats(_time_each(fill_and_save, fill_args))
+        print(f"[{size}] fill_template: {results['fill_template']}")
+
+        results["generate_invoice_buffer"] = _stats(
+            _time_each(generate_invoice_buffer, [(inv,) for inv in invoices_sample])
+        )
+        print(f"[{size}] generate_invoice_buffer: {results['generate_invoice_buffer']}")
+
+        try:
+            batch = _stats(_time_each(bill_due_customers, [()]))
+        except Exception as e:
+            # Keep the rest of the run; a failing batch is itself a result worth recording
+            batch = {"error": str(e).splitlines()[0]}
+        batch["due_customers"] = counts["due_customers"]
+        results["bill_due_customers"] = batch
+        print(f"[{size}] bill_due_customers: {batch}")
+
+        client = app.test_client()
+        for name, path in (("page_invoices", "/invoices"), ("page_customers", "/customers")):
+            def fetch(path=path):
+                response = client.get(path)
+                if response.status_code != 200:
+                    raise RuntimeError(f"GET {path} returned {response.status_code}")
+            results[name] = _stats(_time_each(fetch, [()] * page_iterations))
+            print(f"[{size}] GET {path}: {results[name]}")
+    finally:
+        SessionLocal.configure(bind=models.engine)
+        engine.dispose()
+
+    return results
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(",")] if args.sizes else DEFAULT_SIZES
+    db_dir = args.db_dir or tempfile.mkdtemp(prefix="invoice_bench_")
+    os.makedirs(db_dir, exist_ok=True)
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "page_iterations": args.page_iterations,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        report["results"][str(size)] = run_size(
+            size, db_dir, args.iterations, args.page_iterations, args.due, args.properties, args.invoices
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    return 0
+
+def compare_reports(baseline, current, threshold):
+    """
+    Compare the mean latency of every metric present in both reports.
+    Returns a list of (size, metric, old_ms, new_ms, change, regressed) tuples.
+    """
+    rows = []
+    for size, old_metrics in baseline.get("results", {}).items():
+        new_metrics = current.get("results", {}).get(size)
+        if not new_metrics:
+            continue
+        for metric, old in old_metrics.items():
+            new = new_metrics.get(metric)
+            if not isinstance(old, dict) or not isinstance(new, dict) or "mean_ms" not in old or "mean_ms" not in new:
+                continue
+            change = (new["mean_ms"] - old["mean_ms"]) / old["mean_ms"] if old["mean_ms"] else 0.0
+            rows.append((size, metric, old["mean_ms"], new["mean_ms"], change, change > threshold))
+    return rows
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare_reports(baseline, current, args.threshold)
+    regressions = 0
+    print(f"{'size':>8}  {'metric':<26} {'old ms':>10} {'new ms':>10} {'change':>8}")
+    for size, metric, old_ms, new_ms, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{size:>8}  {metric:<26} {old_ms:>10.2f} {new_ms:>10.2f} {change:>+8.1%}{flag}")
+        regressions += regressed
+    print(f"{regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark invoice rendering, billing and list pages.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Build synthetic datasets and time the hot paths")
+    run_parser.add_argument("--sizes", help="Comma-separated customer counts (default 1000,10000,100000)")
+    run_parser.add_argument("--output", default="bench_results.json")
+    run_parser.add_argument("--db-dir", help="Where to put the SQLite files (default: a temp dir)")
+    run_parser.add_argument("--iterations", type=int, default=20, help="Renders/downloads timed per size")
+    run_parser.add_argument("--page-iterations", type=int, default=3, help="Page loads timed per size")
+    run_parser.add_argument("--due", type=int, default=25, help="Customers due for the daily batch")
+    run_parser.add_argument("--properties", type=int, default=1, help="Extra properties per customer")
+    run_parser.add_argument("--invoices", type=int, default=4, help="Invoice history per customer")
+
+    compare_parser = sub.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.15,
+                                help="Relative slowdown of the mean that counts as a regression")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,12 +17,13 @@ def check_fonts():
     
     doc = Document(path)
     
-    # We expect some runs to be Calibri 14
+    # We expect some runs to be Calibri 14 (the font usually comes from the Normal style)
     calibri_14_found = False
+    default_font = doc.styles['Normal'].font.name
     
     for p in doc.paragraphs:
         for run in p.runs:
-            if run.font.name == 'Calibri' and run.font.size and run.font.size.pt == 14.0:
+            if (run.font.name or default_font) == 'Calibri' and run.font.size and run.font.size.pt == 14.0:
                 calibri_14_found = True
                 # print(f"Found Calibri 14 run: '{run.text}'")
     
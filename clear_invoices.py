@@ -2,7 +2,8 @@
 Script to clear all invoices from the database.
 Use with caution - this will delete ALL invoice records!
 """
-from models import SessionLocal, Invoice
+from models import SessionLocal, Invoice, InvoiceLine, ReceivableBalance
+from analytics_snapshot import record_invoice_deletions
 
 def clear_all_invoices():
     session = SessionLocal()
@@ -13,6 +14,9 @@ def clear_all_invoices():
         if count > 0:
             confirm = input(f"Are you sure you want to delete all {count} invoices? (yes/no): ")
             if confirm.lower() == 'yes':
+                record_invoice_deletions(session)
+                session.query(InvoiceLine).delete()
+                session.query(ReceivableBalance).delete()
                 session.query(Invoice).delete()
                 session.commit()
                 print(f"✓ Deleted {count} invoices")
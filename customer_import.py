@@ -0,0 +1,185 @@
+"""
+Bulk customer import from CSV.
+
+Rows are read one at a time and validated. Each row is matched to an existing customer by
+email, or by name when the email is new, using one preloaded index. Changes are written
+in chunks: new customers with a batched INSERT, existing ones with INSERT ... ON CONFLICT
+(id) DO UPDATE. A dry run returns the same report without writing anything.
+
+Columns (header names as on the customer form): name, email, property_address,
+property_city, property_state, property_zip, rate, cadence, fee_type, next_bill_date,
+fee_2_type, fee_2_rate, fee_3_type, fee_3_rate, additional_fee_desc, additional_fee_amount.
+New customers need name, email, property_address, rate, cadence and next_bill_date.
+Blank cells leave an existing customer's value unchanged.
+
+    python customer_import.py portfolio.csv --dry-run
+"""
+import argparse
+import csv
+import sys
+from datetime import datetime
+
+from sqlalchemy import select, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import SessionLocal, Customer
+
+CHUNK_SIZE = 500
+CADENCES = ("monthly", "quarterly", "yearly")
+REQUIRED = ("name", "email", "property_address", "rate", "cadence", "next_bill_date")
+TEXT_FIELDS = ("name", "email", "property_address", "property_city", "property_state", "property_zip",
+               "cadence", "fee_type", "fee_2_type", "fee_3_type", "additional_fee_desc")
+NUMBER_FIELDS = ("rate", "fee_2_rate", "fee_3_rate", "additional_fee_amount")
+DATE_FIELDS = ("next_bill_date",)
+FIELDS = TEXT_FIELDS + NUMBER_FIELDS + DATE_FIELDS
+
+def _parse_date(value):
+    for fmt in ("%Y-%m-%d", "%m/%d/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"'{value}' is not a date (use YYYY-MM-DD)")
+
+def parse_customer_row(row):
+    """Clean one CSV row into {field: value} for its non-blank cells. Raises ValueError."""
+    values = {}
+    for key, raw in row.items():
+        field = (key or "").strip().lower()
+        value = (raw or "").strip()
+        if field not in FIELDS or not value:
+            continue
+        if field in NUMBER_FIELDS:
+            try:
+                values[field] = float(value.replace("$", "").replace(",", ""))
+            except ValueError:
+                raise ValueError(f"{field} '{value}' is not a number")
+        elif field in DATE_FIELDS:
+            values[field] = _parse_date(value)
+        else:
+            values[field] = value
+    if "cadence" in values:
+        values["cadence"] = values["cadence"].lower()
+        if values["cadence"] not in CADENCES:
+            raise ValueError(f"cadence must be one of {', '.join(CADENCES)}")
+    if values.get("rate") is not None and values["rate"] < 0:
+        raise ValueError("rate can't be negative")
+    return values
+
+def _upsert_statement(session):
+    """INSERT ... ON CONFLICT (id) DO UPDATE for every importable column, in this database's dialect."""
+    dialect_insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(Customer)
+    return stmt.on_conflict_do_update(index_elements=[Customer.id],
+                                      set_={field: stmt.excluded[field] for field in FIELDS})
+
+def import_customers(session, lines, dry_run=False, chunk_size=CHUNK_SIZE):
+    """
+    Import customers from `lines` (any iterable of CSV text lines). Returns a report:
+    a list of dicts with row, action ("create", "update", "unchanged" or "error"), name,
+    and either changes ({field: (old, new)}) or error.
+    """
+    # One query for the whole match index
+    existing = {}
+    by_email = {}
+    by_name = {}
+    for row in session.execute(select(Customer.id, *[getattr(Customer, f) for f in FIELDS])).mappings():
+        existing[row["id"]] = dict(row)
+        by_email.setdefault(row["email"].lower(), row["id"])
+        by_name.setdefault(row["name"].lower(), row["id"])
+
+    report = []
+    creates = []
+    updates = []
+    seen = {}
+
+    def flush():
+        if dry_run:
+            return
+        if creates:
+            session.execute(insert(Customer), creates)
+        if updates:
+            session.execute(_upsert_statement(session), updates)
+        creates.clear()
+        updates.clear()
+
+    for row_number, row in enumerate(csv.DictReader(lines), start=2):
+        try:
+            values = parse_customer_row(row)
+        except ValueError as e:
+            report.append({"row": row_number, "action": "error", "name": row.get("name", ""), "error": str(e)})
+            continue
+
+        customer_id = by_email.get(values.get("email", "").lower()) or by_name.get(values.get("name", "").lower())
+        # A customer may appear only once per file
+        key = customer_id or values.get("email", "").lower()
+        if key in seen:
+            report.append({"row": row_number, "action": "error", "name": values.get("name", ""),
+                           "error": f"Same customer as row {seen[key]}"})
+            continue
+
+        if customer_id is None:
+            missing = [field for field in REQUIRED if values.get(field) is None]
+            if missing:
+                report.append({"row": row_number, "action": "error", "name": values.get("name", ""),
+                               "error": f"New customer is missing {', '.join(missing)}"})
+                continue
+            new = {field: values.get(field) for field in FIELDS}
+            new["fee_type"] = new["fee_type"] or "Management Fee"
+            creates.append(new)
+            report.append({"row": row_number, "action": "create", "name": new["name"], "changes": {}})
+        else:
+            current = existing[customer_id]
+            changes = {field: (current[field], value) for field, value in values.items() if current[field] != value}
+            if "email" in changes and changes["email"][0].lower() == values["email"].lower():
+                del changes["email"]
+                values["email"] = current["email"]
+            if changes:
+                updates.append({"id": customer_id, **{field: current[field] for field in FIELDS}, **values})
+            report.append({"row": row_number, "action": "update" if changes else "unchanged",
+                           "name": current["name"], "changes": changes})
+        seen[key] = row_number
+
+        if len(creates) + len(updates) >= chunk_size:
+            flush()
+
+    flush()
+    if not dry_run:
+        session.commit()
+    return report
+
+def summarize(report):
+    """Counts per action, e.g. {"create": 10, "update": 2, "unchanged": 0, "error": 1}."""
+    counts = {"create": 0, "update": 0, "unchanged": 0, "error": 0}
+    for entry in report:
+        counts[entry["action"]] += 1
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create or update customers from a CSV file.")
+    parser.add_argument("csv_file")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would change without writing")
+    args = parser.parse_args(argv)
+
+    session = SessionLocal()
+    try:
+        with open(args.csv_file, newline="", encoding="utf-8-sig") as f:
+            report = import_customers(session, f, dry_run=args.dry_run)
+    finally:
+        session.close()
+
+    for entry in report:
+        if entry["action"] == "error":
+            print(f"row {entry['row']}: ERROR {entry['error']}")
+        elif entry["action"] == "update":
+            changes = ", ".join(f"{field}: {old!r} -> {new!r}" for field, (old, new) in entry["changes"].items())
+            print(f"row {entry['row']}: update {entry['name']} ({changes})")
+        elif entry["action"] == "create":
+            print(f"row {entry['row']}: create {entry['name']}")
+    counts = summarize(report)
+    print(f"{'Dry run: ' if args.dry_run else ''}{counts['create']} created, {counts['update']} updated, "
+          f"{counts['unchanged']} unchanged, {counts['error']} errors")
+    return 1 if counts["error"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
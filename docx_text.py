@@ -0,0 +1,93 @@
+"""
+Fast text extraction from .docx files.
+
+Reads only word/document.xml out of the zip and walks it with lxml's iterparse,
+clearing elements as it goes, so scanning hundreds of legacy invoices doesn't build a
+python-docx Document for each one and memory stays flat however long the file is.
+
+    for block in iter_text("invoice.docx"):
+        print(block.kind, block.position, block.text)
+
+Paragraph text matches python-docx's paragraph.text (text, tabs and breaks of its runs),
+except that runs inside tracked insertions and content controls are included.
+Cell text is the cell's paragraphs joined with "\\n", as cell.text. Unlike python-docx's
+row.cells, a merged cell is yielded once rather than once per grid column it spans.
+"""
+import zipfile
+from collections import namedtuple
+
+from lxml import etree
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCUMENT_XML = "word/document.xml"
+
+# kind is "paragraph" (position: index among the body's paragraphs, as in doc.paragraphs)
+# or "cell" (position: (table, row, cell), tables numbered in document order)
+TextBlock = namedtuple("TextBlock", "kind position text")
+
+# Run content and its text equivalent; w:br is "\n" only for line breaks (not page/column)
+_RUN_TEXT = {W + "tab": "\t", W + "ptab": "\t", W + "cr": "\n", W + "noBreakHyphen": "-"}
+_TAGS = [W + name for name in ("p", "tbl", "tr", "tc", "r", "t", "br")] + list(_RUN_TEXT)
+
+def iter_text(source):
+    """Yield a TextBlock for every body paragraph and table cell of a .docx path or file object."""
+    with zipfile.ZipFile(source) as archive, archive.open(DOCUMENT_XML) as xml:
+        paragraph_index = 0
+        table_count = 0
+        tables = []      # [table, row, cell] of each open table, innermost last
+        cells = []       # paragraph texts of each open cell
+        paragraphs = []  # text parts of each open paragraph (text boxes nest them)
+        run_depth = 0    # w:tab also appears in paragraph properties, outside any run
+
+        for event, elem in etree.iterparse(xml, events=("start", "end"), tag=_TAGS):
+            tag = elem.tag
+            if event == "start":
+                if tag == W + "p":
+                    paragraphs.append([])
+                elif tag == W + "tbl":
+                    tables.append([table_count, -1, -1])
+                    table_count += 1
+                elif tag == W + "tr":
+                    tables[-1][1] += 1
+                    tables[-1][2] = -1
+                elif tag == W + "tc":
+                    tables[-1][2] += 1
+                    cells.append([])
+                elif tag == W + "r":
+                    run_depth += 1
+                continue
+
+            if tag == W + "r":
+                run_depth -= 1
+            elif run_depth and paragraphs and tag in _RUN_TEXT:
+                paragraphs[-1].append(_RUN_TEXT[tag])
+            elif run_depth and paragraphs and tag == W + "t":
+                paragraphs[-1].append(elem.text or "")
+            elif run_depth and paragraphs and tag == W + "br":
+                if elem.get(W + "type", "textWrapping") == "textWrapping":
+                    paragraphs[-1].append("\n")
+            elif tag == W + "p":
+                text = "".join(paragraphs.pop())
+                if paragraphs:
+                    # A text box inside another paragraph, which python-docx leaves out too
+                    continue
+                if cells:
+                    cells[-1].append(text)
+                else:
+                    yield TextBlock("paragraph", paragraph_index, text)
+                    paragraph_index += 1
+            elif tag == W + "tc":
+                table, row, cell = tables[-1]
+                yield TextBlock("cell", (table, row, cell), "\n".join(cells.pop()))
+            elif tag == W + "tbl":
+                tables.pop()
+
+            # Only free finished top-level blocks; anything deeper is still being read
+            if tag in (W + "p", W + "tbl") and not paragraphs and not cells:
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+def paragraph_texts(source):
+    """Text of every body paragraph, in order (doc.paragraphs)."""
+    return [block.text for block in iter_text(source) if block.kind == "paragraph"]
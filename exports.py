@@ -0,0 +1,129 @@
+"""
+Streaming CSV / JSONL export of invoices and customers.
+
+Rows are read with a server-side cursor (stream_results + yield_per) and written out in
+chunks, so exporting years of history runs in constant memory.
+
+    python exports.py invoices --format csv --from 2024-01-01 --to 2024-12-31 --status Unpaid -o unpaid.csv
+    python exports.py customers --format jsonl > customers.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import date
+
+from sqlalchemy import select
+
+from models import SessionLocal, Invoice, Customer
+from reports import INVOICE_TOTAL
+
+CHUNK_ROWS = 1000
+
+INVOICE_COLUMNS = [
+    Invoice.id, Invoice.customer_id, Customer.name.label("customer_name"), Customer.email.label("customer_email"),
+    Invoice.invoice_date, Invoice.period_label, Invoice.period_start, Invoice.period_end,
+    Invoice.amount, INVOICE_TOTAL.label("total_amount"), Invoice.status, Invoice.paid_date,
+    Invoice.fee_2_type, Invoice.fee_2_amount, Invoice.fee_3_type, Invoice.fee_3_amount,
+    Invoice.additional_fee_desc, Invoice.additional_fee_amount, Invoice.file_path, Invoice.email_subject,
+]
+
+CUSTOMER_COLUMNS = [
+    Customer.id, Customer.name, Customer.email, Customer.property_address, Customer.property_city,
+    Customer.property_state, Customer.property_zip, Customer.rate, Customer.cadence, Customer.fee_type,
+    Customer.fee_2_type, Customer.fee_2_rate, Customer.fee_3_type, Customer.fee_3_rate,
+    Customer.additional_fee_desc, Customer.additional_fee_amount, Customer.next_bill_date,
+]
+
+EXPORTS = ("invoices", "customers")
+FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+def export_query(kind, date_from=None, date_to=None, status=None, customer_id=None):
+    """
+    SELECT for an export. Invoices filter on invoice_date range, status and customer;
+    customers only on customer_id. Returns (statement, column names).
+    """
+    if kind == "invoices":
+        stmt = select(*INVOICE_COLUMNS).outerjoin(Customer, Invoice.customer_id == Customer.id).order_by(Invoice.id)
+        if date_from:
+            stmt = stmt.where(Invoice.invoice_date >= date_from)
+        if date_to:
+            stmt = stmt.where(Invoice.invoice_date <= date_to)
+        if status:
+            stmt = stmt.where(Invoice.status == status)
+        if customer_id:
+            stmt = stmt.where(Invoice.customer_id == customer_id)
+        columns = INVOICE_COLUMNS
+    elif kind == "customers":
+        stmt = select(*CUSTOMER_COLUMNS).order_by(Customer.id)
+        if customer_id:
+            stmt = stmt.where(Customer.id == customer_id)
+        columns = CUSTOMER_COLUMNS
+    else:
+        raise ValueError(f"Unknown export: {kind}")
+    return stmt, [c.key for c in columns]
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def stream_export(kind, fmt="csv", chunk_rows=CHUNK_ROWS, **filters):
+    """
+    Generator of text chunks (about chunk_rows rows each) for an export. Opens and
+    closes its own session, so it can be handed straight to a streaming response.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    stmt, names = export_query(kind, **filters)
+
+    session = SessionLocal()
+    try:
+        result = session.execute(stmt.execution_options(stream_results=True, yield_per=chunk_rows))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(names)
+        for partition in result.partitions():
+            for row in partition:
+                if fmt == "csv":
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(names, row)), default=_json_default))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        session.close()
+
+def export_filename(kind, fmt):
+    return f"{kind}_{date.today().isoformat()}.{fmt}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export invoices or customers as CSV or JSONL.")
+    parser.add_argument("kind", choices=EXPORTS)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="Invoice date on or after (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="Invoice date on or before (YYYY-MM-DD)")
+    parser.add_argument("--status", choices=["Paid", "Unpaid"])
+    parser.add_argument("--customer", dest="customer_id", type=int)
+    parser.add_argument("-o", "--output", help="Write to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    chunks = stream_export(args.kind, args.format, date_from=args.date_from, date_to=args.date_to,
+                           status=args.status, customer_id=args.customer_id)
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from docx import Document
+from docx_text import iter_text
 import re
 
 TEMPLATE_PATH = r"C:\Development\invoice_automation\invoice_templates\base_invoice_template.docx"
@@ -6,14 +6,9 @@ TEMPLATE_PATH = r"C:\Development\invoice_automation\invoice_templates\base_invoi
 PLACEHOLDER_PATTERN = re.compile(r"{{(.*?)}}")
 
 def extract_placeholders(docx_path):
-    doc = Document(docx_path)
     found = set()
-    for para in doc.paragraphs:
-        found.update(PLACEHOLDER_PATTERN.findall(para.text))
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                found.update(PLACEHOLDER_PATTERN.findall(cell.text))
+    for block in iter_text(docx_path):
+        found.update(PLACEHOLDER_PATTERN.findall(block.text))
     return sorted(found)
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from docx import Document
+from docx_text import iter_text
 import os
 
 TEMPLATE_PATH = os.path.join("invoice_templates", "base_invoice_template.docx")
@@ -8,27 +8,30 @@ def inspect_template():
         print(f"Template not found at {TEMPLATE_PATH}")
         return
 
-    doc = Document(TEMPLATE_PATH)
+    blocks = list(iter_text(TEMPLATE_PATH))
     
     placeholders = ["{{FEE_LINE_2}}", "{{FEE_LINE_3}}", "{{ADDITIONAL_FEE_LINE}}"]
     found = {p: False for p in placeholders}
     
     print("Searching paragraphs...")
-    for p in doc.paragraphs:
+    for block in blocks:
+        if block.kind != "paragraph":
+            continue
         for ph in placeholders:
-            if ph in p.text:
+            if ph in block.text:
                 found[ph] = True
-                print(f"Found {ph} in paragraph: {p.text.strip()}")
+                print(f"Found {ph} in paragraph: {block.text.strip()}")
 
     print("\nSearching tables...")
-    for table_idx, table in enumerate(doc.tables):
-        for row_idx, row in enumerate(table.rows):
-            for cell in row.cells:
-                for p in cell.paragraphs:
-                    for ph in placeholders:
-                        if ph in p.text:
-                            found[ph] = True
-                            print(f"Found {ph} in Table {table_idx}, Row {row_idx}: {p.text.strip()}")
+    for block in blocks:
+        if block.kind != "cell":
+            continue
+        table_idx, row_idx, _ = block.position
+        for text in block.text.split("\n"):
+            for ph in placeholders:
+                if ph in text:
+                    found[ph] = True
+                    print(f"Found {ph} in Table {table_idx}, Row {row_idx}: {text.strip()}")
 
     print("\nResults:")
     for ph, was_found in found.items():
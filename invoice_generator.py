@@ -1,9 +1,18 @@
 import os
 import io
-from datetime import date, timedelta
-from docx import Document
-from docx.shared import Pt
-from models import Invoice, SessionLocal, Customer, Settings
+import re
+import json
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import selectinload
+from models import Invoice, InvoiceLine, SessionLocal, Customer, Settings
+from reports import adjust_receivables
+from template_registry import list_templates, resolve_template, get_template
+from template_artifact import ARTIFACT_VERSION, ZIP_DATE_TIME, merge_documents
+from invoice_pdf import InvoicePdf, template_layout
+from artifact_store import get_store
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "invoice_templates")
@@ -17,10 +26,17 @@ except OSError:
     OUTPUT_DIR = "/tmp"
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Bump when the render snapshot layout changes
+SNAPSHOT_VERSION = 2
+# Bump when rendering changes the bytes produced for the same snapshot and template
+# (it's part of every download's ETag, so browsers would otherwise keep the old file)
+RENDER_VERSION = 1
+# Parallel writes when a billing run stores its new invoices' documents
+STORE_WORKERS = 8
+
 def get_invoice_templates():
     """Return a list of available invoice template filenames (docx) in the invoice_templates folder."""
-    templates = [f for f in os.listdir(TEMPLATE_DIR) if f.endswith(".docx") and not f.startswith("~")]
-    return sorted(templates)
+    return list_templates()
 
 def get_period_dates(invoice_date: date, cadence: str):
     """Calculate start and end dates for the period based on cadence."""
@@ -63,207 +79,314 @@ def get_period_label(invoice_date: date, cadence: str) -> str:
     else:
         return invoice_date.isoformat()
 
+def parse_period_label(label: str):
+    """
+    Inverse of get_period_label: return (start_date, end_date) for a stored label,
+    or None if the label isn't in a format we generate.
+    """
+    label = (label or "").strip()
+
+    match = re.fullmatch(r"([1-4])(?:st|nd|rd|th) quarter (\d{4})", label) or re.fullmatch(r"Q([1-4]) (\d{4})", label)
+    if match:
+        quarter, year = int(match.group(1)), int(match.group(2))
+        return get_period_dates(date(year, 3 * (quarter - 1) + 1, 1), "quarterly")
+
+    if re.fullmatch(r"\d{4}", label):
+        return get_period_dates(date(int(label), 1, 1), "yearly")
+
+    for fmt in ("%B %Y", "%b %Y"):
+        try:
+            return get_period_dates(datetime.strptime(label, fmt).date(), "monthly")
+        except ValueError:
+            pass
+
+    try:
+        day = date.fromisoformat(label)
+        return day, day
+    except ValueError:
+        return None
+
+def format_period_dates(start_date, end_date):
+    return f"{start_date.strftime('%m/%d/%Y')} - {end_date.strftime('%m/%d/%Y')}"
+
 def fill_invoice_template(doc, replacements):
-    """Replace placeholders in the document with values from replacements dict."""
-    # Define keys that need tight spacing
-    tight_spacing_keys = ["{{FEE_LINE_2}}", "{{FEE_LINE_3}}", "{{ADDITIONAL_FEE_LINE}}"]
-
-    for p in doc.paragraphs:
-        replaced = False
-        for old, new in replacements.items():
-            if old in p.text:
-                p.text = p.text.replace(old, str(new))
-                replaced = True
-                # Apply standard spacing (12pt) if it's a fee line
-                if old in tight_spacing_keys:
-                    p.paragraph_format.space_after = Pt(12)
-                    p.paragraph_format.line_spacing = 1.0
-        if replaced:
-            for run in p.runs:
-                run.font.name = 'Calibri'
-                run.font.size = Pt(14)
-    
-    for table in doc.tables:
-        for row in table.rows:
-            for cell in row.cells:
-                for p in cell.paragraphs:
-                    replaced = False
-                    for old, new in replacements.items():
-                        if old in p.text:
-                            p.text = p.text.replace(old, str(new))
-                            replaced = True
-                            # Apply standard spacing (12pt) if it's a fee line
-                            if old in tight_spacing_keys:
-                                p.paragraph_format.space_after = Pt(12)
-                                p.paragraph_format.line_spacing = 1.0
-                    if replaced:
-                        for run in p.runs:
-                            run.font.name = 'Calibri'
-                            run.font.size = Pt(14)
+    """
+    Replace placeholders in a TemplateDocument with values from replacements dict. Each
+    placeholder's runs were merged when the template was compiled, so the value takes
+    the formatting of the run the placeholder starts in.
+    """
+    doc.fill(replacements)
 
-def _generate_invoice_logic(customer, invoice_date, period_label, period_dates, amount, return_buffer=True, **kwargs):
+def remove_empty_fee_blocks(doc, values):
     """
-    Shared logic to generate an invoice.
-    If return_buffer is True, returns (filename, BytesIO_object).
-    If return_buffer is False, saves to file and returns (filename, full_path).
-    DEFAULT IS TRUE FOR VERCEL CLOUD COMPATIBILITY (read-only filesystem).
+    Drop the table row or paragraph of every fee line placeholder whose value is empty,
+    so unused fee lines leave no blank space. values maps placeholder name to its text;
+    where each block sits was worked out when the template was compiled.
+    """
+    for name, value in values.items():
+        if not value:
+            doc.omit_block(name)
+
+def fee_lines(fee_type, amount, fee_2_type=None, fee_2_amount=None, fee_3_type=None, fee_3_amount=None,
+              additional_fee_desc=None, additional_fee_amount=None, recurring_fees=(), property_fees=()):
+    """
+    Build the ordered invoice lines (dicts shaped like InvoiceLine) for one invoice.
+    kind says where the line prints: "base" is the main amount, "fee_2"/"fee_3" fill
+    the FEE_LINE_2/FEE_LINE_3 placeholders, "fee" goes on the additional fee line and
+    "property" gets the template's per-property block (or the additional fee line if it
+    has none). Fees without an amount are left out.
+    """
+    def line(kind, line_fee_type, description, line_amount):
+        return {"kind": kind, "fee_type": line_fee_type, "description": description, "amount": line_amount}
+
+    lines = [line("base", fee_type, None, amount)]
+    if fee_2_amount:
+        # Fallback to "Fee" if type is missing
+        lines.append(line("fee_2", fee_2_type or "Fee", None, fee_2_amount))
+    if fee_3_amount:
+        lines.append(line("fee_3", fee_3_type or "Fee", None, fee_3_amount))
+    if additional_fee_amount:
+        lines.append(line("fee", "Additional Fee", additional_fee_desc or "Additional Fee", additional_fee_amount))
+    for recurring_fee_type, description, recurring_amount in recurring_fees:
+        if recurring_amount:
+            lines.append(line("fee", recurring_fee_type, description, recurring_amount))
+    for address, fee in property_fees:
+        lines.append(line("property", "Management Fee", address, fee))
+    return lines
+
+def build_render_snapshot(customer, invoice_date, period_label, period_dates, amount,
+                          include_recurring_fees=True, template_name=None, default_template=None, **kwargs):
+    """
+    Capture everything the renderer needs for one invoice as a JSON-serializable dict.
+    Stored on the Invoice so a download can be regenerated from that row alone, and
+    gives the same document even after the customer is edited.
     
-    kwargs can contain:
-    - fee_2_type, fee_2_amount
-    - fee_3_type, fee_3_amount
-    - additional_fee_desc, additional_fee_amount
+    kwargs are the same fee overrides _generate_invoice_logic accepts; without them
+    the customer's default fees are used. The customer's recurring fees are always
+    added unless include_recurring_fees is False.
+    
+    The template is template_name if given, else the customer's own template, else
+    default_template (Settings.default_template_name), else the base template.
     """
-    try:
-        doc = Document(TEMPLATE_PATH)
-        
-        print(f"DEBUG: Generator Logic Called. Kwargs: {kwargs}")
-        if kwargs:
-            print(f"DEBUG: Using kwargs. fee_2_amount={kwargs.get('fee_2_amount')}, additional={kwargs.get('additional_fee_amount')}")
-        
-        if kwargs:
-            # Manual generation: use provided values (even if None)
-            fee_2_type = kwargs.get('fee_2_type')
-            fee_2_amount = kwargs.get('fee_2_amount')
-            fee_3_type = kwargs.get('fee_3_type')
-            fee_3_amount = kwargs.get('fee_3_amount')
-            additional_fee_desc = kwargs.get('additional_fee_desc')
-            additional_fee_amount = kwargs.get('additional_fee_amount')
-        else:
-            # Batch generation: use customer defaults
-            fee_2_type = customer.fee_2_type
-            fee_2_amount = customer.fee_2_rate
-            fee_3_type = customer.fee_3_type
-            fee_3_amount = customer.fee_3_rate
-            additional_fee_desc = customer.additional_fee_desc
-            additional_fee_amount = customer.additional_fee_amount
-        
-        # Calculate total amount including all fees
-        # Start with base rate
-        total_amount = amount
-        
-        # Add Fee 2
-        if fee_2_amount:
-            total_amount += fee_2_amount
-            
-        # Add Fee 3
-        if fee_3_amount:
-            total_amount += fee_3_amount
-            
-        # Add Additional Fee
-        if additional_fee_amount:
-            total_amount += additional_fee_amount
-            
-        # Add Property Fees
-        property_fees_total = 0
-        for prop in customer.properties:
-            if prop.fee_amount:
-                property_fees_total += prop.fee_amount
-        total_amount += property_fees_total
-        
-        
-        # Build complete fee lines (or empty strings if not used)
-        # Calculate period info for fee 2 and 3 if they exist
-        # Build complete fee lines (or empty strings if not used)
-        # Calculate period info for fee 2 and 3 if they exist
-        fee_line_2 = ""
-        if fee_2_amount:
-            # Fallback to "Fee" if type is missing
-            f2_type = fee_2_type or "Fee"
-            fee_line_2 = f"{period_label} {f2_type} ({period_dates}) = ${fee_2_amount:,.2f}"
-        
-        fee_line_3 = ""
-        if fee_3_amount:
-            f3_type = fee_3_type or "Fee"
-            fee_line_3 = f"{period_label} {f3_type} ({period_dates}) = ${fee_3_amount:,.2f}"
-        
-        # Build additional fee line
-        additional_fee_parts = []
-        if additional_fee_amount:
-             additional_fee_parts.append(f"{additional_fee_desc} = ${additional_fee_amount:,.2f}")
-        
-        # Append property fees
-        if customer.properties:
-            for prop in customer.properties:
-                if prop.fee_amount:
-                    additional_fee_parts.append(f"Management Fee ({prop.address}) = ${prop.fee_amount:,.2f}")
-        
-        additional_fee_line = "\n\n".join(additional_fee_parts)
-        
-        replacements = {
-            "{{CUSTOMER_NAME}}": customer.name,
-            "{{CUSTOMER_EMAIL}}": customer.email,
-            "{{PROPERTY_ADDRESS}}": customer.property_address,
-            "{{PROPERTY_CITY}}": customer.property_city or "",
-            "{{PROPERTY_STATE}}": customer.property_state or "",
-            "{{PROPERTY_ZIP}}": customer.property_zip or "",
-            "{{PERIOD}}": period_label,
-            "{{PERIOD_DATES}}": period_dates,
-            "{{AMOUNT}}": f"${amount:,.2f}",
-            "{{INVOICE_DATE}}": invoice_date.strftime("%m/%d/%Y"),
-            "{{FEE_TYPE}}": getattr(customer, "fee_type", "Management Fee") or "Management Fee",
-            "{{TOTAL_AMOUNT}}": f"${total_amount:,.2f}",
-            # Complete fee lines - these replace the entire row content
-            "{{FEE_LINE_2}}": fee_line_2,
-            "{{FEE_LINE_3}}": fee_line_3,
-            "{{ADDITIONAL_FEE_LINE}}": additional_fee_line,
-        }
-
-        # Remove rows with empty fee lines to eliminate whitespace
-        rows_to_remove = []
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    # Check if this row contains an empty fee line placeholder
-                    if ("{{FEE_LINE_2}}" in cell.text and not fee_line_2) or \
-                       ("{{FEE_LINE_3}}" in cell.text and not fee_line_3) or \
-                       ("{{ADDITIONAL_FEE_LINE}}" in cell.text and not additional_fee_line):
-                        rows_to_remove.append((table._tbl, row._tr))
-                        break
-        
-        # Remove the rows
-        for tbl, tr in rows_to_remove:
-            tbl.remove(tr)
-        # Remove paragraphs containing empty fee line placeholders BEFORE replacement
-        # This preserves intentional spacing while removing only unused fee lines
-        paragraphs_to_remove = []
-        for paragraph in doc.paragraphs:
-            text = paragraph.text.strip()
-            # Only remove if it contains a fee line placeholder that will be empty
-            if ("{{FEE_LINE_2}}" in text and not fee_line_2) or \
-               ("{{FEE_LINE_3}}" in text and not fee_line_3) or \
-               ("{{ADDITIONAL_FEE_LINE}}" in text and not additional_fee_line):
-                paragraphs_to_remove.append(paragraph)
-        
-        # Remove the specific fee line paragraphs
-        for paragraph in paragraphs_to_remove:
-            p = paragraph._element
-            p.getparent().remove(p)
+    if kwargs:
+        # Manual generation: use provided values (even if None)
+        fee_2_type = kwargs.get('fee_2_type')
+        fee_2_amount = kwargs.get('fee_2_amount')
+        fee_3_type = kwargs.get('fee_3_type')
+        fee_3_amount = kwargs.get('fee_3_amount')
+        additional_fee_desc = kwargs.get('additional_fee_desc')
+        additional_fee_amount = kwargs.get('additional_fee_amount')
+    else:
+        # Batch generation: use customer defaults
+        fee_2_type = customer.fee_2_type
+        fee_2_amount = customer.fee_2_rate
+        fee_3_type = customer.fee_3_type
+        fee_3_amount = customer.fee_3_rate
+        additional_fee_desc = customer.additional_fee_desc
+        additional_fee_amount = customer.additional_fee_amount
 
-        fill_invoice_template(doc, replacements)
-        
-        # Add property fees as dynamic rows if they exist
-        # This is tricky with python-docx if we don't have a specific placeholder row to clone.
-        # For now, we will just ensure the total is correct. 
-        # If the user wants property fees listed, we'd need a more complex template logic.
-        # Given the constraints, let's assume the "Additional Fee" or similar might be used, 
-        # OR we just accept that they are summed in the total but not itemized unless we add more logic.
-        # WAIT: The user asked for "ability to add a fee when adding a property".
-        # Ideally this should be itemized.
-        # Let's try to append them to the table if possible, or just leave as is for now and verify total.
-        # Since I can't easily clone rows without a reference, I'll stick to the total for now.
-
-        # Calculate street name (remove number)
-        address_parts = customer.property_address.split(' ', 1)
-        if len(address_parts) > 1:
-            street_name = address_parts[1]
+    recurring_fees = []
+    if include_recurring_fees:
+        recurring_fees = [(fee.fee_type, fee.description, fee.amount) for fee in customer.recurring_fees]
+
+    template = get_template(resolve_template(template_name, getattr(customer, "template_name", None), default_template))
+
+    return {
+        "v": SNAPSHOT_VERSION,
+        "template": template.name,
+        "template_version": template.version,
+        "customer_name": customer.name,
+        "customer_email": customer.email,
+        "property_address": customer.property_address,
+        "property_city": customer.property_city or "",
+        "property_state": customer.property_state or "",
+        "property_zip": customer.property_zip or "",
+        "invoice_date": invoice_date.isoformat(),
+        "period_label": period_label,
+        "period_dates": period_dates,
+        "lines": fee_lines(
+            getattr(customer, "fee_type", "Management Fee") or "Management Fee",
+            amount,
+            fee_2_type, fee_2_amount,
+            fee_3_type, fee_3_amount,
+            additional_fee_desc, additional_fee_amount,
+            recurring_fees=recurring_fees,
+            # Every additional property that carries a fee
+            property_fees=[(prop.address, prop.fee_amount) for prop in customer.properties if prop.fee_amount],
+        ),
+    }
+
+def snapshot_lines(snapshot):
+    """Invoice lines of a render snapshot; version 1 snapshots stored the fees as flat keys."""
+    if "lines" in snapshot:
+        return snapshot["lines"]
+    return fee_lines(
+        snapshot["fee_type"], snapshot["amount"],
+        snapshot["fee_2_type"], snapshot["fee_2_amount"],
+        snapshot["fee_3_type"], snapshot["fee_3_amount"],
+        snapshot["additional_fee_desc"], snapshot["additional_fee_amount"],
+        property_fees=snapshot["property_fees"],
+    )
+
+def compute_invoice_total(snapshot):
+    """Sum of every line on the snapshot: base amount plus all fees."""
+    return sum(line["amount"] for line in snapshot_lines(snapshot))
+
+def build_invoice_lines(snapshot):
+    """InvoiceLine rows for a snapshot, to attach to its Invoice."""
+    return [InvoiceLine(position=i, **line) for i, line in enumerate(snapshot_lines(snapshot))]
+
+def invoice_filename(snapshot, format="docx"):
+    """Download filename, e.g. Invoice_March_2025_Main_St.docx"""
+    # Calculate street name (remove number)
+    address_parts = snapshot["property_address"].split(' ', 1)
+    if len(address_parts) > 1:
+        street_name = address_parts[1]
+    else:
+        street_name = snapshot["property_address"]
+    
+    # Sanitize filename
+    safe_period = snapshot["period_label"].replace(' ', '_').replace('/', '-')
+    safe_street = street_name.replace(' ', '_').replace('/', '-')
+    
+    return f"Invoice_{safe_period}_{safe_street}.{format}"
+
+def fee_line_label(line, period_label, period_dates):
+    """What an invoice line prints before its " = $amount"."""
+    if line["kind"] == "property":
+        return f"{line['fee_type']} ({line['description']})"
+    if line["description"]:
+        return line["description"]
+    return f"{period_label} {line['fee_type']} ({period_dates})"
+
+def invoice_preview(snapshot):
+    """What the invoice document shows, for the HTML preview: its header fields, lines and total."""
+    return {
+        "customer_name": snapshot["customer_name"],
+        "customer_email": snapshot["customer_email"],
+        "property_address": snapshot["property_address"],
+        "property_city": snapshot["property_city"],
+        "property_state": snapshot["property_state"],
+        "property_zip": snapshot["property_zip"],
+        "invoice_date": date.fromisoformat(snapshot["invoice_date"]).strftime("%m/%d/%Y"),
+        "template": snapshot["template"],
+        "lines": [{"label": fee_line_label(line, snapshot["period_label"], snapshot["period_dates"]),
+                   "amount": line["amount"]} for line in snapshot_lines(snapshot)],
+        "total": compute_invoice_total(snapshot),
+    }
+
+def invoice_values(snapshot, itemize_properties=False):
+    """
+    What a template is filled with for a render snapshot: (replacements, the fee line
+    placeholders that are empty so their blocks are left out, one {name: text} per
+    property fee for a per-property block, total amount). Property fees are itemized
+    only for templates that have a per-property block; otherwise they're on the
+    additional fee line.
+    """
+    period_label = snapshot["period_label"]
+    period_dates = snapshot["period_dates"]
+    lines = snapshot_lines(snapshot)
+    
+    # Calculate total amount including all fees
+    total_amount = compute_invoice_total(snapshot)
+    
+    # Build complete fee lines (or empty strings if not used)
+    base_line = lines[0]
+    fee_line_2 = ""
+    fee_line_3 = ""
+    additional_fee_parts = []
+    property_items = []
+    for line in lines[1:]:
+        text = f"{fee_line_label(line, period_label, period_dates)} = ${line['amount']:,.2f}"
+        if line["kind"] == "property":
+            if itemize_properties:
+                property_items.append({
+                    "PROPERTY_FEE_LINE": text,
+                    "PROPERTY_FEE_ADDRESS": line["description"],
+                    "PROPERTY_FEE_TYPE": line["fee_type"],
+                    "PROPERTY_FEE_AMOUNT": f"${line['amount']:,.2f}",
+                })
+            else:
+                additional_fee_parts.append(text)
+        elif line["description"]:
+            additional_fee_parts.append(text)
+        elif line["kind"] == "fee_2":
+            fee_line_2 = text
+        elif line["kind"] == "fee_3":
+            fee_line_3 = text
         else:
-            street_name = customer.property_address
-        
-        # Sanitize filename
-        safe_period = period_label.replace(' ', '_').replace('/', '-')
-        safe_street = street_name.replace(' ', '_').replace('/', '-')
-        
-        filename = f"Invoice_{safe_period}_{safe_street}.docx"
+            additional_fee_parts.append(text)
+    
+    additional_fee_line = "\n\n".join(additional_fee_parts)
+    
+    replacements = {
+        "{{CUSTOMER_NAME}}": snapshot["customer_name"],
+        "{{CUSTOMER_EMAIL}}": snapshot["customer_email"],
+        "{{PROPERTY_ADDRESS}}": snapshot["property_address"],
+        "{{PROPERTY_CITY}}": snapshot["property_city"],
+        "{{PROPERTY_STATE}}": snapshot["property_state"],
+        "{{PROPERTY_ZIP}}": snapshot["property_zip"],
+        "{{PERIOD}}": period_label,
+        "{{PERIOD_DATES}}": period_dates,
+        "{{AMOUNT}}": f"${base_line['amount']:,.2f}",
+        "{{INVOICE_DATE}}": date.fromisoformat(snapshot["invoice_date"]).strftime("%m/%d/%Y"),
+        "{{FEE_TYPE}}": base_line["fee_type"],
+        "{{TOTAL_AMOUNT}}": f"${total_amount:,.2f}",
+        # Complete fee lines - these replace the entire row content
+        "{{FEE_LINE_2}}": fee_line_2,
+        "{{FEE_LINE_3}}": fee_line_3,
+        "{{ADDITIONAL_FEE_LINE}}": additional_fee_line,
+    }
+
+    fee_blocks = {
+        "FEE_LINE_2": fee_line_2,
+        "FEE_LINE_3": fee_line_3,
+        "ADDITIONAL_FEE_LINE": additional_fee_line,
+    }
+    return replacements, [name for name, value in fee_blocks.items() if not value], property_items, total_amount
+
+def build_invoice_document(snapshot):
+    """
+    The filled-in invoice document (a TemplateDocument) for a render snapshot, and its
+    total amount. render_invoice_snapshot saves it; a print run merges several.
+    """
+    # Falls back to the base template if this one has since been removed
+    doc = get_template(resolve_template(snapshot["template"])).new_document()
+    replacements, empty_fee_blocks, property_items, total_amount = invoice_values(snapshot, doc.has_repeat("PROPERTY"))
+
+    # Remove the rows/paragraphs of unused fee lines
+    remove_empty_fee_blocks(doc, {name: "" for name in empty_fee_blocks})
+    doc.repeat("PROPERTY", property_items)
+
+    fill_invoice_template(doc, replacements)
+    return doc, total_amount
+
+def add_invoice_pdf(pdf, snapshot):
+    """Lay out the invoice of a render snapshot on new pages of an InvoicePdf. Returns its total amount."""
+    layout = template_layout(get_template(resolve_template(snapshot["template"])))
+    replacements, empty_fee_blocks, property_items, total_amount = invoice_values(snapshot, layout.has_repeat)
+    values = {placeholder[2:-2]: str(value) for placeholder, value in replacements.items()}
+    pdf.add_invoice(layout, values, empty_fee_blocks, property_items)
+    return total_amount
+
+def render_invoice_pdf(snapshot):
+    """Render a render snapshot as a PDF: (filename, BytesIO_object, total_amount)."""
+    buffer = io.BytesIO()
+    pdf = InvoicePdf(buffer)
+    total_amount = add_invoice_pdf(pdf, snapshot)
+    pdf.close()
+    buffer.seek(0)
+    return invoice_filename(snapshot, "pdf"), buffer, total_amount
+
+def render_invoice_snapshot(snapshot, return_buffer=True):
+    """
+    Render an invoice document from a render snapshot (see build_render_snapshot).
+    If return_buffer is True, returns (filename, BytesIO_object, total_amount).
+    If return_buffer is False, saves to file and returns (filename, full_path, total_amount).
+    """
+    try:
+        doc, total_amount = build_invoice_document(snapshot)
+        filename = invoice_filename(snapshot)
         
         if return_buffer:
             buffer = io.BytesIO()
@@ -279,21 +402,45 @@ def _generate_invoice_logic(customer, invoice_date, period_label, period_dates,
         print(f"Error generating invoice: {e}")
         raise e
 
+def _generate_invoice_logic(customer, invoice_date, period_label, period_dates, amount, return_buffer=True, **kwargs):
+    """
+    Shared logic to generate an invoice.
+    If return_buffer is True, returns (filename, BytesIO_object, total_amount).
+    If return_buffer is False, saves to file and returns (filename, full_path, total_amount).
+    DEFAULT IS TRUE FOR VERCEL CLOUD COMPATIBILITY (read-only filesystem).
+    
+    kwargs can contain:
+    - fee_2_type, fee_2_amount
+    - fee_3_type, fee_3_amount
+    - additional_fee_desc, additional_fee_amount
+    """
+    print(f"DEBUG: Generator Logic Called. Kwargs: {kwargs}")
+    snapshot = build_render_snapshot(customer, invoice_date, period_label, period_dates, amount, **kwargs)
+    return render_invoice_snapshot(snapshot, return_buffer=return_buffer)
+
+def manual_invoice_snapshot(customer, invoice_date, template_name=None, default_template=None, **kwargs):
+    """The render snapshot of a manually generated invoice (the Generate Invoice form), at the customer's rate."""
+    start_date, end_date = get_period_dates(invoice_date, customer.cadence)
+    return build_render_snapshot(customer, invoice_date, get_period_label(invoice_date, customer.cadence),
+                                 format_period_dates(start_date, end_date), customer.rate,
+                                 template_name=template_name, default_template=default_template, **kwargs)
+
 def generate_invoice_with_template(customer, invoice_date, template_name, **kwargs):
     """Generate invoice and save to database (for manual generation via UI)."""
     session = SessionLocal()
     try:
         period_label = get_period_label(invoice_date, customer.cadence)
-        amount = customer.rate 
         start_date, end_date = get_period_dates(invoice_date, customer.cadence)
-        period_dates = f"{start_date.strftime('%m/%d/%Y')} - {end_date.strftime('%m/%d/%Y')}"
-        
-        # Generate invoice in-memory
-        filename, buffer, total_amount = _generate_invoice_logic(customer, invoice_date, period_label, period_dates, amount, **kwargs)
         
-        # Get sender info from settings
+        # Get sender info and default template from settings
         settings = session.query(Settings).first()
         sender_name = settings.sender_name if settings else "Property Manager"
+        default_template = settings.default_template_name if settings else None
+        
+        # Capture the render inputs; the document itself is rendered on download
+        snapshot = manual_invoice_snapshot(customer, invoice_date, template_name, default_template, **kwargs)
+        total_amount = compute_invoice_total(snapshot)
+        filename = invoice_filename(snapshot)
         
         # Create email content
         fee_type_text = getattr(customer, "fee_type", "Management Fee") or "Management Fee"
@@ -310,31 +457,10 @@ def generate_invoice_with_template(customer, invoice_date, template_name, **kwar
             customer_id=customer.id,
             invoice_date=invoice_date,
             period_label=period_label,
+            period_start=start_date,
+            period_end=end_date,
             amount=customer.rate, # Store BASE amount (rate) so regeneration works correctly
-            # WAIT: If we store total_amount here, then future regenerations might double count fees if we add fees to it again?
-            # The Invoice model has 'amount'. If we store total here, we should be careful.
-            # But the invoice generation logic takes 'amount' as input.
-            # If we pass total_amount back into logic, it will add fees ON TOP of total.
-            # So we should probably store the BASE amount in the DB if we want to regenerate with dynamic fees.
-            # OR we store the total and don't add fees again?
-            # The current logic passes 'customer.rate' (base) to logic.
-            # So 'invoice_record.amount' should probably be the TOTAL for display purposes in the list?
-            # Let's check how 'amount' is used.
-            # In 'generate_invoice_buffer', it uses 'invoice.amount'.
-            # If 'invoice.amount' is TOTAL, and we pass it to logic, logic adds fees.
-            # So logic would calculate: TOTAL + fees. That's wrong.
-            # So 'invoice.amount' MUST be the BASE amount.
-            # BUT the user wants the email to say the TOTAL.
-            # So we use 'total_amount' for the email body, but store 'amount' (base) in the DB?
-            # The 'Invoices' list shows 'inv.amount'. If that shows base, it's confusing.
-            # Ideally 'Invoice' model should have 'base_amount' and 'total_amount'.
-            # Or we change logic to not add fees if they are already included? No, that's messy.
-            # Let's keep 'amount' as BASE amount in DB to preserve regeneration logic.
-            # And just use 'total_amount' for the email body.
-            # AND maybe we should update the 'Invoices' list to calculate total on the fly?
-            # Or add a 'total_amount' column to Invoice?
-            # For now, I will just fix the EMAIL as requested.
-            # The user complained about the email body.
+            # 'amount' stays the base rate (regeneration adds fees on top); the full total is in total_amount
             file_path=filename,
             email_subject=subject,
             email_body=body,
@@ -344,29 +470,47 @@ def generate_invoice_with_template(customer, invoice_date, template_name, **kwar
             fee_3_type=kwargs.get("fee_3_type"),
             fee_3_amount=kwargs.get("fee_3_amount"),
             additional_fee_desc=kwargs.get("additional_fee_desc"),
-            additional_fee_amount=kwargs.get("additional_fee_amount")
+            additional_fee_amount=kwargs.get("additional_fee_amount"),
+            total_amount=total_amount,
+            render_snapshot=json.dumps(snapshot),
+            lines=build_invoice_lines(snapshot)
         )
         session.add(invoice_record)
+        adjust_receivables(session, [invoice_record], 1)
         session.commit()
         
         return invoice_record
     finally:
         session.close()
 
-def generate_invoice_for_customer(customer, invoice_date):
+def generate_invoice_for_customer(customer, invoice_date, session=None, sender_name=None, default_template=None):
+    """
+    Generate an invoice using the customer's default fees (batch generation).
+    If a session is passed the Invoice is only added to it and the caller commits,
+    so a batch run can write all of its invoices in one flush; the caller then also
+    passes the new invoices to reports.adjust_receivables.
+    A batch passes sender_name and default_template from Settings so they're read once;
+    without sender_name both are looked up here.
+    """
     period_label = get_period_label(invoice_date, customer.cadence)
     start_date, end_date = get_period_dates(invoice_date, customer.cadence)
-    period_dates = f"{start_date.strftime('%m/%d/%Y')} - {end_date.strftime('%m/%d/%Y')}"
+    period_dates = format_period_dates(start_date, end_date)
     amount = customer.rate
-    
-    # Generate invoice in-memory (don't write to disk - Vercel is read-only)
-    filename, buffer, total_amount = _generate_invoice_logic(customer, invoice_date, period_label, period_dates, amount)
 
-    # Get sender info from settings
-    session = SessionLocal()
-    settings = session.query(Settings).first()
-    sender_name = settings.sender_name if settings else "Property Manager"
-    session.close()
+    # Get sender info and default template from settings
+    if sender_name is None:
+        settings_session = session or SessionLocal()
+        settings = settings_session.query(Settings).first()
+        sender_name = settings.sender_name if settings else "Property Manager"
+        default_template = settings.default_template_name if settings else None
+        if session is None:
+            settings_session.close()
+    
+    # Capture the render inputs; the document itself is rendered on download
+    snapshot = build_render_snapshot(customer, invoice_date, period_label, period_dates, amount,
+                                     default_template=default_template)
+    total_amount = compute_invoice_total(snapshot)
+    filename = invoice_filename(snapshot)
 
     fee_type_text = getattr(customer, "fee_type", "Management Fee") or "Management Fee"
     subject = f"Invoice – {period_label} – {customer.property_address}"
@@ -381,6 +525,8 @@ def generate_invoice_for_customer(customer, invoice_date):
         customer_id=customer.id,
         invoice_date=invoice_date,
         period_label=period_label,
+        period_start=start_date,
+        period_end=end_date,
         amount=amount, # Keep as base amount
         file_path=filename, # Store filename only for cloud compatibility
         email_subject=subject,
@@ -391,47 +537,42 @@ def generate_invoice_for_customer(customer, invoice_date):
         fee_3_type=customer.fee_3_type,
         fee_3_amount=customer.fee_3_rate,
         additional_fee_desc=customer.additional_fee_desc,
-        additional_fee_amount=customer.additional_fee_amount
+        additional_fee_amount=customer.additional_fee_amount,
+        total_amount=total_amount,
+        render_snapshot=json.dumps(snapshot),
+        lines=build_invoice_lines(snapshot)
     )
     
+    if session is not None:
+        session.add(invoice)
+        return invoice
+
     session = SessionLocal()
     session.add(invoice)
+    adjust_receivables(session, [invoice], 1)
     session.commit()
     session.close()
     
     return invoice
 
-def generate_invoice_buffer(invoice):
+def build_legacy_snapshot(invoice, customer):
     """
-    Regenerates the invoice document in-memory for a given Invoice record.
+    Build a render snapshot for an invoice created before snapshots were stored,
+    using its saved fees and period plus the customer's current details.
     """
-    session = SessionLocal()
-    customer = session.query(Customer).get(invoice.customer_id)
-    
-    # Eagerly load properties to avoid lazy loading issues after session close
-    if customer and customer.properties:
-        _ = list(customer.properties)  # Force load
-    
-    session.close()
-    
-    if not customer:
-        raise ValueError("Customer not found")
-        
-    # Reconstruct parameters
-    # Note: In a real app, we might want to store period_dates in the Invoice model too.
-    # For now, we recalculate them based on the invoice date and customer cadence.
-    # This assumes the cadence hasn't changed in a way that affects the past invoice period logic.
-    
-    start_date, end_date = get_period_dates(invoice.invoice_date, customer.cadence)
-    period_dates = f"{start_date.strftime('%m/%d/%Y')} - {end_date.strftime('%m/%d/%Y')}"
+    if invoice.period_start and invoice.period_end:
+        start_date, end_date = invoice.period_start, invoice.period_end
+    else:
+        start_date, end_date = get_period_dates(invoice.invoice_date, customer.cadence)
     
-    filename, buffer, _ = _generate_invoice_logic(
-        customer, 
-        invoice.invoice_date, 
-        invoice.period_label, 
-        period_dates, 
-        invoice.amount, 
-        return_buffer=True,
+    return build_render_snapshot(
+        customer,
+        invoice.invoice_date,
+        invoice.period_label,
+        format_period_dates(start_date, end_date),
+        invoice.amount,
+        # Recurring fees postdate these invoices, so they never carried any
+        include_recurring_fees=False,
         fee_2_type=invoice.fee_2_type,
         fee_2_amount=invoice.fee_2_amount,
         fee_3_type=invoice.fee_3_type,
@@ -439,4 +580,201 @@ def generate_invoice_buffer(invoice):
         additional_fee_desc=invoice.additional_fee_desc,
         additional_fee_amount=invoice.additional_fee_amount
     )
+
+RENDERERS = {"docx": render_invoice_snapshot, "pdf": render_invoice_pdf}
+
+def invoice_snapshot(invoice):
+    """
+    The render snapshot of an Invoice record. Uses the one stored on the invoice, so no
+    other rows are read, unless the invoice predates render snapshots.
+    """
+    if invoice.render_snapshot:
+        return json.loads(invoice.render_snapshot)
+    
+    # Invoice predates render snapshots (and hasn't been backfilled yet)
+    session = SessionLocal()
+    try:
+        customer = session.query(Customer).options(selectinload(Customer.properties)).get(invoice.customer_id)
+    finally:
+        session.close()
+    
+    if not customer:
+        raise ValueError("Customer not found")
+    return build_legacy_snapshot(invoice, customer)
+
+def render_key(snapshot, format="docx"):
+    """
+    Hash of everything a render depends on: the snapshot, the template version and the
+    renderer. Rendering is byte-deterministic, so equal keys mean identical files and
+    the key can serve as a strong ETag without rendering anything.
+    """
+    template = get_template(resolve_template(snapshot["template"]))
+    key = json.dumps([RENDER_VERSION, ARTIFACT_VERSION, format, template.version, snapshot],
+                     sort_keys=True, default=str)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def render_invoice(snapshot, format="docx"):
+    """Render a render snapshot as a .docx or (format="pdf") a PDF: (filename, BytesIO_object)."""
+    if format not in RENDERERS:
+        raise ValueError(f"Unknown invoice format: {format}")
+    filename, buffer, _ = RENDERERS[format](snapshot)
+    return filename, buffer
+
+def stored_invoice(snapshot, key, format="docx"):
+    """
+    (filename, file object) for a render snapshot whose render_key is `key`: the stored
+    document if there is one, else rendered now and stored for the next download.
+    """
+    store = get_store()
+    if store is not None:
+        try:
+            blob = store.get_ref(key)
+            stored = store.open(blob) if blob else None
+        except Exception as e:
+            print(f"Artifact store read failed, rendering instead: {e}")
+            stored = None
+        if stored is not None:
+            return invoice_filename(snapshot, format), stored
+
+    filename, buffer = render_invoice(snapshot, format)
+    if store is not None:
+        try:
+            store.set_ref(key, store.put(buffer.getvalue()))
+        except Exception as e:
+            print(f"Could not store invoice {filename}: {e}")
     return filename, buffer
+
+def _store_snapshot(store, snapshot, key, format):
+    if store.get_ref(key):
+        return False
+    _, buffer = render_invoice(snapshot, format)
+    store.set_ref(key, store.put(buffer.getvalue()))
+    return True
+
+def store_invoice_documents(render_snapshots, format="docx"):
+    """
+    Render and store the documents for invoices' render snapshots (the JSON stored in
+    Invoice.render_snapshot), STORE_WORKERS at a time, so their downloads stream stored
+    bytes. Already-stored ones are skipped. Returns how many distinct documents were
+    stored; a store error is logged and leaves the rest to be rendered on download.
+    """
+    store = get_store()
+    if store is None:
+        return 0
+    try:
+        # One render per distinct render key: invoices with identical inputs share a document,
+        # and rendering the same key in two workers at once would store (and count) it twice
+        pending = {}
+        for render_snapshot in render_snapshots:
+            if render_snapshot:
+                snapshot = json.loads(render_snapshot)
+                pending.setdefault(render_key(snapshot, format), snapshot)
+        with ThreadPoolExecutor(max_workers=STORE_WORKERS) as pool:
+            stored = list(pool.map(lambda item: _store_snapshot(store, item[1], item[0], format), pending.items()))
+    except Exception as e:
+        print(f"Could not store invoice documents: {e}")
+        return 0
+    return sum(stored)
+
+def generate_invoice_buffer(invoice, format="docx"):
+    """
+    Regenerates the invoice document in-memory for a given Invoice record, as a .docx
+    or (format="pdf") a PDF. Returns (filename, BytesIO_object).
+    """
+    if format not in RENDERERS:
+        raise ValueError(f"Unknown invoice format: {format}")
+    return render_invoice(invoice_snapshot(invoice), format)
+
+def invoice_snapshots(invoices):
+    """
+    Yield (invoice, render snapshot) for each invoice. Invoices without a render snapshot
+    get their customers loaded in a single query rather than one per invoice; those whose
+    customer is gone are skipped.
+    """
+    legacy_ids = {inv.customer_id for inv in invoices if not inv.render_snapshot}
+    customers = {}
+    if legacy_ids:
+        session = SessionLocal()
+        try:
+            customers = {
+                c.id: c for c in session.query(Customer)
+                .options(selectinload(Customer.properties))
+                .filter(Customer.id.in_(legacy_ids))
+            }
+        finally:
+            session.close()
+
+    for invoice in invoices:
+        if invoice.render_snapshot:
+            yield invoice, json.loads(invoice.render_snapshot)
+        elif invoice.customer_id in customers:
+            yield invoice, build_legacy_snapshot(invoice, customers[invoice.customer_id])
+        else:
+            print(f"Skipping invoice {invoice.id}: customer not found")
+
+def generate_invoice_archive(invoices, format="docx"):
+    """
+    Render several invoices into one in-memory zip (BytesIO), one .docx (or PDF) per
+    invoice. Each is written to the zip as soon as it's rendered and then dropped.
+    """
+    render = RENDERERS[format]
+    archive = io.BytesIO()
+    used_names = set()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+        for invoice, snapshot in invoice_snapshots(invoices):
+            filename, buffer, _ = render(snapshot)
+            if filename in used_names:
+                filename = f"{os.path.splitext(filename)[0]}_{invoice.id}.{format}"
+            used_names.add(filename)
+            zf.writestr(zipfile.ZipInfo(filename, ZIP_DATE_TIME), buffer.getvalue(), zipfile.ZIP_DEFLATED)
+    archive.seek(0)
+    return archive
+
+def invoices_for_period(session, period_from=None, period_to=None):
+    """Invoices whose billing period overlaps [period_from, period_to], by customer name then date."""
+    filters = []
+    if period_from:
+        filters.append(Invoice.period_end >= period_from)
+    if period_to:
+        filters.append(Invoice.period_start <= period_to)
+    return (
+        session.query(Invoice)
+        .outerjoin(Customer, Invoice.customer_id == Customer.id)
+        .filter(*filters)
+        .order_by(Customer.name.asc(), Invoice.invoice_date.desc())
+        .all()
+    )
+
+def write_invoices_pdf(out, invoices):
+    """
+    Write invoices to the file object `out` as one PDF, every invoice starting a new page.
+    Pages are written as they're laid out; fonts and logos are shared by all of them.
+    Returns the number of invoices written.
+    """
+    pdf = InvoicePdf(out)
+    count = 0
+    for _, snapshot in invoice_snapshots(invoices):
+        add_invoice_pdf(pdf, snapshot)
+        count += 1
+    pdf.close()
+    return count
+
+def generate_merged_documents(invoices, name="Invoices"):
+    """
+    Render invoices into print-ready merged documents, every invoice starting a new page,
+    in the order given. Returns [(filename, BytesIO)]: one .docx, or one per template
+    when the invoices use several (they can't share one package).
+    """
+    groups = {}
+    for _, snapshot in invoice_snapshots(invoices):
+        doc, _ = build_invoice_document(snapshot)
+        groups.setdefault(resolve_template(snapshot["template"]), []).append(doc)
+
+    documents = []
+    for template_name, docs in groups.items():
+        buffer = io.BytesIO()
+        merge_documents(docs, buffer)
+        buffer.seek(0)
+        suffix = "" if len(groups) == 1 else "_" + os.path.splitext(template_name)[0]
+        documents.append((f"{name}{suffix}.docx", buffer))
+    return documents
@@ -0,0 +1,503 @@
+"""
+PDF invoices, written directly from the invoice data: no Word, LibreOffice or PDF library.
+
+A template's body and footer are read once per template version into a simple layout
+(paragraphs of styled text runs, table rows and the logo), cached for the life of the
+process like the compiled templates. Each invoice fills that layout's placeholders and
+is laid out in Helvetica, a font every PDF reader has built in, so there are no font
+files to embed. The logo's PNG or JPEG data goes into the PDF as is (PDF reads both
+compressions natively), and each font and image is written once per file and shared
+by every page that uses it.
+
+PdfWriter writes each object to the output as soon as it's made, so a print run of
+hundreds of invoices never holds more than the current page in memory:
+
+    with open("invoices.pdf", "wb") as f:
+        pdf = InvoicePdf(f)
+        for layout, values, omitted, property_items in invoices:
+            pdf.add_invoice(layout, values, omitted, property_items)
+        pdf.close()
+
+The layout is an approximation of Word's: paragraph alignment and spacing, run sizes
+and bold, line breaks, tabs, table rows as columns, and a floating logo that text
+flows beside. Typefaces, colours and borders are not reproduced.
+"""
+import re
+import struct
+import threading
+import zlib
+from collections import namedtuple
+
+from lxml import etree
+
+from template_artifact import DOCUMENT_PART
+from template_compiler import PROPERTY_PLACEHOLDERS
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+WP = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+RELS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+EMU_PER_POINT = 12700
+LINE_HEIGHT = 1.2     # line height as a multiple of the font size
+TAB = "    "
+CACHE_SIZE = 8
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([A-Za-z0-9_]+)\}\}")
+_TOKENS = re.compile(r"[^\S\n]+|[^\s]+")
+
+# Advance widths (1/1000 em) of characters 32-126 in the standard Helvetica fonts
+_HELVETICA = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556, 1015,
+    667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778, 667, 778,
+    722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556, 333,
+    556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556, 556, 556,
+    333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+_HELVETICA_BOLD = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611, 975,
+    722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778, 667, 778,
+    722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556, 333,
+    556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611, 611, 611,
+    389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+FONTS = {False: (b"F1", b"Helvetica", _HELVETICA), True: (b"F2", b"Helvetica-Bold", _HELVETICA_BOLD)}
+
+Run = namedtuple("Run", "text size bold")
+# image is an Image or None; names are the placeholders in the paragraph
+Paragraph = namedtuple("Paragraph", "runs align before after size image names")
+Row = namedtuple("Row", "cells widths names")
+# x/y are offsets from the margin and paragraph for a floating (anchored) image
+Image = namedtuple("Image", "key width height anchored x y wrap")
+Page = namedtuple("Page", "width height left right top bottom footer")
+
+def text_width(text, size, bold=False):
+    widths = FONTS[bold][2]
+    return sum(widths[ord(c) - 32] if 32 <= ord(c) <= 126 else 556 for c in text) * size / 1000
+
+def _pdf_string(text):
+    data = text.encode("cp1252", "replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+# --- Reading the template ---
+
+def _member(artifact, name):
+    """Uncompressed bytes of one zip member of an artifact, placeholders left in place; None if absent."""
+    for member in artifact["members"]:
+        if member[1] != name:
+            continue
+        if member[0] == "part":
+            return _segments_text(member[3]).encode("utf-8")
+        _, _, _, compress_type, _, _, data = member
+        return zlib.decompress(data, -15) if compress_type else data
+    return None
+
+def _segments_text(segments):
+    out = []
+    for segment in segments:
+        if segment.__class__ is str:
+            out.append(segment)
+        elif segment[0] == "slot":
+            out.append("{{%s}}" % segment[1])
+        else:
+            out.append(_segments_text(segment[2]))
+    return "".join(out)
+
+def _twips(elem, attr, default=0):
+    value = elem.get(W + attr) if elem is not None else None
+    return int(value) / 20 if value and value.lstrip("-").isdigit() else default
+
+def _on(elem):
+    return elem is not None and elem.get(W + "val", "true") not in ("false", "0", "off")
+
+def _size(rpr, default):
+    sz = rpr.find(W + "sz") if rpr is not None else None
+    return int(sz.get(W + "val")) / 2 if sz is not None else default
+
+def _image_object(name, data):
+    """(image dictionary entries, stream data) for a PNG or JPEG, or None if it can't be used as is."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        position, idat, palette, header = 8, [], None, None
+        while position < len(data):
+            length, kind = struct.unpack(">I4s", data[position:position + 8])
+            chunk = data[position + 8:position + 8 + length]
+            if kind == b"IHDR":
+                header = struct.unpack(">IIBBBBB", chunk)
+            elif kind == b"PLTE":
+                palette = chunk
+            elif kind == b"IDAT":
+                idat.append(chunk)
+            position += 12 + length
+        width, height, depth, color, _, _, interlace = header
+        colors = {0: 1, 2: 3, 3: 1}.get(color)
+        if colors is None or interlace:
+            # Transparency or interlacing would need the pixels decoded and split
+            print(f"Skipping logo {name} in PDFs: PNGs with transparency or interlacing aren't supported")
+            return None
+        if color == 3:
+            space = b"[/Indexed /DeviceRGB %d <%s>]" % (len(palette) // 3 - 1, palette.hex().encode())
+        else:
+            space = b"/DeviceGray" if color == 0 else b"/DeviceRGB"
+        entries = (b"/Width %d /Height %d /ColorSpace %s /BitsPerComponent %d /Filter /FlateDecode "
+                   b"/DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent %d /Columns %d >>"
+                   % (width, height, space, depth, colors, depth, width))
+        return entries, b"".join(idat)
+    if data[:2] == b"\xff\xd8":
+        position = 2
+        while position < len(data):
+            marker, length = struct.unpack(">HH", data[position:position + 4])
+            if marker in (0xFFC0, 0xFFC1, 0xFFC2):
+                depth, height, width, components = struct.unpack(">BHHB", data[position + 4:position + 10])
+                space = {1: b"/DeviceGray", 3: b"/DeviceRGB", 4: b"/DeviceCMYK"}[components]
+                return (b"/Width %d /Height %d /ColorSpace %s /BitsPerComponent %d /Filter /DCTDecode"
+                        % (width, height, space, depth), data)
+            position += 2 + length
+    print(f"Skipping logo {name} in PDFs: only PNG and JPEG images are supported")
+    return None
+
+class TemplateLayout:
+    """A template's page setup, body and footer, parsed once and filled in for each invoice."""
+
+    def __init__(self, artifact):
+        self._artifact = artifact
+        styles = _member(artifact, "word/styles.xml")
+        self.default_size = 11
+        if styles:
+            root = etree.fromstring(styles)
+            self.default_size = _size(root.find(f"{W}docDefaults/{W}rPrDefault/{W}rPr"), self.default_size)
+            for style in root.iter(W + "style"):
+                if style.get(W + "styleId") == "Normal":
+                    self.default_size = _size(style.find(W + "rPr"), self.default_size)
+
+        rels = {}
+        rels_xml = _member(artifact, "word/_rels/document.xml.rels")
+        if rels_xml:
+            for rel in etree.fromstring(rels_xml).iter(RELS + "Relationship"):
+                rels[rel.get("Id")] = "word/" + rel.get("Target").lstrip("/").replace("word/", "", 1)
+        self._rels = rels
+        self.images = {}    # part name -> (image dictionary entries, stream data)
+
+        body = etree.fromstring(_member(artifact, DOCUMENT_PART)).find(W + "body")
+        section = body.find(W + "sectPr")
+        size = section.find(W + "pgSz") if section is not None else None
+        margins = section.find(W + "pgMar") if section is not None else None
+        self.page = Page(_twips(size, "w", 612), _twips(size, "h", 792),
+                         _twips(margins, "left", 72), _twips(margins, "right", 72),
+                         _twips(margins, "top", 72), _twips(margins, "bottom", 72), _twips(margins, "footer", 36))
+
+        self.blocks = []
+        for child in body:
+            if child.tag == W + "p":
+                self.blocks.append(self._paragraph(child))
+            elif child.tag == W + "tbl":
+                widths = [_twips(col, "w") for col in child.iter(W + "gridCol")]
+                for row in child.iter(W + "tr"):
+                    cells = [[self._paragraph(p) for p in cell.iter(W + "p")] for cell in row.iter(W + "tc")]
+                    names = frozenset().union(*(p.names for cell in cells for p in cell))
+                    self.blocks.append(Row(cells, widths if len(widths) == len(cells) else None, names))
+
+        self.footer = []
+        if section is not None:
+            for reference in section.iter(W + "footerReference"):
+                if reference.get(W + "type") == "default" and reference.get(R + "id") in rels:
+                    footer = _member(artifact, rels[reference.get(R + "id")])
+                    if footer:
+                        self.footer = [self._paragraph(p) for p in etree.fromstring(footer).iter(W + "p")]
+        self.has_repeat = any(block.names & set(PROPERTY_PLACEHOLDERS) for block in self.blocks)
+
+    def _paragraph(self, p):
+        ppr = p.find(W + "pPr")
+        align = ppr.find(W + "jc").get(W + "val") if ppr is not None and ppr.find(W + "jc") is not None else "left"
+        spacing = ppr.find(W + "spacing") if ppr is not None else None
+        mark_size = _size(ppr.find(W + "rPr") if ppr is not None else None, self.default_size)
+        runs, image = [], None
+        for r in p.iter(W + "r"):
+            rpr = r.find(W + "rPr")
+            size, bold = _size(rpr, self.default_size), _on(rpr.find(W + "b") if rpr is not None else None)
+            text = []
+            for child in r:
+                if child.tag == W + "t":
+                    text.append(child.text or "")
+                elif child.tag == W + "tab":
+                    text.append(TAB)
+                elif child.tag == W + "cr" or (child.tag == W + "br" and child.get(W + "type", "textWrapping") == "textWrapping"):
+                    text.append("\n")
+                elif child.tag == W + "drawing" and image is None:
+                    image = self._image(child)
+            if text:
+                runs.append(Run("".join(text), size, bold))
+        names = frozenset(PLACEHOLDER_PATTERN.findall("".join(run.text for run in runs)))
+        return Paragraph(runs, {"center": "center", "right": "right", "end": "right"}.get(align, "left"),
+                         _twips(spacing, "before"), _twips(spacing, "after"), mark_size, image, names)
+
+    def _image(self, drawing):
+        blip = drawing.find(f".//{A}blip")
+        extent = drawing.find(f".//{WP}extent")
+        key = self._rels.get(blip.get(R + "embed")) if blip is not None else None
+        if key is None or extent is None:
+            return None
+        if key not in self.images:
+            self.images[key] = None
+            data = _member(self._artifact, key)
+            if data:
+                self.images[key] = _image_object(key, data)
+        if self.images[key] is None:
+            return None
+        width, height = int(extent.get("cx")) / EMU_PER_POINT, int(extent.get("cy")) / EMU_PER_POINT
+        anchor = drawing.find(WP + "anchor")
+        if anchor is None:
+            return Image(key, width, height, False, 0, 0, False)
+        offsets = [anchor.find(f"{WP}{axis}/{WP}posOffset") for axis in ("positionH", "positionV")]
+        x, y = (int(o.text) / EMU_PER_POINT if o is not None else 0 for o in offsets)
+        wrap = any(anchor.find(WP + kind) is not None for kind in ("wrapSquare", "wrapTight", "wrapThrough", "wrapTopAndBottom"))
+        return Image(key, width, height, True, x, y, wrap)
+
+_lock = threading.Lock()
+_layouts = {}   # template version -> TemplateLayout, oldest first
+
+def template_layout(template):
+    """The PDF layout of a compiled template (see template_registry), built once per version."""
+    with _lock:
+        layout = _layouts.get(template.version)
+    if layout is None:
+        layout = TemplateLayout(template.artifact)
+        with _lock:
+            _layouts[template.version] = layout
+            while len(_layouts) > CACHE_SIZE:
+                del _layouts[next(iter(_layouts))]
+    return layout
+
+# --- Writing the PDF ---
+
+class PdfWriter:
+    """Writes numbered PDF objects to a file object as they're added, then the cross-reference table."""
+
+    def __init__(self, out):
+        self.out = out
+        self.position = 0
+        self.offsets = {}
+        self.count = 0
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def reserve(self):
+        self.count += 1
+        return self.count
+
+    def add(self, body, number=None):
+        number = number or self.reserve()
+        self.offsets[number] = self.position
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        return number
+
+    def add_stream(self, entries, data, number=None):
+        return self.add(b"<< %s /Length %d >>\nstream\n%s\nendstream" % (entries, len(data), data), number)
+
+    def close(self, root):
+        xref = self.position
+        entries = [b"0000000000 65535 f \n"] + [b"%010d 00000 n \n" % self.offsets[n] for n in range(1, self.count + 1)]
+        self._write(b"xref\n0 %d\n%s" % (self.count + 1, b"".join(entries)))
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.count + 1, root, xref))
+
+class InvoicePdf:
+    """A PDF of one or more invoices, each starting on a new page, written to `out` as it's built."""
+
+    def __init__(self, out):
+        self.writer = PdfWriter(out)
+        self.pages_number = self.writer.reserve()
+        self.fonts = {}
+        self.images = {}    # (template layout, image part) -> object number, written on first use
+        self.pages = []
+        self._ops = None
+
+    # Pages
+
+    def _start_page(self, layout):
+        self._finish_page()
+        self.layout = layout
+        self._ops = []
+        self._resources = set()
+        self._exclusions = []
+        page = layout.page
+        self.y = page.height - page.top
+
+    def _finish_page(self):
+        if self._ops is None:
+            return
+        self._draw_footer()
+        writer = self.writer
+        content = writer.add_stream(b"/Filter /FlateDecode", zlib.compress(b"".join(self._ops), 6))
+        fonts = b"".join(b"/%s %d 0 R " % (name, number) for name, number in sorted(self.fonts.items())
+                         if name in self._resources)
+        images = b"".join(b"/Im%d %d 0 R " % (number, number) for number in sorted(self._resources - set(self.fonts)))
+        page = self.layout.page
+        self.pages.append(writer.add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources << /Font << %s>> /XObject << %s>> >> "
+            b"/Contents %d 0 R >>" % (self.pages_number, _num(page.width), _num(page.height), fonts, images, content)))
+        self._ops = None
+
+    def close(self):
+        self._finish_page()
+        kids = b" ".join(b"%d 0 R" % number for number in self.pages)
+        self.writer.add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)), self.pages_number)
+        self.writer.close(self.writer.add(b"<< /Type /Catalog /Pages %d 0 R >>" % self.pages_number))
+
+    # Drawing
+
+    def _font(self, bold):
+        name, base, _ = FONTS[bold]
+        if name not in self.fonts:
+            self.fonts[name] = self.writer.add(b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % base)
+        self._resources.add(name)
+        return name
+
+    def _text(self, x, y, text, size, bold):
+        self._ops.append(b"BT /%s %s Tf %s %s Td %s Tj ET\n"
+                         % (self._font(bold), _num(size), _num(x), _num(y), _pdf_string(text)))
+
+    def _image(self, image, x, y):
+        key = (id(self.layout), image.key)
+        if key not in self.images:
+            entries, data = self.layout.images[image.key]
+            self.images[key] = self.writer.add_stream(b"/Type /XObject /Subtype /Image " + entries, data)
+        number = self.images[key]
+        self._resources.add(number)
+        self._ops.append(b"q %s 0 0 %s %s %s cm /Im%d Do Q\n"
+                         % (_num(image.width), _num(image.height), _num(x), _num(y), number))
+
+    def _span(self, x0, x1, top, height):
+        """The horizontal space free of floating images for a line from `top` down `height`."""
+        for left, right, ex_top, ex_bottom in self._exclusions:
+            if ex_top > top - height and ex_bottom < top:
+                if (left + right) / 2 < (x0 + x1) / 2:
+                    x0 = max(x0, right)
+                else:
+                    x1 = min(x1, left)
+        return x0, x1
+
+    def _paragraph(self, paragraph, values, item, x0, x1, breaks=True):
+        """Lay out one paragraph from self.y down, starting new pages as needed when `breaks`."""
+        self.y -= paragraph.before
+        if paragraph.image and paragraph.image.anchored:
+            image = paragraph.image
+            left = self.layout.page.left + image.x
+            top = self.y - image.y
+            self._image(image, left, top - image.height)
+            if image.wrap:
+                self._exclusions.append((left - 9, left + image.width + 9, top, top - image.height))
+
+        def fill(text):
+            return PLACEHOLDER_PATTERN.sub(
+                lambda m: item[m.group(1)] if item and m.group(1) in item else values.get(m.group(1), m.group(0)), text)
+
+        lines = [[]]
+        for run in paragraph.runs:
+            for i, part in enumerate(fill(run.text).split("\n")):
+                if i:
+                    lines.append([])
+                lines[-1].extend((token, run.size, run.bold) for token in _TOKENS.findall(part))
+
+        if paragraph.image and not paragraph.image.anchored:
+            lines[0][:0] = [(paragraph.image, paragraph.image.height, False)]
+
+        for tokens in lines:
+            height = max((size for _, size, _ in tokens), default=paragraph.size) * LINE_HEIGHT
+            wrapped = False
+            while True:
+                if breaks and self.y - height < self.layout.page.bottom:
+                    self._start_page(self.layout)
+                left, right = self._span(x0, x1, self.y, height)
+                pieces, width = [], 0
+                while tokens:
+                    token, size, bold = tokens[0]
+                    if isinstance(token, Image):
+                        token_width = token.width
+                    else:
+                        token_width = text_width(token, size, bold)
+                        if token.isspace() and (wrapped and not pieces or width + token_width > right - left):
+                            tokens.pop(0)
+                            continue
+                    if pieces and width + token_width > right - left:
+                        break
+                    pieces.append((token, size, bold, token_width))
+                    width += token_width
+                    tokens.pop(0)
+
+                while pieces and not isinstance(pieces[-1][0], Image) and pieces[-1][0].isspace():
+                    width -= pieces.pop()[3]
+                x = {"center": (left + right - width) / 2, "right": right - width}.get(paragraph.align, left)
+                line_size = max((size for _, size, _, _ in pieces), default=paragraph.size)
+                baseline = self.y - line_size
+                # One text operation per stretch of the same font and size
+                text, text_x, style = [], x, None
+                for token, size, bold, token_width in pieces + [(None, None, None, 0)]:
+                    if text and (token is None or isinstance(token, Image) or (size, bold) != style):
+                        self._text(text_x, baseline, "".join(text), *style)
+                        text = []
+                    if isinstance(token, Image):
+                        self._image(token, x, self.y - token.height)
+                    elif token is not None:
+                        if not text:
+                            text_x, style = x, (size, bold)
+                        text.append(token)
+                    x += token_width
+                self.y -= line_size * LINE_HEIGHT
+                wrapped = True
+                if not tokens:
+                    break
+        self.y -= paragraph.after
+
+    def _draw_footer(self):
+        if not self.layout.footer:
+            return
+        page = self.layout.page
+        ops, exclusions, y = self._ops, self._exclusions, self.y
+        # Lay the footer out once to measure it, then again above the footer margin
+        self._ops, self._exclusions, self.y = [], [], 0
+        for paragraph in self.layout.footer:
+            self._paragraph(paragraph, self._values, None, page.left, page.width - page.right, breaks=False)
+        self._ops, self.y = ops, page.footer - self.y
+        for paragraph in self.layout.footer:
+            self._paragraph(paragraph, self._values, None, page.left, page.width - page.right, breaks=False)
+        self._exclusions, self.y = exclusions, y
+
+    def add_invoice(self, layout, values, omitted=(), property_items=()):
+        """
+        Add one invoice on new pages. values maps placeholder name to text; blocks holding
+        an `omitted` fee line are left out, and per-property blocks repeat for each of
+        `property_items` ({placeholder name: text}).
+        """
+        self._finish_page()
+        self._values = values
+        self._start_page(layout)
+        page = layout.page
+        x0, x1 = page.left, page.width - page.right
+        omitted = set(omitted)
+        for block in layout.blocks:
+            if block.names & omitted:
+                continue
+            items = property_items if block.names & set(PROPERTY_PLACEHOLDERS) else [None]
+            for item in items:
+                if isinstance(block, Paragraph):
+                    self._paragraph(block, values, item, x0, x1)
+                    continue
+                widths = block.widths or [1] * len(block.cells)
+                scale = (x1 - x0) / sum(widths)
+                top, bottom, left = self.y, self.y, x0
+                for cell, width in zip(block.cells, widths):
+                    self.y = top
+                    for paragraph in cell:
+                        self._paragraph(paragraph, values, item, left + 5, left + width * scale - 5, breaks=False)
+                    bottom = min(bottom, self.y)
+                    left += width * scale
+                self.y = bottom
+                if self.y < page.bottom:
+                    self._start_page(layout)
+
+def _num(value):
+    return (b"%.2f" % value).rstrip(b"0").rstrip(b".")
@@ -1,5 +1,5 @@
-from datetime import date
-from sqlalchemy import create_engine, Column, Integer, String, Date, Float, Text, ForeignKey, Boolean
+from datetime import date, datetime
+from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime, Float, Text, ForeignKey, Boolean, Index, func, literal_column
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
@@ -48,8 +48,12 @@ class Customer(Base):
     additional_fee_desc = Column(String, nullable=True)
     additional_fee_amount = Column(Float, nullable=True)
     next_bill_date = Column(Date, nullable=False)
+    template_name = Column(String, nullable=True)  # invoice template; None uses Settings.default_template_name
 
     properties = relationship("Property", back_populates="customer", cascade="all, delete-orphan")
+    # Fees beyond the fee_2/fee_3/additional slots above, billed every period
+    recurring_fees = relationship("CustomerRecurringFee", back_populates="customer", cascade="all, delete-orphan",
+                                  order_by="CustomerRecurringFee.position")
 
 class Property(Base):
     __tablename__ = "properties"
@@ -65,6 +69,18 @@ class Property(Base):
 
     customer = relationship("Customer", back_populates="properties")
 
+class CustomerRecurringFee(Base):
+    __tablename__ = "customer_recurring_fees"
+
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, ForeignKey("customers.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False, default=0)
+    fee_type = Column(String, nullable=False)
+    description = Column(String, nullable=True)  # printed as "description = $x" instead of a period line
+    amount = Column(Float, nullable=False)
+
+    customer = relationship("Customer", back_populates="recurring_fees")
+
 class Invoice(Base):
     __tablename__ = "invoices"
 
@@ -72,8 +88,9 @@ class Invoice(Base):
     customer_id = Column(Integer, nullable=False)
     invoice_date = Column(Date, nullable=False)
     period_label = Column(String, nullable=False)   # e.g. "3rd quarter 2025"
-    amount = Column(Float, nullable=False)
-    file_path = Column(String, nullable=False)      # path to generated docx
+    amount = Column(Float, nullable=False)          # base rate only
+    total_amount = Column(Float, nullable=True)     # base rate plus every fee, as billed
+    file_path = Column(String, nullable=False)      # download filename; the document is kept in artifact_store
     email_subject = Column(String, nullable=False)
     email_body = Column(Text, nullable=False)
     
@@ -88,6 +105,73 @@ class Invoice(Base):
     status = Column(String, default="Unpaid")
     paid_date = Column(Date, nullable=True)
 
+    # Billing period covered by the invoice (period_label is only a display string)
+    period_start = Column(Date, nullable=True, index=True)
+    period_end = Column(Date, nullable=True, index=True)
+
+    # JSON of everything the renderer needs (see invoice_generator.build_render_snapshot),
+    # so re-downloading reads only this row and isn't affected by later customer edits
+    render_snapshot = Column(Text, nullable=True)
+
+    # Set on insert and on every UPDATE (including bulk ones); the analytics export uses it as a watermark
+    updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    lines = relationship("InvoiceLine", back_populates="invoice", cascade="all, delete-orphan",
+                         order_by="InvoiceLine.position")
+
+    __table_args__ = (
+        Index("ix_invoices_customer_period", "customer_id", "period_start"),
+    )
+
+class InvoiceLine(Base):
+    __tablename__ = "invoice_lines"
+
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)           # "base", "fee_2", "fee_3", "fee" or "property" (see fee_lines)
+    fee_type = Column(String, nullable=False)       # e.g. "Management Fee", "Inspection Fee"
+    description = Column(String, nullable=True)     # additional-fee text or property address
+    amount = Column(Float, nullable=False)
+
+    invoice = relationship("Invoice", back_populates="lines")
+
+class ReceivableBalance(Base):
+    """
+    Unpaid invoice totals per customer, invoice date and billing period. Kept in step
+    with invoices by reports.adjust_receivables; rows reaching zero open invoices are removed.
+    """
+    __tablename__ = "receivable_balances"
+
+    id = Column(Integer, primary_key=True, index=True)
+    customer_id = Column(Integer, nullable=False, index=True)
+    invoice_date = Column(Date, nullable=False, index=True)
+    period_start = Column(Date, nullable=True)
+    period_end = Column(Date, nullable=True)
+    open_count = Column(Integer, nullable=False, default=0)
+    open_amount = Column(Float, nullable=False, default=0.0)
+
+# One balance per key. NULLs never collide in a unique index, so an invoice without a
+# billing period is keyed on NO_PERIOD instead; reports.adjust_receivables upserts on this.
+NO_PERIOD = literal_column("'1900-01-01'")
+RECEIVABLE_KEY = Index(
+    "uq_receivable_balances_key",
+    ReceivableBalance.customer_id, ReceivableBalance.invoice_date,
+    func.coalesce(ReceivableBalance.period_start, NO_PERIOD), func.coalesce(ReceivableBalance.period_end, NO_PERIOD),
+    unique=True,
+)
+
+class DeletedInvoice(Base):
+    """
+    One row per deleted invoice, written by analytics_snapshot.record_invoice_deletions
+    before the delete, so incremental analytics snapshots can drop the invoice and its lines.
+    """
+    __tablename__ = "deleted_invoices"
+
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 class FeeType(Base):
     __tablename__ = "fee_types"
 
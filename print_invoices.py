@@ -0,0 +1,64 @@
+"""
+Print-ready merged invoices for a billing period.
+
+Writes every invoice whose period overlaps the given dates into one .docx, each invoice
+starting a new page, for mailing runs. The invoices share one package, so the logo,
+styles and fonts are stored once however many invoices there are.
+
+    python print_invoices.py 2025-10-01 2025-12-31
+    python print_invoices.py 2025-10-01 2025-12-31 --out mailing/
+    python print_invoices.py 2025-10-01 2025-12-31 --format pdf
+
+A PDF print run is written to its file page by page as the invoices are laid out.
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+from models import SessionLocal
+from invoice_generator import generate_merged_documents, invoices_for_period, write_invoices_pdf
+
+def write_print_run(period_from, period_to, out_dir=".", format="docx"):
+    """Write the merged document(s) for the period to out_dir. Returns (paths, invoice count)."""
+    session = SessionLocal()
+    try:
+        invoices = invoices_for_period(session, period_from, period_to)
+    finally:
+        session.close()
+    if not invoices:
+        return [], 0
+
+    os.makedirs(out_dir, exist_ok=True)
+    name = f"Invoices_{period_from}_{period_to}"
+    if format == "pdf":
+        path = os.path.join(out_dir, name + ".pdf")
+        with open(path, "wb") as f:
+            write_invoices_pdf(f, invoices)
+        return [path], len(invoices)
+
+    paths = []
+    for filename, buffer in generate_merged_documents(invoices, name):
+        path = os.path.join(out_dir, filename)
+        with open(path, "wb") as f:
+            f.write(buffer.getvalue())
+        paths.append(path)
+    return paths, len(invoices)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge every invoice of a billing period into one printable .docx or PDF.")
+    parser.add_argument("period_from", type=date.fromisoformat, help="First day of the period (YYYY-MM-DD)")
+    parser.add_argument("period_to", type=date.fromisoformat, help="Last day of the period (YYYY-MM-DD)")
+    parser.add_argument("--out", default=".", help="Output directory (default: current directory)")
+    parser.add_argument("--format", choices=("docx", "pdf"), default="docx")
+    args = parser.parse_args(argv)
+
+    paths, count = write_print_run(args.period_from, args.period_to, args.out, args.format)
+    if not paths:
+        print("No invoices in this period", file=sys.stderr)
+        return 1
+    print(f"{count} invoices -> {', '.join(paths)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
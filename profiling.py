@@ -0,0 +1,133 @@
+"""
+Opt-in per-request profiling.
+
+Enable with INVOICE_PROFILING=1. A request is then profiled when it carries `?_profile=1`
+or an `X-Profile: 1` header: a background thread samples the request thread's stack and
+the result is written as a collapsed-stack file (`frame;frame;frame count` per line),
+which speedscope and flamegraph.pl open directly. Captured profiles are listed at /_profiles.
+
+    INVOICE_PROFILE_DIR          where profiles are written (default: <tmp>/invoice_profiles)
+    INVOICE_PROFILE_INTERVAL_MS  sampling interval (default: 5)
+"""
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, request, render_template, send_from_directory, abort
+
+PROFILE_EXTENSION = ".collapsed"
+MAX_PROFILES = 200
+
+class StackSampler:
+    """Periodically record the stack of one thread until stopped."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                stack.append(name.replace(";", ":"))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def _wants_profile():
+    return request.args.get("_profile") == "1" or request.headers.get("X-Profile") == "1"
+
+def _profile_filename(elapsed):
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", request.path).strip("_") or "root"
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return f"{stamp}_{request.method}_{slug}_{int(elapsed * 1000)}ms{PROFILE_EXTENSION}"
+
+def _prune(profile_dir):
+    files = sorted(f for f in os.listdir(profile_dir) if f.endswith(PROFILE_EXTENSION))
+    for old in files[:-MAX_PROFILES]:
+        os.remove(os.path.join(profile_dir, old))
+
+def init_profiling(app, enabled=None, profile_dir=None, interval_ms=None):
+    """Register the profiling hooks and the /_profiles pages on `app` when profiling is enabled."""
+    if enabled is None:
+        enabled = os.getenv("INVOICE_PROFILING", "").lower() in ("1", "true", "yes")
+    if not enabled:
+        return
+
+    profile_dir = profile_dir or os.getenv("INVOICE_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "invoice_profiles")
+    interval = (interval_ms or float(os.getenv("INVOICE_PROFILE_INTERVAL_MS", "5"))) / 1000.0
+    os.makedirs(profile_dir, exist_ok=True)
+    app.config["PROFILE_DIR"] = profile_dir
+
+    def finish_profile():
+        sampler = g.pop("profiler", None)
+        if sampler is None:
+            return None
+        sampler.stop()
+        filename = _profile_filename(sampler.elapsed)
+        with open(os.path.join(profile_dir, filename), "w") as f:
+            f.write(sampler.collapsed())
+        _prune(profile_dir)
+        return filename
+
+    @app.before_request
+    def start_profile():
+        if request.path.startswith("/_profiles") or not _wants_profile():
+            return
+        g.profiler = StackSampler(threading.get_ident(), interval)
+        g.profiler.start()
+
+    @app.after_request
+    def stop_profile(response):
+        filename = finish_profile()
+        if filename:
+            response.headers["X-Profile-File"] = filename
+        return response
+
+    @app.teardown_request
+    def stop_profile_on_error(exc):
+        # after_request doesn't run when the view raised, so make sure the sampler stops
+        finish_profile()
+
+    @app.route("/_profiles")
+    def list_profiles():
+        profiles = []
+        for name in sorted(os.listdir(profile_dir), reverse=True):
+            if name.endswith(PROFILE_EXTENSION):
+                stat = os.stat(os.path.join(profile_dir, name))
+                profiles.append({
+                    "name": name,
+                    "size": stat.st_size,
+                    "captured": datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                })
+        return render_template("profiles.html", profiles=profiles, profile_dir=profile_dir)
+
+    @app.route("/_profiles/<path:name>")
+    def download_profile(name):
+        if not name.endswith(PROFILE_EXTENSION):
+            abort(404)
+        return send_from_directory(profile_dir, name, as_attachment=True, mimetype="text/plain")
@@ -0,0 +1,195 @@
+"""
+Match a bank/processor payments CSV against open invoices and mark the matches Paid.
+
+The CSV is read one row at a time. Recognised columns (case-insensitive, extra columns
+are ignored): email, name (or payer), amount, date (or paid_date), period. A payment
+needs an amount and an email or name; the period may be a label such as "October 2025"
+or "3rd quarter 2025", or any date inside the billing period.
+
+    python reconcile.py payments.csv --unmatched review.csv
+"""
+import argparse
+import csv
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import select, update, func
+
+from models import SessionLocal, Invoice, Customer
+from invoice_generator import parse_period_label
+from reports import INVOICE_TOTAL, adjust_receivables
+
+COLUMN_ALIASES = {
+    "email": "email", "customer_email": "email",
+    "name": "name", "payer": "name", "customer": "name", "customer_name": "name",
+    "amount": "amount", "paid_amount": "amount",
+    "date": "date", "paid_date": "date", "payment_date": "date",
+    "period": "period", "period_label": "period",
+}
+
+def _cents(amount):
+    return int(round(amount * 100))
+
+def _parse_amount(value):
+    return float((value or "").replace("$", "").replace(",", "").strip())
+
+def _parse_date(value):
+    value = (value or "").strip()
+    for fmt in ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+def _normalize_row(row):
+    normalized = {}
+    for key, value in row.items():
+        field = COLUMN_ALIASES.get((key or "").strip().lower())
+        if field:
+            normalized[field] = (value or "").strip()
+    return normalized
+
+class OpenInvoiceIndex:
+    """
+    Hash index over every open invoice, keyed on (payer, amount in cents, period start).
+    The payer is the customer's email or name, lowercased; each invoice is also indexed
+    with period None so payments without a period match the oldest open invoice.
+    """
+
+    def __init__(self, session):
+        self.candidates = defaultdict(list)
+        self.invoices = {}
+        self.matched = set()
+
+        rows = session.execute(
+            select(
+                Invoice.id, Invoice.customer_id, Invoice.invoice_date, Invoice.period_start, Invoice.period_end,
+                Invoice.amount, Invoice.total_amount, INVOICE_TOTAL.label("total"),
+                func.lower(Customer.email).label("email"), func.lower(Customer.name).label("name"),
+            )
+            .join(Customer, Invoice.customer_id == Customer.id)
+            .where(func.coalesce(Invoice.status, "Unpaid") != "Paid")
+            .order_by(Invoice.invoice_date, Invoice.id)
+        )
+        for row in rows:
+            self.invoices[row.id] = row
+            cents = _cents(row.total)
+            for payer in {row.email, row.name}:
+                if payer:
+                    self.candidates[(payer, cents, row.period_start)].append(row.id)
+                    self.candidates[(payer, cents, None)].append(row.id)
+
+    def match(self, payers, amount, period=None):
+        """
+        Claim the oldest open invoice for the first payer that matches, or return None.
+        `period` is a (start, end) pair from parse_period_label; when its start isn't an
+        invoice's first day (a payment dated mid-period) the invoice covering it matches.
+        """
+        cents = _cents(amount)
+        period_start = period[0] if period else None
+        for payer in payers:
+            for invoice_id in self.candidates.get((payer, cents, period_start), ()):
+                if invoice_id not in self.matched:
+                    return self._claim(invoice_id)
+
+        if period is not None:
+            for payer in payers:
+                for invoice_id in self.candidates.get((payer, cents, None), ()):
+                    invoice = self.invoices[invoice_id]
+                    if invoice_id not in self.matched and invoice.period_start \
+                            and invoice.period_start <= period_start <= invoice.period_end:
+                        return self._claim(invoice_id)
+        return None
+
+    def _claim(self, invoice_id):
+        self.matched.add(invoice_id)
+        return self.invoices[invoice_id]
+
+def reconcile_payments(session, lines, default_paid_date=None, dry_run=False):
+    """
+    Match payment rows from `lines` (any iterable of CSV text lines, e.g. an open file)
+    to open invoices. Matches are marked Paid in one bulk UPDATE and commit together.
+    Returns (matched, unmatched): matched is a list of (row number, invoice id, paid date),
+    unmatched a list of (row number, original row, reason) for the review report.
+    """
+    default_paid_date = default_paid_date or date.today()
+    index = OpenInvoiceIndex(session)
+    matched = []
+    unmatched = []
+    paid_invoices = []
+
+    for row_number, row in enumerate(csv.DictReader(lines), start=2):
+        payment = _normalize_row(row)
+        payers = [p.lower() for p in (payment.get("email"), payment.get("name")) if p]
+        if not payers:
+            unmatched.append((row_number, row, "No email or name"))
+            continue
+        try:
+            amount = _parse_amount(payment.get("amount"))
+        except ValueError:
+            unmatched.append((row_number, row, "Amount is not a number"))
+            continue
+
+        period = None
+        if payment.get("period"):
+            period = parse_period_label(payment["period"])
+            if period is None:
+                unmatched.append((row_number, row, f"Unrecognised period '{payment['period']}'"))
+                continue
+
+        invoice = index.match(payers, amount, period)
+        if invoice is None:
+            unmatched.append((row_number, row, "No open invoice with this payer, amount and period"))
+            continue
+
+        paid_date = _parse_date(payment.get("date")) or default_paid_date
+        matched.append((row_number, invoice.id, paid_date))
+        paid_invoices.append(invoice)
+
+    if matched and not dry_run:
+        session.execute(update(Invoice), [
+            {"id": invoice_id, "status": "Paid", "paid_date": paid_date}
+            for _, invoice_id, paid_date in matched
+        ])
+        adjust_receivables(session, paid_invoices, -1)
+        session.commit()
+    return matched, unmatched
+
+def write_review_report(unmatched, out):
+    """Write unmatched payments as CSV: row number, reason, then the original columns."""
+    fieldnames = ["row", "reason"]
+    for _, row, _ in unmatched:
+        fieldnames.extend(key for key in row if key is not None and key not in fieldnames)
+    writer = csv.DictWriter(out, fieldnames=fieldnames)
+    writer.writeheader()
+    for row_number, row, reason in unmatched:
+        writer.writerow({"row": row_number, "reason": reason, **{k: v for k, v in row.items() if k is not None}})
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mark invoices Paid from a payments CSV.")
+    parser.add_argument("csv_file")
+    parser.add_argument("--unmatched", help="Write unmatched payments to this CSV for review")
+    parser.add_argument("--dry-run", action="store_true", help="Match only, don't update invoices")
+    args = parser.parse_args(argv)
+
+    session = SessionLocal()
+    try:
+        with open(args.csv_file, newline="", encoding="utf-8-sig") as f:
+            matched, unmatched = reconcile_payments(session, f, dry_run=args.dry_run)
+    finally:
+        session.close()
+
+    print(f"{'Would mark' if args.dry_run else 'Marked'} {len(matched)} invoices paid, {len(unmatched)} payments unmatched")
+    if args.unmatched:
+        with open(args.unmatched, "w", newline="") as f:
+            write_review_report(unmatched, f)
+        print(f"Unmatched payments written to {args.unmatched}")
+    else:
+        for row_number, _, reason in unmatched:
+            print(f"  row {row_number}: {reason}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
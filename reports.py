@@ -0,0 +1,166 @@
+"""
+Billing aggregates computed in SQL.
+
+All sums use the stored invoice total (falling back to the base amount for rows that
+haven't been backfilled), so none of these render or recompute invoices in Python.
+
+Accounts-receivable aging reads the receivable_balances summary instead of invoices,
+so its cost follows the number of open balances rather than invoice history.
+
+    python reports.py rebuild-receivables
+"""
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+from sqlalchemy import func, case, delete, insert, select
+from models import SessionLocal, Invoice, InvoiceLine, ReceivableBalance, RECEIVABLE_KEY
+
+INVOICE_TOTAL = func.coalesce(Invoice.total_amount, Invoice.amount)
+IS_PAID = Invoice.status == "Paid"
+
+def _money_columns():
+    return (
+        func.count(Invoice.id).label("count"),
+        func.coalesce(func.sum(INVOICE_TOTAL), 0).label("billed"),
+        func.coalesce(func.sum(case((IS_PAID, INVOICE_TOTAL), else_=0)), 0).label("collected"),
+        func.coalesce(func.sum(case((IS_PAID, 0), else_=INVOICE_TOTAL)), 0).label("outstanding"),
+    )
+
+def invoice_totals(session, *filters):
+    """Count, billed, collected and outstanding totals over invoices matching `filters`."""
+    row = session.query(*_money_columns()).filter(*filters).one()
+    return row._asdict()
+
+def customer_totals(session):
+    """Billed/collected/outstanding per customer, keyed by customer_id."""
+    rows = session.query(Invoice.customer_id, *_money_columns()).group_by(Invoice.customer_id)
+    return {row.customer_id: row._asdict() for row in rows}
+
+def period_revenue(session, *filters):
+    """One row per billing period (newest first) with invoice count and money totals."""
+    return (
+        session.query(Invoice.period_start, Invoice.period_end, *_money_columns())
+        .filter(Invoice.period_start.isnot(None), *filters)
+        .group_by(Invoice.period_start, Invoice.period_end)
+        .order_by(Invoice.period_start.desc(), Invoice.period_end.desc())
+        .all()
+    )
+
+def fee_type_revenue(session, *filters):
+    """Billed amount per fee type across invoice lines, largest first."""
+    billed = func.sum(InvoiceLine.amount)
+    return (
+        session.query(InvoiceLine.fee_type, func.count(InvoiceLine.id).label("count"), billed.label("billed"))
+        .join(Invoice, InvoiceLine.invoice_id == Invoice.id)
+        .filter(*filters)
+        .group_by(InvoiceLine.fee_type)
+        .order_by(billed.desc())
+        .all()
+    )
+
+def _receivable_key(invoice):
+    return (invoice.customer_id, invoice.invoice_date, invoice.period_start, invoice.period_end)
+
+def _upsert(session, table):
+    """An INSERT for `table` that supports ON CONFLICT, for the session's database."""
+    if session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(table)
+
+def adjust_receivables(session, invoices, sign):
+    """
+    Add (sign=1) or remove (sign=-1) invoices from the open receivable balances.
+    Call it in the same session, before the commit, whenever an invoice becomes unpaid
+    (created, marked unpaid) or stops being unpaid (paid, deleted). Each balance is
+    upserted in one statement (INSERT ... ON CONFLICT DO UPDATE on RECEIVABLE_KEY), so
+    concurrent changes to one balance add up instead of racing to create it.
+    """
+    deltas = defaultdict(lambda: [0, 0.0])
+    for invoice in invoices:
+        delta = deltas[_receivable_key(invoice)]
+        delta[0] += sign
+        delta[1] += sign * (invoice.total_amount if invoice.total_amount is not None else invoice.amount)
+    if not deltas:
+        return
+
+    stmt = _upsert(session, ReceivableBalance).values([
+        dict(customer_id=customer_id, invoice_date=invoice_date, period_start=period_start,
+             period_end=period_end, open_count=count, open_amount=amount)
+        for (customer_id, invoice_date, period_start, period_end), (count, amount) in deltas.items()
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=list(RECEIVABLE_KEY.expressions),
+        set_={"open_count": ReceivableBalance.open_count + stmt.excluded.open_count,
+              "open_amount": ReceivableBalance.open_amount + stmt.excluded.open_amount},
+    ))
+    # Also drops the row a removal inserts when its balance wasn't there
+    session.execute(delete(ReceivableBalance).where(ReceivableBalance.open_count <= 0))
+
+def rebuild_receivables(session):
+    """Recompute receivable_balances from the invoices table. Returns the number of balance rows."""
+    session.execute(delete(ReceivableBalance))
+    key = (Invoice.customer_id, Invoice.invoice_date, Invoice.period_start, Invoice.period_end)
+    session.execute(
+        insert(ReceivableBalance).from_select(
+            ["customer_id", "invoice_date", "period_start", "period_end", "open_count", "open_amount"],
+            select(*key, func.count(Invoice.id), func.sum(INVOICE_TOTAL))
+            .where(func.coalesce(Invoice.status, "Unpaid") != "Paid")
+            .group_by(*key),
+        )
+    )
+    session.commit()
+    return session.query(ReceivableBalance).count()
+
+AGING_BUCKETS = ("current", "days_30", "days_60", "days_90")
+
+def _aging_columns(today):
+    age = ReceivableBalance.invoice_date
+    amount = ReceivableBalance.open_amount
+    return (
+        func.coalesce(func.sum(case((age > today - timedelta(days=30), amount), else_=0)), 0).label("current"),
+        func.coalesce(func.sum(case(((age <= today - timedelta(days=30)) & (age > today - timedelta(days=60)), amount), else_=0)), 0).label("days_30"),
+        func.coalesce(func.sum(case(((age <= today - timedelta(days=60)) & (age > today - timedelta(days=90)), amount), else_=0)), 0).label("days_60"),
+        func.coalesce(func.sum(case((age <= today - timedelta(days=90), amount), else_=0)), 0).label("days_90"),
+        func.coalesce(func.sum(ReceivableBalance.open_count), 0).label("count"),
+        func.coalesce(func.sum(amount), 0).label("total"),
+    )
+
+def receivables_aging(session, today=None):
+    """
+    Open balances by age of the invoice date: current (under 30 days), 30, 60 and 90+.
+    Returns (rows per customer, largest balance first; totals row).
+    """
+    today = today or date.today()
+    columns = _aging_columns(today)
+    rows = (
+        session.query(ReceivableBalance.customer_id, *columns)
+        .group_by(ReceivableBalance.customer_id)
+        .order_by(func.sum(ReceivableBalance.open_amount).desc())
+        .all()
+    )
+    totals = session.query(*columns).one()
+    return rows, totals
+
+def unpaid_by_period(session):
+    """Open balance per billing period, newest first."""
+    return (
+        session.query(
+            ReceivableBalance.period_start, ReceivableBalance.period_end,
+            func.sum(ReceivableBalance.open_count).label("count"),
+            func.sum(ReceivableBalance.open_amount).label("total"),
+        )
+        .group_by(ReceivableBalance.period_start, ReceivableBalance.period_end)
+        .order_by(ReceivableBalance.period_start.desc())
+        .all()
+    )
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild-receivables"]:
+        sys.exit("usage: python reports.py rebuild-receivables")
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt receivable balances: {rebuild_receivables(session)} rows")
+    finally:
+        session.close()
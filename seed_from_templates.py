@@ -1,11 +1,26 @@
+"""
+Create customers from legacy invoice .docx files.
+
+Files are parsed in parallel, and a manifest of (size, mtime, sha256) per file means
+later runs only parse files that are new or changed.
+
+    python seed_from_templates.py --dir invoice_templates --workers 4
+"""
+import argparse
+import hashlib
+import json
 import os
 import re
-from docx import Document
+from concurrent.futures import ProcessPoolExecutor
+from docx_text import paragraph_texts
+from sqlalchemy import insert, update
 from models import SessionLocal, Customer, FeeType, init_db
 from datetime import date
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "invoice_templates")
+# Kept beside the invoices it describes
+MANIFEST_NAME = ".seed_manifest.json"
 
 def extract_money(text):
     # Find all money patterns like $150 or $1,200.50
@@ -56,135 +71,227 @@ def parse_address(full_address):
     
     return street, city, state, zip_code
 
-def seed_customers():
-    print("Initializing DB...")
-    init_db()
-    session = SessionLocal()
-    
-    # Ensure Management Fee exists
-    if not session.query(FeeType).filter_by(name="Management Fee").first():
-        session.add(FeeType(name="Management Fee"))
-        session.commit()
-
-    files = [f for f in os.listdir(TEMPLATE_DIR) if f.lower().endswith('.docx')]
-    
-    count = 0
-    for f in files:
-        if f == "base_invoice_template.docx" or f.startswith("~"):
-            continue
-            
-        path = os.path.join(TEMPLATE_DIR, f)
-        print(f"Processing {f}...")
+def parse_template(path):
+    """
+    Extract customer details from one legacy invoice .docx. Runs in a worker process.
+    Returns a dict with the customer fields, or with an "error" key.
+    """
+    try:
+        texts = paragraph_texts(path)
         
-        try:
-            doc = Document(path)
+        name = ""
+        address = ""
+        email = ""
+        rate = 0.0
+        cadence = "monthly" # Default
+        fee_type = "Management Fee"
+        
+        for text in texts:
+            text = text.strip()
+            if not text:
+                continue
             
-            name = ""
-            address = ""
-            email = ""
-            rate = 0.0
-            cadence = "monthly" # Default
-            fee_type = "Management Fee"
+            # Extract Name
+            if text.upper().startswith("TO:"):
+                # Try to get name from same line
+                parts = text.split(":", 1)
+                if len(parts) > 1 and parts[1].strip():
+                    name = parts[1].strip()
+                else:
+                    # Name might be on next line, but simple parsing is hard here.
+                    # Let's assume it's on the same line for now based on analysis.
+                    pass
             
-            for p in doc.paragraphs:
-                text = p.text.strip()
-                if not text:
-                    continue
-                
-                # Extract Name
-                if text.upper().startswith("TO:"):
-                    # Try to get name from same line
-                    parts = text.split(":", 1)
-                    if len(parts) > 1 and parts[1].strip():
-                        name = parts[1].strip()
-                    else:
-                        # Name might be on next line, but simple parsing is hard here.
-                        # Let's assume it's on the same line for now based on analysis.
-                        pass
-                
-                # Extract Address
-                if text.upper().startswith("FOR:"):
-                    parts = text.split(":", 1)
-                    if len(parts) > 1 and parts[1].strip():
-                        address = parts[1].strip()
-                
-                # Extract Email
-                email_matches = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', text)
-                for email_match in email_matches:
-                    # Filter out sender emails
-                    if "linda" not in email_match.lower() and "stonegate" not in email_match.lower():
-                         # Assume the first non-sender email is the customer's
-                         if not email or email == "change@me.com":
-                             email = email_match
-
-                # Extract Rate & Cadence from management line
-                if "management" in text.lower() or "quarter" in text.lower():
-                    line_rate = extract_money(text)
-                    if line_rate > 0:
-                        rate = line_rate
-                    
-                    if "quarter" in text.lower():
-                        cadence = "quarterly"
-                    elif "year" in text.lower() or "annual" in text.lower():
-                        cadence = "yearly"
+            # Extract Address
+            if text.upper().startswith("FOR:"):
+                parts = text.split(":", 1)
+                if len(parts) > 1 and parts[1].strip():
+                    address = parts[1].strip()
             
-            # Fallback for rate if not found in management line
-            if rate == 0:
-                for p in doc.paragraphs:
-                    if "Total due" in p.text:
-                        rate = extract_money(p.text)
-                        break
-
-            if name and address:
-                # Parse address into components
-                street, city, state, zip_code = parse_address(address)
+            # Extract Email
+            email_matches = re.findall(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}', text)
+            for email_match in email_matches:
+                # Filter out sender emails
+                if "linda" not in email_match.lower() and "stonegate" not in email_match.lower():
+                     # Assume the first non-sender email is the customer's
+                     if not email or email == "change@me.com":
+                         email = email_match
+
+            # Extract Rate & Cadence from management line
+            if "management" in text.lower() or "quarter" in text.lower():
+                line_rate = extract_money(text)
+                if line_rate > 0:
+                    rate = line_rate
                 
-               # Check if exists
-                existing = session.query(Customer).filter(Customer.name == name).first()
-                if not existing:
-                    print(f"  -> Adding {name} ({street}, {city}, {state} {zip_code}) - ${rate} {cadence}")
-                    c = Customer(
-                        name=name,
-                        email=email if email else "change@me.com",
-                        property_address=street,
-                        property_city=city,
-                        property_state=state,
-                        property_zip=zip_code,
-                        rate=rate,
-                        cadence=cadence,
-                        fee_type=fee_type,
-                        next_bill_date=date(2025, 10, 1)
-                    )
-                    session.add(c)
-                    count += 1
-                else:
-                    print(f"  -> Updating existing customer: {name}")
-                    # Force update all fields to match template
-                    existing.property_address = street
-                    existing.property_city = city
-                    existing.property_state = state
-                    existing.property_zip = zip_code
-                    existing.rate = rate
-                    existing.cadence = cadence
-                    existing.fee_type = fee_type
-                    # Reset next_bill_date to today so "Run Daily Batch" picks them up
-                    existing.next_bill_date = date(2025, 10, 1)
-                    
-                    if email:
-                        existing.email = email
-                    
-                    session.add(existing)
-                    count += 1
-            else:
-                print(f"  -> Could not extract Name or Address from {f}")
+                if "quarter" in text.lower():
+                    cadence = "quarterly"
+                elif "year" in text.lower() or "annual" in text.lower():
+                    cadence = "yearly"
+        
+        # Fallback for rate if not found in management line
+        if rate == 0:
+            for text in texts:
+                if "Total due" in text:
+                    rate = extract_money(text)
+                    break
+
+        if not (name and address):
+            return {"error": "Could not extract Name or Address"}
 
-        except Exception as e:
-            print(f"  -> Error processing {f}: {e}")
+        # Parse address into components
+        street, city, state, zip_code = parse_address(address)
+        return {
+            "name": name,
+            "email": email,
+            "property_address": street,
+            "property_city": city,
+            "property_state": state,
+            "property_zip": zip_code,
+            "rate": rate,
+            "cadence": cadence,
+            "fee_type": fee_type,
+        }
+    except Exception as e:
+        return {"error": f"Error processing: {e}"}
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest, path):
+    try:
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    except OSError as e:
+        # Read-only deploys (Vercel) simply re-parse everything next time
+        print(f"Could not write seed manifest: {e}")
+
+def changed_templates(template_dir, manifest):
+    """
+    Return ({filename: (size, mtime, sha256)} for new or changed files, the manifest
+    entries of unchanged ones). Size and mtime are checked first; the file is only
+    hashed when they differ from the manifest.
+    """
+    changed = {}
+    unchanged = {}
+    for f in sorted(os.listdir(template_dir)):
+        if not f.lower().endswith('.docx') or f == "base_invoice_template.docx" or f.startswith("~"):
+            continue
+        path = os.path.join(template_dir, f)
+        stat = os.stat(path)
+        entry = manifest.get(f)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            unchanged[f] = entry
+            continue
+        sha256 = file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            # Touched but identical
+            unchanged[f] = dict(entry, mtime=stat.st_mtime)
+            continue
+        changed[f] = (stat.st_size, stat.st_mtime, sha256)
+    return changed, unchanged
+
+def parse_templates(paths, workers=None):
+    """
+    Parse files over a process pool (in-process for a single file, workers=1, or where
+    processes can't be started). Returns results in order.
+    """
+    if len(paths) > 1 and workers != 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(parse_template, paths, chunksize=8))
+        except (OSError, NotImplementedError) as e:
+            # Serverless runtimes (Vercel, Lambda) have no /dev/shm for the pool's semaphores
+            print(f"Could not start parser processes ({e}); parsing in-process")
+    return [parse_template(path) for path in paths]
+
+def seed_customers(template_dir=TEMPLATE_DIR, manifest_path=None, workers=None, force=False):
+    """
+    Create or update customers from the legacy invoices in template_dir. Only files
+    that are new or changed since the last run (per the manifest, by default
+    template_dir/.seed_manifest.json) are parsed, and all customer writes go to the
+    database in one batch.
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(template_dir, MANIFEST_NAME)
+    print("Initializing DB...")
+    init_db()
+    session = SessionLocal()
+    try:
+        # Ensure Management Fee exists
+        if not session.query(FeeType).filter_by(name="Management Fee").first():
+            session.add(FeeType(name="Management Fee"))
+
+        manifest = {} if force else load_manifest(manifest_path)
+        changed, unchanged = changed_templates(template_dir, manifest)
+        print(f"{len(changed)} new or changed files, {len(unchanged)} unchanged")
+        
+        filenames = list(changed)
+        results = parse_templates([os.path.join(template_dir, f) for f in filenames], workers=workers)
+
+        # Later files win when several describe the same customer
+        parsed = {}
+        new_manifest = dict(unchanged)
+        for f, result in zip(filenames, results):
+            print(f"Processing {f}...")
+            if "error" in result:
+                print(f"  -> {result['error']}")
+                continue
+            parsed[result["name"]] = result
+            size, mtime, sha256 = changed[f]
+            new_manifest[f] = {"size": size, "mtime": mtime, "sha256": sha256}
+
+        # One query for every customer we might update
+        existing = {
+            c.name: c.id for c in session.query(Customer.id, Customer.name).filter(Customer.name.in_(list(parsed)))
+        }
+        
+        inserts = []
+        updates = []
+        for name, result in parsed.items():
+            street, city, state, zip_code = (result["property_address"], result["property_city"],
+                                              result["property_state"], result["property_zip"])
+            values = dict(result)
+            # Reset next_bill_date so "Run Daily Batch" picks them up
+            values["next_bill_date"] = date(2025, 10, 1)
+            if name not in existing:
+                print(f"  -> Adding {name} ({street}, {city}, {state} {zip_code}) - ${result['rate']} {result['cadence']}")
+                values["email"] = result["email"] if result["email"] else "change@me.com"
+                inserts.append(values)
+            else:
+                print(f"  -> Updating existing customer: {name}")
+                # Force update all fields to match template
+                if not result["email"]:
+                    del values["email"]
+                updates.append(dict(values, id=existing[name]))
+        
+        if inserts:
+            session.execute(insert(Customer), inserts)
+        if updates:
+            session.execute(update(Customer), updates)
+        session.commit()
+    finally:
+        session.close()
 
-    session.commit()
-    session.close()
-    print(f"Done! Added {count} new customers.")
+    # Only remember files once their customers are saved
+    save_manifest(new_manifest, manifest_path)
+    print(f"Done! Added {len(inserts)} new customers, updated {len(updates)}.")
+    return len(inserts), len(updates)
 
 if __name__ == "__main__":
-    from datetime import date
-    seed_customers()
+    parser = argparse.ArgumentParser(description="Create customers from legacy invoice .docx files.")
+    parser.add_argument("--dir", default=TEMPLATE_DIR, help="Directory of .docx invoices (default: invoice_templates)")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and re-parse every file")
+    args = parser.parse_args()
+    seed_customers(template_dir=args.dir, workers=args.workers, force=args.force)
@@ -0,0 +1,132 @@
+import random
+from datetime import date, timedelta
+from sqlalchemy import insert, select, func
+from sqlalchemy.orm import Session
+from models import Base, Customer, Property, Invoice, InvoiceLine, FeeType, Settings
+from invoice_generator import get_period_label, get_period_dates, fee_lines
+from reports import rebuild_receivables
+
+FEE_TYPE_NAMES = ["Management Fee", "Inspection Fee", "Late Fee", "Maintenance Markup", "Utility Management"]
+CADENCES = ["monthly", "quarterly", "yearly"]
+STREETS = ["Main St", "Oak Ave", "Pine Rd", "Elm St", "Market St", "Broadway", "Cedar Ln", "Lakeview Dr"]
+CITIES = [("Milwaukee", "WI", "53202"), ("Madison", "WI", "53703"), ("Chicago", "IL", "60611"), ("Denver", "CO", "80203")]
+
+CHUNK_SIZE = 5000
+
+def _insert_chunked(session, model, rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        session.execute(insert(model), rows[i:i + CHUNK_SIZE])
+
+def build_dataset(engine, customers, properties_per_customer=1, invoices_per_customer=4, due_customers=0, seed=1234):
+    """
+    Create tables on `engine` and fill them with a deterministic synthetic portfolio.
+
+    `due_customers` customers get a next_bill_date of today (so the daily batch picks them up),
+    everyone else is billed in the future. Returns a dict of row counts.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    Base.metadata.create_all(bind=engine)
+
+    with Session(engine) as session:
+        if not session.scalar(select(func.count()).select_from(FeeType)):
+            _insert_chunked(session, FeeType, [{"name": n} for n in FEE_TYPE_NAMES])
+        if not session.scalar(select(func.count()).select_from(Settings)):
+            session.add(Settings(sender_name="Benchmark Manager", sender_email="bench@example.com"))
+
+        first_id = (session.scalar(select(func.max(Customer.id))) or 0) + 1
+        next_invoice_id = (session.scalar(select(func.max(Invoice.id))) or 0) + 1
+        customer_rows = []
+        property_rows = []
+        invoice_rows = []
+        line_rows = []
+        for n in range(customers):
+            customer_id = first_id + n
+            cadence = CADENCES[n % len(CADENCES)]
+            city, state, zip_code = CITIES[n % len(CITIES)]
+            rate = float(rng.randrange(200, 5000, 25))
+            has_fee_2 = n % 3 == 0
+            has_additional = n % 7 == 0
+            if n < due_customers:
+                next_bill_date = today
+            else:
+                next_bill_date = today + timedelta(days=30 + n % 60)
+
+            customer_rows.append({
+                "id": customer_id,
+                "name": f"Customer {customer_id:06d}",
+                "email": f"owner{customer_id}@example.com",
+                "property_address": f"{100 + n % 9000} {STREETS[n % len(STREETS)]}",
+                "property_city": city,
+                "property_state": state,
+                "property_zip": zip_code,
+                "rate": rate,
+                "cadence": cadence,
+                "fee_type": "Management Fee",
+                "fee_2_type": "Inspection Fee" if has_fee_2 else None,
+                "fee_2_rate": 75.0 if has_fee_2 else None,
+                "fee_3_type": None,
+                "fee_3_rate": None,
+                "additional_fee_desc": "Landscaping" if has_additional else None,
+                "additional_fee_amount": 40.0 if has_additional else None,
+                "next_bill_date": next_bill_date,
+            })
+
+            for p in range(properties_per_customer):
+                property_rows.append({
+                    "customer_id": customer_id,
+                    "address": f"{200 + p} {STREETS[(n + p) % len(STREETS)]}",
+                    "city": city,
+                    "state": state,
+                    "zip_code": zip_code,
+                    "fee_amount": float(rng.randrange(25, 150, 5)),
+                    "is_primary": False,
+                })
+
+            # Invoice history: one invoice per past period, oldest first
+            for k in range(invoices_per_customer, 0, -1):
+                if cadence == "monthly":
+                    months_back = k
+                elif cadence == "quarterly":
+                    months_back = 3 * k
+                else:
+                    months_back = 12 * k
+                month_index = today.year * 12 + today.month - 1 - months_back
+                invoice_date = date(month_index // 12, month_index % 12 + 1, 1)
+                period_label = get_period_label(invoice_date, cadence)
+                period_start, period_end = get_period_dates(invoice_date, cadence)
+                lines = fee_lines("Management Fee", rate, "Inspection Fee", 75.0 if has_fee_2 else None)
+                line_rows.extend({"invoice_id": next_invoice_id, "position": i, **line} for i, line in enumerate(lines))
+                invoice_rows.append({
+                    "id": next_invoice_id,
+                    "customer_id": customer_id,
+                    "invoice_date": invoice_date,
+                    "period_label": period_label,
+                    "period_start": period_start,
+                    "period_end": period_end,
+                    "amount": rate,
+                    "total_amount": sum(line["amount"] for line in lines),
+                    "file_path": f"Invoice_{period_label.replace(' ', '_')}_{customer_id}.docx",
+                    "email_subject": f"Invoice – {period_label}",
+                    "email_body": f"Amount due: ${rate:,.2f}",
+                    "fee_2_type": "Inspection Fee" if has_fee_2 else None,
+                    "fee_2_amount": 75.0 if has_fee_2 else None,
+                    "status": "Paid" if k > 1 else "Unpaid",
+                    "paid_date": invoice_date + timedelta(days=10) if k > 1 else None,
+                })
+                next_invoice_id += 1
+
+        _insert_chunked(session, Customer, customer_rows)
+        _insert_chunked(session, Property, property_rows)
+        _insert_chunked(session, Invoice, invoice_rows)
+        _insert_chunked(session, InvoiceLine, line_rows)
+        session.commit()
+        rebuild_receivables(session)
+
+    return {
+        "customers": len(customer_rows),
+        "properties": len(property_rows),
+        "invoices": len(invoice_rows),
+        "invoice_lines": len(line_rows),
+        "due_customers": min(due_customers, customers),
+    }
@@ -0,0 +1,205 @@
+"""
+Precompiled invoice templates, and the renderer that fills them in.
+
+An artifact holds everything needed to write a filled-in invoice without parsing the
+.docx: the parts that contain placeholders, pre-split into XML text segments,
+placeholder slots, optional blocks and repeating blocks, and every other zip member as its raw compressed bytes, copied into
+the output unchanged. template_compiler builds artifacts; they are pickled to
+invoice_templates/.compiled/<name>.artifact, so loading one is a single file read with
+no zip, lxml or python-docx work.
+"""
+import hashlib
+import os
+import pickle
+import re
+import struct
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+ARTIFACT_VERSION = 3
+COMPILED_DIRNAME = ".compiled"
+# Every zip member gets this timestamp, so identical input always gives identical bytes
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# A value's line breaks and tabs become Word breaks and tabs inside the placeholder's run
+_BREAK = '</w:t><w:br/><w:t xml:space="preserve">'
+_TAB = '</w:t><w:tab/><w:t xml:space="preserve">'
+_ESCAPES = {'"': "&quot;"}
+
+DOCUMENT_PART = "word/document.xml"
+_BODY_START = re.compile(r"<w:body(?: [^>]*)?>")
+_SECTION_TYPE = re.compile(r"<w:type [^>]*/>")
+_DRAWING_ID = re.compile(r'(<wp:docPr [^>]*?\bid=")(\d+)')
+
+def template_version(data):
+    """Short content hash identifying one version of a template."""
+    return hashlib.sha1(data).hexdigest()[:12]
+
+def artifact_paths(template_dir, name):
+    """(artifact path, manifest path) for template `name`."""
+    compiled_dir = os.path.join(template_dir, COMPILED_DIRNAME)
+    return os.path.join(compiled_dir, name + ".artifact"), os.path.join(compiled_dir, name + ".json")
+
+def load_artifact(template_dir, name, version):
+    """The stored artifact for this version of template `name`, or None if stale or absent."""
+    try:
+        with open(artifact_paths(template_dir, name)[0], "rb") as f:
+            artifact = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if not isinstance(artifact, dict) or artifact.get("artifact_version") != ARTIFACT_VERSION \
+            or artifact["manifest"]["version"] != version:
+        return None
+    return artifact
+
+def xml_text(value):
+    """A replacement value as XML to put inside a w:t element."""
+    return escape(value, _ESCAPES).replace("\r\n", "\n").replace("\n", _BREAK).replace("\t", _TAB)
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+def write_zip(out, members):
+    """
+    Write a zip archive to the file object `out` from already-compressed members:
+    (name, date_time, compress_type, crc, file_size, compressed bytes). Nothing is
+    recompressed, and the same members always give the same bytes.
+    """
+    central = []
+    offset = 0
+    for name, date_time, compress_type, crc, file_size, data in members:
+        encoded = name.encode("utf-8")
+        flags = 0x800 if not encoded.isascii() else 0
+        dos_time, dos_date = _dos_datetime(date_time)
+        header = struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, flags, compress_type, dos_time, dos_date,
+                             crc, len(data), file_size, len(encoded), 0)
+        out.write(header)
+        out.write(encoded)
+        out.write(data)
+        central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, flags, compress_type, dos_time, dos_date,
+                                   crc, len(data), file_size, len(encoded), 0, 0, 0, 0, 0, offset) + encoded)
+        offset += len(header) + len(encoded) + len(data)
+    directory = b"".join(central)
+    out.write(directory)
+    out.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(directory), offset, 0))
+
+def _deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+class TemplateDocument:
+    """
+    One invoice being filled in from an artifact. fill() sets placeholder values,
+    omit_block() drops an optional block (an unused fee line) and repeat() stamps out a
+    repeating block once per item; save() writes the .docx, to a path or a file object
+    like python-docx's Document.save().
+    """
+
+    def __init__(self, artifact):
+        self.artifact = artifact
+        self.values = {}
+        self.omitted = set()
+        self.repeats = {}
+
+    def fill(self, replacements):
+        """Set placeholder values from {"{{NAME}}": value}."""
+        for placeholder, value in replacements.items():
+            self.values[placeholder[2:-2]] = xml_text(str(value))
+
+    def omit_block(self, name):
+        self.omitted.add(name)
+
+    def has_repeat(self, name):
+        """Whether the template has a repeating block `name`."""
+        return any(block["name"] == name for block in self.artifact["manifest"].get("repeat_blocks", ()))
+
+    def repeat(self, name, items):
+        """
+        Fill repeating block `name` once per item, each a {"NAME": value} dict of the
+        placeholders inside the block. A block never given items is left out.
+        """
+        self.repeats[name] = [{key: xml_text(str(value)) for key, value in item.items()} for item in items]
+
+    def _render(self, segments, out, item=None):
+        for segment in segments:
+            if segment.__class__ is str:
+                out.append(segment)
+            elif segment[0] == "slot":
+                if item is not None and segment[1] in item:
+                    out.append(item[segment[1]])
+                else:
+                    # Placeholders without a value stay as written, as python-docx rendering left them
+                    out.append(self.values.get(segment[1], "{{%s}}" % segment[1]))
+            elif segment[0] == "repeat":
+                for repeat_item in self.repeats.get(segment[1], ()):
+                    self._render(segment[2], out, repeat_item)
+            elif segment[1] not in self.omitted:
+                self._render(segment[2], out, item)
+
+    def render_part(self, segments):
+        """The filled-in XML of one part, as bytes."""
+        out = []
+        self._render(segments, out)
+        return "".join(out).encode("utf-8")
+
+    def members(self):
+        """Zip members for write_zip: static ones as stored, filled-in parts freshly compressed."""
+        for member in self.artifact["members"]:
+            if member[0] == "raw":
+                yield member[1:]
+            else:
+                _, name, date_time, segments = member
+                data = self.render_part(segments)
+                yield name, date_time, zipfile.ZIP_DEFLATED, zlib.crc32(data), len(data), _deflate(data)
+
+    def save(self, target):
+        if isinstance(target, (str, os.PathLike)):
+            with open(target, "wb") as f:
+                write_zip(f, self.members())
+        else:
+            write_zip(target, self.members())
+
+def _split_body(xml):
+    """(text before the body's content, the content, its final w:sectPr, the rest) of document.xml."""
+    start = _BODY_START.search(xml).end()
+    end = xml.rindex("</w:body>")
+    section = xml.rfind("<w:sectPr", start, end)
+    if section == -1 or not xml.endswith("</w:sectPr>", start, end):
+        return xml[:start], xml[start:end], "", xml[end:]
+    return xml[:start], xml[start:section], xml[section:end], xml[end:]
+
+def merge_documents(documents, out):
+    """
+    Write filled-in documents of one template to the file object `out` as a single .docx,
+    each starting on a new page: their bodies are joined with section breaks, as in a
+    Word mail merge, into one package, so styles, fonts and images are stored once.
+    """
+    artifact = documents[0].artifact
+    manifest = artifact["manifest"]
+    if any(document.artifact["manifest"]["version"] != manifest["version"] for document in documents):
+        raise ValueError("Only invoices rendered from the same template can be merged")
+    if any(part != DOCUMENT_PART for part in manifest["dynamic_parts"]):
+        raise ValueError("Templates with placeholders in headers or footers can't be merged")
+
+    members = []
+    for member in artifact["members"]:
+        if member[0] == "raw":
+            members.append(member[1:])
+            continue
+        bodies = []
+        for document in documents:
+            head, body, section, tail = _split_body(document.render_part(member[3]).decode("utf-8"))
+            # Every invoice starts a new page, whatever section type the template uses
+            section = _SECTION_TYPE.sub("", section)
+            if bodies:
+                bodies.append(f"<w:p><w:pPr>{section}</w:pPr></w:p>" if section
+                              else '<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+            bodies.append(body)
+        drawing_ids = iter(range(1, 1 << 31))
+        # Each copy of the logo is a drawing, and Word wants drawing ids to be unique
+        content = _DRAWING_ID.sub(lambda match: match.group(1) + str(next(drawing_ids)), "".join(bodies))
+        data = (head + content + section + tail).encode("utf-8")
+        members.append((member[1], member[2], zipfile.ZIP_DEFLATED, zlib.crc32(data), len(data), _deflate(data)))
+    write_zip(out, members)
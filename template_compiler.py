@@ -0,0 +1,324 @@
+"""
+Compile invoice templates once per version instead of analysing them on every render.
+
+Compiling a .docx template:
+- checks it is a readable Word document;
+- finds every {{PLACEHOLDER}} in the body, headers and footers. A placeholder that Word
+  split across several runs (e.g. after an autocorrect or a spelling mark) is merged back
+  into its first run, so the renderer sees it whole;
+- records where the optional fee lines ({{FEE_LINE_2}}, {{FEE_LINE_3}},
+  {{ADDITIONAL_FEE_LINE}}) are, and whether each is a table row or a paragraph, so an
+  unused one is removed without scanning the document;
+- records the per-property blocks: a row or paragraph holding {{PROPERTY_FEE_LINE}} (or
+  {{PROPERTY_FEE_ADDRESS}}, {{PROPERTY_FEE_TYPE}}, {{PROPERTY_FEE_AMOUNT}}) is repeated
+  once for every property fee on the invoice;
+- lists which zip parts have no placeholders and are therefore static.
+
+The result is a precompiled artifact (see template_artifact) plus a JSON manifest,
+written to invoice_templates/.compiled/. The upload page does this for uploaded
+templates; the checked-in templates' artifacts are committed (a test fails when they are
+stale), so a fresh serverless instance renders its first invoice without parsing any .docx:
+
+    python template_compiler.py                       # every template
+    python template_compiler.py base_invoice_template.docx
+"""
+import argparse
+import io
+import json
+import os
+import pickle
+import re
+import struct
+import sys
+import zipfile
+
+from lxml import etree
+
+from template_artifact import ARTIFACT_VERSION, ZIP_DATE_TIME, artifact_paths, template_version
+
+MAX_TEMPLATE_BYTES = 10 * 1024 * 1024
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_NAMESPACE = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+TEXT_PARTS = re.compile(r"word/(document|header\d*|footer\d*)\.xml")
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([A-Za-z0-9_]+)\}\}")
+
+# Everything render_invoice_snapshot fills in
+KNOWN_PLACEHOLDERS = (
+    "CUSTOMER_NAME", "CUSTOMER_EMAIL", "PROPERTY_ADDRESS", "PROPERTY_CITY", "PROPERTY_STATE", "PROPERTY_ZIP",
+    "PERIOD", "PERIOD_DATES", "AMOUNT", "INVOICE_DATE", "FEE_TYPE", "TOTAL_AMOUNT",
+    "FEE_LINE_2", "FEE_LINE_3", "ADDITIONAL_FEE_LINE",
+    "PROPERTY_FEE_LINE", "PROPERTY_FEE_ADDRESS", "PROPERTY_FEE_TYPE", "PROPERTY_FEE_AMOUNT",
+)
+REQUIRED_PLACEHOLDERS = ("CUSTOMER_NAME", "TOTAL_AMOUNT")
+FEE_LINE_PLACEHOLDERS = ("FEE_LINE_2", "FEE_LINE_3", "ADDITIONAL_FEE_LINE")
+# Placeholders that make their row or paragraph a repeating block, stamped out per property
+PROPERTY_PLACEHOLDERS = ("PROPERTY_FEE_LINE", "PROPERTY_FEE_ADDRESS", "PROPERTY_FEE_TYPE", "PROPERTY_FEE_AMOUNT")
+
+def _ancestor(elem, tag):
+    parent = elem.getparent()
+    while parent is not None and parent.tag != tag:
+        parent = parent.getparent()
+    return parent
+
+def _merge_split_placeholders(paragraph):
+    """
+    Find the placeholders in one paragraph's runs, merging any that span several w:t
+    elements into the first of them. Returns [(name, was_split)].
+    """
+    # Text of this paragraph's own runs (a text box's runs belong to its own paragraphs)
+    texts = [t for t in paragraph.iter(W + "t") if _ancestor(t, W + "p") is paragraph]
+    content = "".join(t.text or "" for t in texts)
+    if "{{" not in content:
+        return []
+
+    offsets = []
+    position = 0
+    for t in texts:
+        offsets.append(position)
+        position += len(t.text or "")
+
+    found = []
+    # Right to left, so merging one placeholder doesn't move the ones before it
+    for match in reversed(list(PLACEHOLDER_PATTERN.finditer(content))):
+        start, end = match.span()
+        covering = [i for i, t in enumerate(texts)
+                    if offsets[i] < end and offsets[i] + len(t.text or "") > start]
+        split = len(covering) > 1
+        if split:
+            first, last = covering[0], covering[-1]
+            head = texts[first].text[:start - offsets[first]]
+            tail = texts[last].text[end - offsets[last]:]
+            texts[first].text = head + match.group(0)
+            for i in covering[1:-1]:
+                texts[i].text = ""
+            texts[last].text = tail
+            for i in covering:
+                texts[i].set(XML_SPACE, "preserve")
+        found.append((match.group(1), split))
+    found.reverse()
+    return found
+
+def compile_template(data):
+    """
+    Compile template bytes. Returns (compiled .docx bytes, manifest dict). Raises
+    ValueError if the file isn't a usable Word document; problems with its placeholders
+    are listed in manifest["errors"] (unknown or missing placeholders) and
+    manifest["warnings"] (missing fee lines) for the caller to act on.
+
+    Blocks are located by paragraph index (as in root.iter(w:p)) or by table and row.
+    """
+    if len(data) > MAX_TEMPLATE_BYTES:
+        raise ValueError(f"Template is larger than {MAX_TEMPLATE_BYTES // (1024 * 1024)} MB")
+    try:
+        source = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ValueError("Not a .docx file (it isn't a zip archive)")
+    names = source.namelist()
+    if "word/document.xml" not in names or "[Content_Types].xml" not in names:
+        raise ValueError("Not a .docx file (word/document.xml is missing)")
+
+    placeholders = []
+    fee_blocks = []
+    repeat_blocks = []
+    errors = []
+    compiled_parts = {}
+    for name in names:
+        if not TEXT_PARTS.fullmatch(name):
+            continue
+        try:
+            root = etree.fromstring(source.read(name))
+        except etree.XMLSyntaxError as e:
+            raise ValueError(f"{name} is not valid XML: {e}")
+
+        tables = list(root.iter(W + "tbl"))
+        changed = False
+        for paragraph_index, paragraph in enumerate(root.iter(W + "p")):
+            found = _merge_split_placeholders(paragraph)
+            if not found:
+                continue
+            row = _ancestor(paragraph, W + "tr")
+            table_index = row_index = None
+            if row is not None:
+                table = row.getparent()
+                table_index = tables.index(table)
+                row_index = table.findall(W + "tr").index(row)
+            for placeholder, split in found:
+                changed = changed or split
+                placeholders.append({"name": placeholder, "part": name, "paragraph": paragraph_index,
+                                     "table": table_index, "row": row_index, "split": split})
+                block = {"block": "row" if row is not None else "paragraph",
+                         "paragraph": paragraph_index, "table": table_index, "row": row_index}
+                if placeholder in FEE_LINE_PLACEHOLDERS and name == "word/document.xml":
+                    fee_blocks.append(dict(block, placeholder=placeholder))
+                elif placeholder in PROPERTY_PLACEHOLDERS:
+                    if name != "word/document.xml":
+                        errors.append(f"{{{{{placeholder}}}}} can only be used in the document body")
+                        continue
+                    # A row is one block however many of its cells hold property placeholders
+                    if row is not None:
+                        block["paragraph"] = None
+                    if dict(block, name="PROPERTY") not in repeat_blocks:
+                        repeat_blocks.append(dict(block, name="PROPERTY"))
+        if changed:
+            compiled_parts[name] = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+    def same_block(a, b):
+        if a["block"] == "row" or b["block"] == "row":
+            return a["block"] == b["block"] == "row" and (a["table"], a["row"]) == (b["table"], b["row"])
+        return a["paragraph"] == b["paragraph"]
+    for fee_block in fee_blocks:
+        if any(same_block(fee_block, repeat) for repeat in repeat_blocks):
+            errors.append(f"{{{{{fee_block['placeholder']}}}}} can't share a row or paragraph with the property fee placeholders")
+
+    used = {p["name"] for p in placeholders}
+    errors += [f"Unknown placeholder {{{{{name}}}}}" for name in sorted(used - set(KNOWN_PLACEHOLDERS))]
+    errors += [f"Missing required placeholder {{{{{name}}}}}" for name in REQUIRED_PLACEHOLDERS if name not in used]
+    warnings = [f"No {{{{{name}}}}}: those fees will be in the total but not itemized"
+                for name in FEE_LINE_PLACEHOLDERS if name not in used]
+    dynamic_parts = sorted({p["part"] for p in placeholders})
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as compiled:
+        for info in source.infolist():
+            compiled.writestr(info, compiled_parts.get(info.filename) or source.read(info), compress_type=info.compress_type)
+
+    manifest = {
+        "version": template_version(data),
+        "size": len(data),
+        "placeholders": placeholders,
+        "fee_blocks": fee_blocks,
+        "repeat_blocks": repeat_blocks,
+        "dynamic_parts": dynamic_parts,
+        "static_parts": [name for name in names if name not in dynamic_parts],
+        "split_placeholders": sum(1 for p in placeholders if p["split"]),
+        "errors": errors,
+        "warnings": warnings,
+    }
+    return output.getvalue(), manifest
+
+_SEGMENT_TOKENS = re.compile(
+    r"<\?invoice-(block|repeat) (\w+) ?\?>|<\?invoice-(block|repeat)-end ?\?>|\{\{([A-Za-z0-9_]+)\}\}")
+
+def _split_segments(xml):
+    """
+    Split serialized part XML into literal strings, ("slot", name) placeholders,
+    ("block", name, segments) optional blocks and ("repeat", name, segments) repeating
+    blocks.
+    """
+    stack = [["root", None, []]]
+    position = 0
+    for match in _SEGMENT_TOKENS.finditer(xml):
+        if match.start() > position:
+            stack[-1][2].append(xml[position:match.start()])
+        position = match.end()
+        if match.group(1):
+            stack.append([match.group(1), match.group(2), []])
+        elif match.group(4):
+            stack[-1][2].append(("slot", match.group(4)))
+        else:
+            kind, name, segments = stack.pop()
+            if kind != match.group(3):
+                raise ValueError("Unbalanced block markers")
+            stack[-1][2].append((kind, name, segments))
+    if position < len(xml):
+        stack[-1][2].append(xml[position:])
+    if len(stack) != 1:
+        raise ValueError("Unbalanced block markers")
+    return stack[0][2]
+
+def _raw_member(data, info):
+    """The compressed bytes of a zip member, as stored."""
+    name_length, extra_length = struct.unpack("<HH", data[info.header_offset + 26:info.header_offset + 30])
+    start = info.header_offset + 30 + name_length + extra_length
+    return data[start:start + info.compress_size]
+
+def build_artifact(compiled, manifest):
+    """The precompiled artifact (see template_artifact) for a compiled template."""
+    source = zipfile.ZipFile(io.BytesIO(compiled))
+    members = []
+    for info in source.infolist():
+        if info.filename not in manifest["dynamic_parts"]:
+            members.append(("raw", info.filename, ZIP_DATE_TIME, info.compress_type, info.CRC, info.file_size,
+                            _raw_member(compiled, info)))
+            continue
+
+        root = etree.fromstring(source.read(info))
+        if root.nsmap.get("w") != W_NAMESPACE:
+            raise ValueError(f"{info.filename} doesn't use the usual w: prefix for WordprocessingML")
+        for t in root.iter(W + "t"):
+            if t.text and "{{" in t.text:
+                t.set(XML_SPACE, "preserve")
+        if info.filename == "word/document.xml":
+            paragraphs = list(root.iter(W + "p"))
+            tables = list(root.iter(W + "tbl"))
+            marked = [("block", block["placeholder"], block) for block in manifest["fee_blocks"]]
+            marked += [("repeat", block["name"], block) for block in manifest.get("repeat_blocks", [])]
+            for kind, block_name, block in marked:
+                if block["block"] == "row":
+                    element = tables[block["table"]].findall(W + "tr")[block["row"]]
+                else:
+                    element = paragraphs[block["paragraph"]]
+                # Marks the optional or repeating block; dropped when the segments are split out
+                element.addprevious(etree.PI("invoice-" + kind, block_name))
+                element.addnext(etree.PI(f"invoice-{kind}-end"))
+        xml = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True).decode("utf-8")
+        members.append(("part", info.filename, ZIP_DATE_TIME, _split_segments(xml)))
+
+    return {"artifact_version": ARTIFACT_VERSION, "manifest": manifest, "members": members}
+
+def write_artifact(template_dir, name, artifact):
+    """Store an artifact and its manifest beside the template. Raises OSError on read-only disks."""
+    artifact_path, manifest_path = artifact_paths(template_dir, name)
+    os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+    contents = ((artifact_path, pickle.dumps(artifact, protocol=pickle.HIGHEST_PROTOCOL), "wb"),
+                (manifest_path, json.dumps(artifact["manifest"], indent=1), "w"))
+    for path, content, mode in contents:
+        with open(path + ".tmp", mode) as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+def load_manifest(template_dir, name, version):
+    """The stored manifest for this version of template `name`, or None if stale or absent."""
+    try:
+        with open(artifact_paths(template_dir, name)[1]) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == version else None
+
+def compile_file(template_dir, name):
+    """Compile template_dir/name and store its artifact. Returns the manifest."""
+    with open(os.path.join(template_dir, name), "rb") as f:
+        compiled, manifest = compile_template(f.read())
+    write_artifact(template_dir, name, build_artifact(compiled, manifest))
+    return manifest
+
+def main(argv=None):
+    from template_registry import TEMPLATE_DIR, list_templates
+
+    parser = argparse.ArgumentParser(description="Compile invoice templates and report their placeholders.")
+    parser.add_argument("names", nargs="*", help="Template filenames (default: every template)")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for name in args.names or list_templates():
+        try:
+            manifest = compile_file(TEMPLATE_DIR, name)
+        except (OSError, ValueError) as e:
+            print(f"{name}: ERROR {e}")
+            failed = True
+            continue
+        placeholders = sorted({p["name"] for p in manifest["placeholders"]})
+        print(f"{name} ({manifest['version']}): {len(placeholders)} placeholders, "
+              f"{manifest['split_placeholders']} merged from split runs")
+        for line in manifest["errors"]:
+            print(f"  ERROR {line}")
+        for line in manifest["warnings"]:
+            print(f"  warning: {line}")
+        failed = failed or bool(manifest["errors"])
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+Invoice template registry.
+
+Lists the .docx templates in invoice_templates/ (re-read only when the directory's mtime
+changes), picks the template for an invoice, and keeps the most recently used templates
+loaded in memory. Templates are rendered from precompiled artifacts (see
+template_artifact), built by template_compiler once per template version and stored
+beside the template, so no render re-reads or re-parses a .docx.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from template_artifact import TemplateDocument, load_artifact, template_version
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(BASE_DIR, "invoice_templates")
+DEFAULT_TEMPLATE = "base_invoice_template.docx"
+CACHE_SIZE = 8
+
+class CompiledTemplate:
+    """A loaded template artifact and its manifest; new_document() starts a document to fill in."""
+
+    def __init__(self, name, artifact):
+        self.name = name
+        self.artifact = artifact
+        self.manifest = artifact["manifest"]
+        self.version = self.manifest["version"]
+
+    def new_document(self):
+        return TemplateDocument(self.artifact)
+
+_lock = threading.Lock()
+_listing = (None, [])        # (directory mtime, sorted template names)
+_compiled = OrderedDict()    # name -> (file mtime, CompiledTemplate), least recently used first
+
+def list_templates():
+    """Sorted template filenames (.docx, skipping Word's ~ lock files)."""
+    global _listing
+    mtime = os.stat(TEMPLATE_DIR).st_mtime
+    with _lock:
+        if _listing[0] == mtime:
+            return list(_listing[1])
+    names = sorted(f for f in os.listdir(TEMPLATE_DIR) if f.endswith(".docx") and not f.startswith("~"))
+    with _lock:
+        _listing = (mtime, names)
+    return list(names)
+
+def resolve_template(*names):
+    """
+    The first of `names` that is an available template, else DEFAULT_TEMPLATE. Pass the
+    candidates most specific first: the one chosen for this invoice, then the customer's,
+    then the default from Settings. Blank names are skipped.
+    """
+    available = set(list_templates())
+    for name in names:
+        if not name:
+            continue
+        if name in available:
+            return name
+        print(f"Template {name!r} not found, falling back")
+    return DEFAULT_TEMPLATE
+
+def get_template(name):
+    """The compiled template `name`, recompiled when its file has changed since it was cached."""
+    if os.path.basename(name) != name:
+        raise ValueError(f"Invalid template name: {name}")
+    path = os.path.join(TEMPLATE_DIR, name)
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _compiled.get(name)
+        if cached and cached[0] == mtime:
+            _compiled.move_to_end(name)
+            return cached[1]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    artifact = load_artifact(TEMPLATE_DIR, name, template_version(data))
+    if artifact is None:
+        # Not built for this version (a template copied in by hand): compile it now, once
+        from template_compiler import compile_template, build_artifact, write_artifact
+        artifact = build_artifact(*compile_template(data))
+        try:
+            write_artifact(TEMPLATE_DIR, name, artifact)
+        except OSError as e:
+            print(f"Could not store compiled template {name}: {e}")
+    template = CompiledTemplate(name, artifact)
+    with _lock:
+        _compiled[name] = (mtime, template)
+        _compiled.move_to_end(name)
+        while len(_compiled) > CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return template
+
+def save_template(name, data):
+    """
+    Validate, compile and store an uploaded template. Returns its manifest; raises
+    ValueError (with every problem found) if it can't be used as an invoice template.
+    """
+    from template_compiler import compile_template, build_artifact, write_artifact
+    if os.path.basename(name) != name or not name.endswith(".docx") or name.startswith(("~", ".")):
+        raise ValueError("Template must be a .docx file")
+    compiled, manifest = compile_template(data)
+    if manifest["errors"]:
+        raise ValueError("; ".join(manifest["errors"]))
+    artifact = build_artifact(compiled, manifest)
+    path = os.path.join(TEMPLATE_DIR, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    write_artifact(TEMPLATE_DIR, name, artifact)
+    return manifest
+
+def template_manifests():
+    """{name: manifest} for every template that has been compiled at its current version."""
+    from template_compiler import load_manifest
+    manifests = {}
+    for name in list_templates():
+        try:
+            with open(os.path.join(TEMPLATE_DIR, name), "rb") as f:
+                manifest = load_manifest(TEMPLATE_DIR, name, template_version(f.read()))
+        except OSError:
+            continue
+        if manifest:
+            manifests[name] = manifest
+    return manifests
+
+def clear_cache():
+    """Forget the directory listing and every compiled template."""
+    global _listing
+    with _lock:
+        _listing = (None, [])
+        _compiled.clear()
@@ -1,3 +1,5 @@
+import importlib.util
+import io
 import unittest
 from unittest.mock import MagicMock, patch
 from datetime import date
@@ -7,10 +9,25 @@ import sys
 # Add parent directory to path to import app modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from invoice_generator import _generate_invoice_logic, generate_invoice_for_customer, generate_invoice_with_template
+from invoice_generator import _generate_invoice_logic, generate_invoice_for_customer, generate_invoice_with_template, get_period_label, get_period_dates, parse_period_label
 from models import Customer, Property, Invoice
 from app import app
 
+def memory_session():
+    """A session on a fresh in-memory database with every table created."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from models import Base
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return Session(engine)
+
+def make_invoice(**values):
+    """An Invoice with placeholder values for the required columns a test doesn't care about."""
+    defaults = dict(invoice_date=date(2025, 1, 1), period_label="Q1 2025", file_path="x.docx",
+                    email_subject="s", email_body="b")
+    return Invoice(**dict(defaults, **values))
+
 class TestInvoiceRoutes(unittest.TestCase):
     def setUp(self):
         self.client = app.test_client()
@@ -133,16 +150,9 @@ class TestInvoiceSystem(unittest.TestCase):
         )
         self.customer.properties = []
 
-    @patch('invoice_generator.Document')
     @patch('invoice_generator.fill_invoice_template')
-    def test_batch_generation_uses_defaults(self, mock_fill, mock_doc):
+    def test_batch_generation_uses_defaults(self, mock_fill):
         """Test that automated batch generation uses the customer's default fees."""
-        # Setup mock document
-        mock_doc_instance = MagicMock()
-        mock_doc.return_value = mock_doc_instance
-        mock_doc_instance.tables = []
-        mock_doc_instance.paragraphs = []
-        
         # Call batch generation (simulated by calling logic directly as batch does)
         # Batch calls: _generate_invoice_logic(customer, ...) without kwargs
         
@@ -160,15 +170,9 @@ class TestInvoiceSystem(unittest.TestCase):
         
         print(f"\n[Batch Test] Total Amount: {replacements.get('{{TOTAL_AMOUNT}}')}")
         
-    @patch('invoice_generator.Document')
     @patch('invoice_generator.fill_invoice_template')
-    def test_manual_generation_overrides(self, mock_fill, mock_doc):
+    def test_manual_generation_overrides(self, mock_fill):
         """Test that manual generation uses provided kwargs and ignores defaults if provided."""
-        mock_doc_instance = MagicMock()
-        mock_doc.return_value = mock_doc_instance
-        mock_doc_instance.tables = []
-        mock_doc_instance.paragraphs = []
-        
         kwargs = {
             "fee_2_type": "Manual Fee 2",
             "fee_2_amount": 200.0,
@@ -200,15 +204,9 @@ class TestInvoiceSystem(unittest.TestCase):
         self.assertIn("Manual Fee 3", replacements.get('{{FEE_LINE_3}}'))
         self.assertIn("Manual Add", replacements.get('{{ADDITIONAL_FEE_LINE}}'))
 
-    @patch('invoice_generator.Document')
     @patch('invoice_generator.fill_invoice_template')
-    def test_manual_generation_partial_override(self, mock_fill, mock_doc):
+    def test_manual_generation_partial_override(self, mock_fill):
         """Test manual generation with some fields empty (should NOT use defaults if explicitly None)."""
-        mock_doc_instance = MagicMock()
-        mock_doc.return_value = mock_doc_instance
-        mock_doc_instance.tables = []
-        mock_doc_instance.paragraphs = []
-        
         # User leaves Fee 2 blank, but sets Fee 3
         kwargs = {
             "fee_2_type": None,
@@ -237,15 +235,9 @@ class TestInvoiceSystem(unittest.TestCase):
         self.assertEqual(replacements.get('{{TOTAL_AMOUNT}}'), "$400.00")
         self.assertEqual(replacements.get('{{FEE_LINE_2}}'), "")
 
-    @patch('invoice_generator.Document')
     @patch('invoice_generator.fill_invoice_template')
-    def test_property_fees_included(self, mock_fill, mock_doc):
+    def test_property_fees_included(self, mock_fill):
         """Test that property fees are added to the total."""
-        mock_doc_instance = MagicMock()
-        mock_doc.return_value = mock_doc_instance
-        mock_doc_instance.tables = []
-        mock_doc_instance.paragraphs = []
-        
         # Add a property with a fee
         prop = MagicMock()
         prop.fee_amount = 50.0
@@ -278,5 +270,652 @@ class TestInvoiceSystem(unittest.TestCase):
         # Base 100 + Fee2 50 + Fee3 75 + Add 300 + Prop 50 = 575
         self.assertEqual(replacements.get('{{TOTAL_AMOUNT}}'), "$575.00")
 
+    @patch('invoice_generator.fill_invoice_template')
+    def test_recurring_fees_become_lines(self, mock_fill):
+        """Recurring fees beyond the fixed slots are billed, printed and stored as invoice lines."""
+        from models import CustomerRecurringFee
+        from invoice_generator import build_render_snapshot, build_invoice_lines
+
+        self.customer.recurring_fees = [
+            CustomerRecurringFee(fee_type="Pest Control", amount=20.0),
+            CustomerRecurringFee(fee_type="Key Fee", description="Replacement keys", amount=5.0),
+        ]
+
+        _generate_invoice_logic(self.customer, date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+        replacements = mock_fill.call_args[0][1]
+
+        # Base 100 + Fee2 50 + Fee3 25 + Add 10 + Pest 20 + Keys 5 = 210
+        self.assertEqual(replacements['{{TOTAL_AMOUNT}}'], "$210.00")
+        self.assertIn("Default Fee 2", replacements['{{FEE_LINE_2}}'])
+        self.assertIn("October 2025 Pest Control (10/01/2025 - 10/31/2025) = $20.00", replacements['{{ADDITIONAL_FEE_LINE}}'])
+        self.assertIn("Replacement keys = $5.00", replacements['{{ADDITIONAL_FEE_LINE}}'])
+
+        snapshot = build_render_snapshot(self.customer, date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+        lines = build_invoice_lines(snapshot)
+        self.assertEqual([line.kind for line in lines], ["base", "fee_2", "fee_3", "fee", "fee", "fee"])
+        self.assertEqual([line.position for line in lines], list(range(6)))
+        self.assertEqual(sum(line.amount for line in lines), 210.0)
+
+class TestPeriodColumns(unittest.TestCase):
+    def test_parse_period_label_round_trips(self):
+        """Every label get_period_label produces parses back to get_period_dates."""
+        for cadence in ("monthly", "quarterly", "yearly"):
+            for month in range(1, 13):
+                invoice_date = date(2025, month, 1)
+                label = get_period_label(invoice_date, cadence)
+                self.assertEqual(parse_period_label(label), get_period_dates(invoice_date, cadence), label)
+
+        self.assertEqual(parse_period_label("Q4 2025"), (date(2025, 10, 1), date(2025, 12, 31)))
+        self.assertEqual(parse_period_label("Jan 2025"), (date(2025, 1, 1), date(2025, 1, 31)))
+        self.assertIsNone(parse_period_label("Delete Me"))
+
+    def test_backfill_invoice_periods(self):
+        """The batched backfill fills parseable labels and leaves the rest empty."""
+        from backfills import backfill_invoice_periods
+
+        with memory_session() as session:
+            for label in ["3rd quarter 2025", "March 2025", "2024", "Delete Me"]:
+                session.add(make_invoice(customer_id=1, period_label=label, amount=1.0))
+            session.commit()
+
+            updated, unparsed = backfill_invoice_periods(session, batch_size=2)
+            self.assertEqual((updated, unparsed), (3, 1))
+
+            periods = {inv.period_label: (inv.period_start, inv.period_end) for inv in session.query(Invoice)}
+            self.assertEqual(periods["3rd quarter 2025"], (date(2025, 7, 1), date(2025, 9, 30)))
+            self.assertEqual(periods["March 2025"], (date(2025, 3, 1), date(2025, 3, 31)))
+            self.assertEqual(periods["2024"], (date(2024, 1, 1), date(2024, 12, 31)))
+            self.assertEqual(periods["Delete Me"], (None, None))
+
+class TestInvoiceTotals(unittest.TestCase):
+    def setUp(self):
+        self.session = memory_session()
+        self.addCleanup(self.session.close)
+
+    def test_totals_backfill_and_aggregates(self):
+        """Backfilled totals include every fee and the SQL aggregates split paid from outstanding."""
+        from backfills import backfill_invoice_totals
+        from reports import invoice_totals, customer_totals
+
+        session = self.session
+        session.add(make_invoice(customer_id=1, amount=100.0, fee_2_amount=25.0, additional_fee_amount=5.0, status="Paid"))
+        session.add(make_invoice(customer_id=1, amount=200.0))
+        session.add(make_invoice(customer_id=2, amount=50.0, total_amount=80.0))
+        session.commit()
+
+        self.assertEqual(backfill_invoice_totals(session, batch_size=1), 2)
+
+        totals = invoice_totals(session)
+        self.assertEqual(totals["count"], 3)
+        self.assertAlmostEqual(totals["billed"], 410.0)
+        self.assertAlmostEqual(totals["collected"], 130.0)
+        self.assertAlmostEqual(totals["outstanding"], 280.0)
+
+        per_customer = customer_totals(session)
+        self.assertAlmostEqual(per_customer[1]["outstanding"], 200.0)
+        self.assertAlmostEqual(per_customer[2]["billed"], 80.0)
+
+class TestInvoiceLines(unittest.TestCase):
+    def setUp(self):
+        self.session = memory_session()
+        self.addCleanup(self.session.close)
+
+    def test_invoice_lines_backfill_and_fee_type_revenue(self):
+        """Invoices without lines get them from their fee columns; revenue groups by fee type."""
+        from models import InvoiceLine
+        from backfills import backfill_invoice_lines
+        from reports import fee_type_revenue
+
+        session = self.session
+        session.add(make_invoice(customer_id=1, amount=100.0, fee_2_type="Inspection Fee", fee_2_amount=25.0))
+        session.add(make_invoice(customer_id=2, amount=200.0, fee_3_type="Inspection Fee", fee_3_amount=30.0))
+        session.commit()
+
+        self.assertEqual(backfill_invoice_lines(session, batch_size=1), 2)
+        self.assertEqual(backfill_invoice_lines(session), 0)
+        self.assertEqual(session.query(InvoiceLine).count(), 4)
+
+        revenue = {row.fee_type: row.billed for row in fee_type_revenue(session)}
+        self.assertEqual(revenue, {"Management Fee": 300.0, "Inspection Fee": 55.0})
+
+class TestReceivables(unittest.TestCase):
+    def setUp(self):
+        self.session = memory_session()
+        self.addCleanup(self.session.close)
+
+    def balances(self):
+        from models import ReceivableBalance
+        return sorted((b.customer_id, b.invoice_date, b.open_count, b.open_amount)
+                      for b in self.session.query(ReceivableBalance))
+
+    def test_receivable_balances_track_invoices(self):
+        """Incremental balance updates match a full rebuild, and aging buckets by invoice date."""
+        from datetime import timedelta
+        from reports import adjust_receivables, rebuild_receivables, receivables_aging
+
+        session = self.session
+        today = date(2025, 6, 30)
+        invoices = [
+            make_invoice(customer_id=1, invoice_date=today - timedelta(days=10), amount=100.0, total_amount=120.0),
+            make_invoice(customer_id=1, invoice_date=today - timedelta(days=45), amount=50.0),
+            make_invoice(customer_id=2, invoice_date=today - timedelta(days=100), amount=200.0),
+            make_invoice(customer_id=2, invoice_date=today - timedelta(days=100), amount=30.0),
+        ]
+        session.add_all(invoices)
+        adjust_receivables(session, invoices, 1)
+        session.commit()
+
+        # Pay one, then delete another
+        invoices[3].status = "Paid"
+        adjust_receivables(session, [invoices[3]], -1)
+        adjust_receivables(session, [invoices[1]], -1)
+        session.delete(invoices[1])
+        session.commit()
+
+        incremental = self.balances()
+        self.assertEqual(incremental, [(1, today - timedelta(days=10), 1, 120.0),
+                                       (2, today - timedelta(days=100), 1, 200.0)])
+        rebuild_receivables(session)
+        self.assertEqual(self.balances(), incremental)
+
+        rows, totals = receivables_aging(session, today=today)
+        self.assertEqual([r.customer_id for r in rows], [2, 1])
+        self.assertEqual((totals.current, totals.days_30, totals.days_60, totals.days_90), (120.0, 0, 0, 200.0))
+        self.assertEqual((totals.count, totals.total), (2, 320.0))
+
+    def test_balances_without_a_period_share_one_row(self):
+        """Invoices without a billing period upsert into one balance; the key rejects a second row for it."""
+        from sqlalchemy.exc import IntegrityError
+        from models import ReceivableBalance
+        from reports import adjust_receivables
+
+        session = self.session
+        first, second = make_invoice(customer_id=1, amount=100.0), make_invoice(customer_id=1, amount=50.0)
+        session.add_all([first, second])
+        adjust_receivables(session, [first], 1)
+        adjust_receivables(session, [second], 1)
+        session.commit()
+        self.assertEqual(self.balances(), [(1, date(2025, 1, 1), 2, 150.0)])
+
+        session.add(ReceivableBalance(customer_id=1, invoice_date=date(2025, 1, 1), open_count=1, open_amount=1.0))
+        with self.assertRaises(IntegrityError):
+            session.commit()
+        session.rollback()
+
+        adjust_receivables(session, [first, second], -1)
+        session.commit()
+        self.assertEqual(self.balances(), [])
+
+class TestReconcilePayments(unittest.TestCase):
+    def setUp(self):
+        self.session = memory_session()
+        self.addCleanup(self.session.close)
+
+    def test_reconcile_payments(self):
+        """Payments match open invoices by email or name, amount and period; the rest go to review."""
+        from models import ReceivableBalance
+        from reports import rebuild_receivables
+        from reconcile import reconcile_payments
+
+        session = self.session
+        owner = Customer(name="Pat Owner", email="Pat@Example.com", property_address="1 Main St",
+                         rate=100.0, cadence="monthly", next_bill_date=date(2025, 12, 1))
+        session.add(owner)
+        session.flush()
+        for month in (9, 10, 11):
+            start, end = get_period_dates(date(2025, month, 1), "monthly")
+            session.add(make_invoice(customer_id=owner.id, invoice_date=start, period_label=get_period_label(start, "monthly"),
+                                     period_start=start, period_end=end, amount=100.0, total_amount=150.0, status="Unpaid"))
+        session.commit()
+        rebuild_receivables(session)
+
+        csv_lines = [
+            "Payer,Email,Amount,Date,Period\n",
+            ",pat@example.com,$150.00,2025-10-05,October 2025\n",
+            "pat owner,,150,11/20/2025,2025-11-15\n",
+            ",pat@example.com,150.00,,October 2025\n",
+            ",nobody@example.com,150.00,,\n",
+            ",pat@example.com,abc,,\n",
+        ]
+        matched, unmatched = reconcile_payments(session, csv_lines, default_paid_date=date(2025, 12, 1))
+
+        self.assertEqual([row for row, _, _ in matched], [2, 3])
+        self.assertEqual([row for row, _, _ in unmatched], [4, 5, 6])
+        paid = {inv.period_label: inv.paid_date for inv in session.query(Invoice).filter_by(status="Paid")}
+        self.assertEqual(paid, {"October 2025": date(2025, 10, 5), "November 2025": date(2025, 11, 20)})
+        self.assertEqual([(b.open_count, b.open_amount) for b in session.query(ReceivableBalance)], [(1, 150.0)])
+
+class TestCustomerImport(unittest.TestCase):
+    def test_import_creates_updates_and_reports(self):
+        """Rows create new customers, upsert changed ones, and a dry run writes nothing."""
+        from customer_import import import_customers, summarize
+
+        csv_lines = [
+            "name,email,property_address,rate,cadence,next_bill_date,fee_2_type,fee_2_rate\n",
+            "Existing Owner,OWNER@example.com,,250,,,,\n",
+            "New Owner,new@example.com,9 New St,\"$1,200.00\",Monthly,2025-11-01,Inspection Fee,40\n",
+            "Bad Rate,bad@example.com,1 Bad St,lots,monthly,2025-11-01,,\n",
+            "Incomplete,incomplete@example.com,1 Half St,100,monthly,,,\n",
+            "Again,new@example.com,9 New St,100,monthly,2025-11-01,,\n",
+        ]
+        with memory_session() as session:
+            session.add(Customer(name="Existing Owner", email="owner@example.com", property_address="1 Old St",
+                                 rate=200.0, cadence="quarterly", next_bill_date=date(2025, 10, 1)))
+            session.commit()
+
+            report = import_customers(session, csv_lines, dry_run=True)
+            self.assertEqual(summarize(report), {"create": 1, "update": 1, "unchanged": 0, "error": 3})
+            self.assertEqual(report[0]["changes"], {"rate": (200.0, 250.0)})
+            self.assertEqual(session.query(Customer).count(), 1)
+
+            import_customers(session, csv_lines, chunk_size=1)
+            customers = {c.email: c for c in session.query(Customer)}
+            self.assertEqual(len(customers), 2)
+            self.assertEqual((customers["owner@example.com"].rate, customers["owner@example.com"].cadence), (250.0, "quarterly"))
+            self.assertEqual(customers["new@example.com"].rate, 1200.0)
+            self.assertEqual(customers["new@example.com"].fee_2_rate, 40.0)
+
+            report = import_customers(session, csv_lines[:2])
+            self.assertEqual(report[0]["action"], "unchanged")
+
+class TestSeedFromTemplates(unittest.TestCase):
+    def test_manifest_skips_unchanged_files(self):
+        """A second run parses nothing; a changed file is re-parsed and updates its customer."""
+        import tempfile
+        from docx import Document
+        from sqlalchemy import create_engine
+        import models
+        from models import Base, SessionLocal
+        from seed_from_templates import seed_customers
+
+        def write_invoice(path, rate):
+            doc = Document()
+            doc.add_paragraph("TO: Template Owner")
+            doc.add_paragraph("FOR: 12 Elm St, Madison, WI 53703")
+            doc.add_paragraph(f"Quarterly management fee ${rate:.2f}")
+            doc.add_paragraph("owner@example.com")
+            doc.save(path)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'seed.db')}")
+            Base.metadata.create_all(bind=engine)
+            SessionLocal.configure(bind=engine)
+            try:
+                invoice_path = os.path.join(tmp, "owner.docx")
+                write_invoice(invoice_path, 300)
+                self.assertEqual(seed_customers(tmp, workers=1), (1, 0))
+                # The manifest lives with the invoices it describes
+                self.assertTrue(os.path.exists(os.path.join(tmp, ".seed_manifest.json")))
+                self.assertEqual(seed_customers(tmp, workers=1), (0, 0))
+
+                write_invoice(invoice_path, 450)
+                os.utime(invoice_path, (1, 1))
+                self.assertEqual(seed_customers(tmp, workers=1), (0, 1))
+                session = SessionLocal()
+                customer = session.query(Customer).one()
+                self.assertEqual((customer.rate, customer.cadence, customer.property_city), (450.0, "quarterly", "Madison"))
+                session.close()
+            finally:
+                SessionLocal.configure(bind=models.engine)
+
+    def test_parses_in_process_without_a_pool(self):
+        """Where a process pool can't start (no /dev/shm on Lambda), files are parsed in-process."""
+        import seed_from_templates
+
+        with patch.object(seed_from_templates, "ProcessPoolExecutor", side_effect=OSError(38, "Function not implemented")), \
+             patch.object(seed_from_templates, "parse_template", side_effect=lambda path: {"path": path}):
+            results = seed_from_templates.parse_templates(["a.docx", "b.docx"])
+        self.assertEqual(results, [{"path": "a.docx"}, {"path": "b.docx"}])
+
+class TestDocxText(unittest.TestCase):
+    def test_matches_python_docx_text(self):
+        """Paragraph and cell text from the iterparse extractor match python-docx's."""
+        import tempfile
+        from docx import Document
+        from docx.enum.text import WD_BREAK
+        from docx_text import iter_text, paragraph_texts
+
+        doc = Document()
+        para = doc.add_paragraph("TO: {{CUSTOMER_NAME}}")
+        para.paragraph_format.tab_stops.add_tab_stop(914400)
+        para.add_run("\tline").add_break()
+        para.add_run("next").add_break(WD_BREAK.PAGE)
+        table = doc.add_table(rows=2, cols=2)
+        table.cell(0, 0).text = "Rate"
+        table.cell(1, 1).add_paragraph("{{TOTAL_AMOUNT}}")
+        doc.add_paragraph("")
+        doc.add_paragraph("Total due $150.00")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sample.docx")
+            doc.save(path)
+            doc = Document(path)
+            self.assertEqual(paragraph_texts(path), [p.text for p in doc.paragraphs])
+            cells = [(block.position, block.text) for block in iter_text(path) if block.kind == "cell"]
+            expected = [((0, r, c), cell.text) for r, row in enumerate(doc.tables[0].rows)
+                        for c, cell in enumerate(row.cells)]
+            self.assertEqual(cells, expected)
+
+class TestTemplateRegistry(unittest.TestCase):
+    def test_resolves_and_caches_templates(self):
+        """Invoices use the customer's template; compiled templates are reused, bounded and never mutated."""
+        import tempfile
+        from docx import Document
+        import template_registry
+        from invoice_generator import build_render_snapshot, render_invoice_snapshot
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, heading in (("base_invoice_template.docx", "Base"), ("commercial.docx", "Commercial"),
+                                  ("residential.docx", "Residential")):
+                doc = Document()
+                doc.add_paragraph(f"{heading} invoice for {{{{CUSTOMER_NAME}}}}")
+                doc.save(os.path.join(tmp, name))
+
+            with patch.object(template_registry, "TEMPLATE_DIR", tmp), patch.object(template_registry, "CACHE_SIZE", 2):
+                template_registry.clear_cache()
+                try:
+                    self.assertEqual(template_registry.list_templates(),
+                                     ["base_invoice_template.docx", "commercial.docx", "residential.docx"])
+                    self.assertEqual(template_registry.resolve_template("", "missing.docx", "residential.docx"), "residential.docx")
+
+                    customer = Customer(name="Jane", email="jane@example.com", property_address="1 Main St",
+                                        rate=100.0, cadence="monthly", template_name="commercial.docx")
+                    customer.properties = []
+                    snapshot = build_render_snapshot(customer, date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+                    self.assertEqual(snapshot["template"], "commercial.docx")
+                    self.assertEqual(build_render_snapshot(customer, date(2025, 10, 1), "October 2025", "", 100.0,
+                                                           template_name="residential.docx")["template"], "residential.docx")
+
+                    compiled = template_registry.get_template("commercial.docx")
+                    for _ in range(2):
+                        _, buffer, _ = render_invoice_snapshot(snapshot)
+                        self.assertEqual(Document(buffer).paragraphs[0].text, "Commercial invoice for Jane")
+                    self.assertIs(template_registry.get_template("commercial.docx"), compiled)
+
+                    template_registry.get_template("base_invoice_template.docx")
+                    self.assertEqual(list(template_registry._compiled), ["commercial.docx", "base_invoice_template.docx"])
+                finally:
+                    template_registry.clear_cache()
+
+class TestTemplateCompiler(unittest.TestCase):
+    def _template(self, path, extra=""):
+        from docx import Document
+        doc = Document()
+        para = doc.add_paragraph("TO: ")
+        for part in ("{{CUST", "OMER_", "NAME}}"):
+            para.add_run(part).bold = True
+        table = doc.add_table(rows=2, cols=1)
+        table.cell(0, 0).text = "{{FEE_LINE_2}}"
+        table.cell(1, 0).text = "Total due: {{TOTAL_AMOUNT}}" + extra
+        doc.save(path)
+
+    def test_compile_merges_split_runs_and_locates_fee_rows(self):
+        """Split placeholders are merged into one run, fee rows are located, and unused ones are removed on render."""
+        import tempfile
+        from docx import Document
+        import template_registry
+        from template_compiler import compile_template
+        from invoice_generator import build_render_snapshot, render_invoice_snapshot
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "base_invoice_template.docx")
+            self._template(path)
+            with open(path, "rb") as f:
+                compiled, manifest = compile_template(f.read())
+
+            self.assertEqual(manifest["errors"], [])
+            self.assertEqual(manifest["split_placeholders"], 1)
+            self.assertEqual(manifest["fee_blocks"], [{"placeholder": "FEE_LINE_2", "block": "row", "paragraph": 1, "table": 0, "row": 0}])
+            self.assertEqual(len(manifest["warnings"]), 2)
+            self.assertIn("word/styles.xml", manifest["static_parts"])
+            self.assertEqual(manifest["dynamic_parts"], ["word/document.xml"])
+            runs = Document(io.BytesIO(compiled)).paragraphs[0].runs
+            self.assertEqual([r.text for r in runs], ["TO: ", "{{CUSTOMER_NAME}}", "", ""])
+            self.assertTrue(runs[1].bold)
+
+            self._template(path, extra=" {{TOTAL_AMUONT}}")
+            with open(path, "rb") as f:
+                self.assertEqual(compile_template(f.read())[1]["errors"], ["Unknown placeholder {{TOTAL_AMUONT}}"])
+            with self.assertRaises(ValueError):
+                compile_template(b"not a docx")
+
+            self._template(path)
+            with patch.object(template_registry, "TEMPLATE_DIR", tmp):
+                template_registry.clear_cache()
+                try:
+                    customer = Customer(name="Jane", email="jane@example.com", property_address="1 Main St",
+                                        rate=100.0, cadence="monthly")
+                    customer.properties = []
+                    snapshot = build_render_snapshot(customer, date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+                    _, buffer, _ = render_invoice_snapshot(snapshot)
+                    doc = Document(buffer)
+                    self.assertIn("Jane", doc.paragraphs[0].text)
+                    name_run = doc.paragraphs[0].runs[1]
+                    self.assertEqual((name_run.text, name_run.bold, name_run.font.size), ("Jane", True, None))
+                    self.assertEqual([row.cells[0].text for row in doc.tables[0].rows], ["Total due: $100.00"])
+                    self.assertTrue(os.path.exists(os.path.join(tmp, ".compiled", "base_invoice_template.docx.json")))
+                    self.assertTrue(os.path.exists(os.path.join(tmp, ".compiled", "base_invoice_template.docx.artifact")))
+                finally:
+                    template_registry.clear_cache()
+
+    def test_property_rows_repeat_per_property(self):
+        """A row holding property fee placeholders is stamped out once per property fee, and dropped without any."""
+        import tempfile
+        from docx import Document
+        import template_registry
+        from models import Property
+        from template_compiler import compile_template
+        from invoice_generator import build_render_snapshot, render_invoice_snapshot
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "base_invoice_template.docx")
+            doc = Document()
+            doc.add_paragraph("TO: {{CUSTOMER_NAME}}")
+            table = doc.add_table(rows=2, cols=2)
+            table.cell(0, 0).text = "{{PROPERTY_FEE_ADDRESS}}"
+            table.cell(0, 1).text = "{{PROPERTY_FEE_AMOUNT}}"
+            table.cell(1, 0).text = "Total due: {{TOTAL_AMOUNT}}"
+            doc.save(path)
+            with open(path, "rb") as f:
+                manifest = compile_template(f.read())[1]
+            self.assertEqual(manifest["errors"], [])
+            self.assertEqual(manifest["repeat_blocks"], [{"name": "PROPERTY", "block": "row", "paragraph": None, "table": 0, "row": 0}])
+
+            with patch.object(template_registry, "TEMPLATE_DIR", tmp):
+                template_registry.clear_cache()
+                try:
+                    customer = Customer(name="Jane", email="jane@example.com", property_address="1 Main St",
+                                        rate=100.0, cadence="monthly")
+                    customer.properties = [Property(address=f"{n} Oak Ave", fee_amount=10.0 * n) for n in (1, 2, 3)]
+                    snapshot = build_render_snapshot(customer, date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+                    rows = Document(render_invoice_snapshot(snapshot)[1]).tables[0].rows
+                    self.assertEqual([(row.cells[0].text, row.cells[1].text) for row in rows[:3]],
+                                     [("1 Oak Ave", "$10.00"), ("2 Oak Ave", "$20.00"), ("3 Oak Ave", "$30.00")])
+                    self.assertEqual(rows[3].cells[0].text, "Total due: $160.00")
+
+                    customer.properties = []
+                    snapshot = build_render_snapshot(customer, date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+                    rows = Document(render_invoice_snapshot(snapshot)[1]).tables[0].rows
+                    self.assertEqual([row.cells[0].text for row in rows], ["Total due: $100.00"])
+                finally:
+                    template_registry.clear_cache()
+
+    def test_committed_artifacts_are_current(self):
+        """Deploys ship the committed artifacts, so each checked-in template's must match a fresh compile."""
+        import template_registry
+        from template_artifact import load_artifact, template_version
+        from template_compiler import build_artifact, compile_template
+
+        for name in template_registry.list_templates():
+            with self.subTest(template=name):
+                with open(os.path.join(template_registry.TEMPLATE_DIR, name), "rb") as f:
+                    data = f.read()
+                artifact = load_artifact(template_registry.TEMPLATE_DIR, name, template_version(data))
+                self.assertEqual(artifact, build_artifact(*compile_template(data)),
+                                 f"{name} is stale: run python template_compiler.py and commit invoice_templates/.compiled/")
+
+class TestFillInvoiceTemplate(unittest.TestCase):
+    def test_substitution_keeps_run_formatting(self):
+        """Only the runs holding a placeholder change, split placeholders included, and nothing is reformatted."""
+        from docx import Document
+        from docx.shared import Pt
+        from invoice_generator import fill_invoice_template
+        from template_artifact import TemplateDocument
+        from template_compiler import compile_template, build_artifact
+
+        doc = Document()
+        para = doc.add_paragraph()
+        label = para.add_run("Total: ")
+        label.font.size = Pt(18)
+        for part in ("{{TOTAL", "_AMO", "UNT}} due"):
+            para.add_run(part).bold = True
+        doc.add_paragraph("{{CUSTOMER_NAME}} / {{CUSTOMER_NAME}} / {{UNKNOWN}}")
+        doc.add_table(rows=1, cols=1).cell(0, 0).text = "Email: {{CUSTOMER_EMAIL}}"
+        source = io.BytesIO()
+        doc.save(source)
+
+        filled = TemplateDocument(build_artifact(*compile_template(source.getvalue())))
+        fill_invoice_template(filled, {"{{TOTAL_AMOUNT}}": "$1,250.00", "{{CUSTOMER_NAME}}": "A & B",
+                                       "{{CUSTOMER_EMAIL}}": "ab@example.com"})
+        output = io.BytesIO()
+        filled.save(output)
+        doc = Document(output)
+
+        runs = doc.paragraphs[0].runs
+        self.assertEqual([r.text for r in runs], ["Total: ", "$1,250.00", "", " due"])
+        self.assertEqual(runs[0].font.size, Pt(18))
+        self.assertTrue(all(r.bold for r in runs[1:]))
+        self.assertIsNone(runs[1].font.name)
+        self.assertEqual(doc.paragraphs[1].text, "A & B / A & B / {{UNKNOWN}}")
+        self.assertEqual(doc.tables[0].cell(0, 0).text, "Email: ab@example.com")
+
+class TestArtifactStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def check_store(self, store):
+        key = store.put(b"invoice one")
+        self.assertEqual(store.put(b"invoice one"), key)
+        self.assertNotEqual(store.put(b"invoice two"), key)
+        self.assertEqual(store.open(key).read(), b"invoice one")
+        self.assertIsNone(store.open("0" * 64))
+        self.assertIsNone(store.get_ref("render"))
+        store.set_ref("render", key)
+        self.assertEqual(store.get_ref("render"), key)
+
+    def test_local_store_keeps_identical_documents_once(self):
+        from artifact_store import LocalStore
+        store = LocalStore(self.tmp.name)
+        self.check_store(store)
+        blobs = [name for _, _, files in os.walk(os.path.join(self.tmp.name, "blobs")) for name in files]
+        self.assertEqual(len(blobs), 2)
+
+    def test_local_store_falls_back_when_directory_is_read_only(self):
+        import artifact_store
+        blocker = os.path.join(self.tmp.name, "file")
+        open(blocker, "w").close()
+        fallback = os.path.join(self.tmp.name, "fallback")
+        with patch.dict(os.environ, {"ARTIFACT_STORE": "local", "ARTIFACT_STORE_DIR": os.path.join(blocker, "store")}), \
+                patch.multiple(artifact_store, _store=None, _configured=False, FALLBACK_DIR=fallback):
+            self.assertEqual(artifact_store.get_store().root, fallback)
+        with patch.dict(os.environ, {"ARTIFACT_STORE": "local", "ARTIFACT_STORE_DIR": os.path.join(blocker, "store")}), \
+                patch.multiple(artifact_store, _store=None, _configured=False, FALLBACK_DIR=os.path.join(blocker, "tmp")):
+            self.assertIsNone(artifact_store.get_store())
+
+    def test_misconfigured_store_turns_storage_off(self):
+        """A bad store setting is logged once and leaves invoices rendered on demand instead of failing."""
+        import artifact_store
+        from invoice_generator import store_invoice_documents
+        for env in ({"ARTIFACT_STORE": "s3"}, {"ARTIFACT_STORE": "ftp"}):
+            with patch.dict(os.environ, env), patch.multiple(artifact_store, _store=None, _configured=False):
+                os.environ.pop("ARTIFACT_S3_BUCKET", None)
+                self.assertIsNone(artifact_store.get_store())
+                self.assertTrue(artifact_store._configured)
+                self.assertEqual(store_invoice_documents(["{}"]), 0)
+
+    @unittest.skipUnless(importlib.util.find_spec("boto3") and importlib.util.find_spec("moto"), "boto3/moto not installed")
+    def test_s3_store(self):
+        import boto3
+        from moto import mock_aws
+        from artifact_store import S3Store
+        with mock_aws():
+            client = boto3.client("s3", region_name="us-east-1")
+            client.create_bucket(Bucket="invoices")
+            self.check_store(S3Store("invoices", "test/", client=client))
+            keys = [obj["Key"] for obj in client.list_objects_v2(Bucket="invoices")["Contents"]]
+            self.assertEqual(len([key for key in keys if key.startswith("test/blobs/")]), 2)
+
+    def test_billing_run_stores_documents_for_downloads(self):
+        """Stored once per distinct render, in parallel; a later download streams the stored bytes."""
+        import json
+        from artifact_store import LocalStore
+        from invoice_generator import (build_render_snapshot, render_invoice, render_key, store_invoice_documents,
+                                       stored_invoice)
+        store = LocalStore(self.tmp.name)
+        snapshots = [
+            build_render_snapshot(Customer(name=name, email="store@example.com", property_address="1 Store St",
+                                           rate=100.0, cadence="monthly"),
+                                  date(2025, 10, 1), "October 2025", "10/01/2025 - 10/31/2025", 100.0)
+            for name in ("Store One", "Store Two", "Store One")
+        ]
+        render_snapshots = [json.dumps(snapshot) for snapshot in snapshots]
+
+        with patch("invoice_generator.get_store", return_value=store):
+            self.assertEqual(store_invoice_documents(render_snapshots), 2)
+            self.assertEqual(store_invoice_documents(render_snapshots), 0)
+            key = render_key(snapshots[0])
+            with patch("invoice_generator.render_invoice") as render:
+                filename, stored = stored_invoice(snapshots[0], key)
+                render.assert_not_called()
+            self.assertEqual(filename, render_invoice(snapshots[0])[0])
+            self.assertEqual(stored.read(), render_invoice(snapshots[0])[1].getvalue())
+            stored.close()
+
+class TestAnalyticsSnapshot(unittest.TestCase):
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow not installed")
+    def test_incremental_parquet_snapshot(self):
+        """The first run writes everything; the next appends only new and changed invoices."""
+        import tempfile
+        import pyarrow.parquet as pq
+        from sqlalchemy import create_engine, update
+        import models
+        from models import SessionLocal
+        from synthetic_data import build_dataset
+        from models import InvoiceLine
+        from analytics_snapshot import record_invoice_deletions, write_snapshot
+
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'analytics.db')}")
+            build_dataset(engine, customers=6, invoices_per_customer=2)
+            SessionLocal.configure(bind=engine)
+            try:
+                out = os.path.join(tmp, "snapshot")
+                counts = write_snapshot(out)
+                self.assertEqual((counts["invoices"], counts["customers"], counts["properties"]), (12, 6, 6))
+                self.assertEqual(pq.read_table(os.path.join(out, "invoices")).num_rows, 12)
+                self.assertTrue(any(name.startswith("year=") for name in os.listdir(os.path.join(out, "invoices"))))
+
+                with engine.begin() as conn:
+                    conn.execute(update(Invoice).where(Invoice.id == 1).values(status="Paid"))
+                counts = write_snapshot(out)
+                self.assertEqual((counts["invoices"], counts["invoice_lines"]), (1, 0))
+                self.assertEqual(pq.read_table(os.path.join(out, "invoices")).num_rows, 13)
+
+                session = SessionLocal()
+                record_invoice_deletions(session, Invoice.id == 2)
+                session.query(InvoiceLine).filter_by(invoice_id=2).delete()
+                session.query(Invoice).filter_by(id=2).delete()
+                session.commit()
+                session.close()
+                counts = write_snapshot(out)
+                self.assertEqual((counts["invoices"], counts["deleted_invoices"]), (0, 1))
+                self.assertEqual(pq.read_table(os.path.join(out, "deleted_invoices")).column("invoice_id").to_pylist(), [2])
+                self.assertEqual(write_snapshot(out)["deleted_invoices"], 0)
+                self.assertEqual(write_snapshot(out, full=True)["deleted_invoices"], 0)
+            finally:
+                SessionLocal.configure(bind=models.engine)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from flask import Flask
+
+from profiling import init_profiling
+
+class TestRequestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+
+        @self.app.route("/slow")
+        def slow():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+            return "done"
+
+        init_profiling(self.app, enabled=True, profile_dir=self.profile_dir, interval_ms=1)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def test_unflagged_request_is_not_profiled(self):
+        response = self.client.get("/slow")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-File", response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_flagged_request_writes_collapsed_stacks(self):
+        response = self.client.get("/slow?_profile=1")
+        filename = response.headers["X-Profile-File"]
+        with open(os.path.join(self.profile_dir, filename)) as f:
+            lines = f.read().splitlines()
+
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertIn("slow (test_profiling.py:", stack)
+
+        # Header trigger works too, and the file can be downloaded back
+        response = self.client.get("/slow", headers={"X-Profile": "1"})
+        self.assertIn("X-Profile-File", response.headers)
+        download = self.client.get(f"/_profiles/{filename}")
+        self.assertEqual(download.status_code, 200)
+        download.close()
+
+if __name__ == '__main__':
+    unittest.main()
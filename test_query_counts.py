@@ -0,0 +1,155 @@
+import unittest
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+from datetime import date
+
+from sqlalchemy import create_engine, event, select
+
+import models
+from models import SessionLocal, Customer, Invoice
+from synthetic_data import build_dataset
+from app import app
+
+# Two portfolios that differ in every dimension a route could accidentally scale with:
+# customers, properties per customer, invoice history and customers due for billing.
+SMALL = dict(customers=4, properties_per_customer=1, invoices_per_customer=2, due_customers=2)
+LARGE = dict(customers=40, properties_per_customer=4, invoices_per_customer=8, due_customers=5)
+
+class QueryCounter:
+    """Collect every SQL statement executed on an engine while the block runs."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    @property
+    def reads(self):
+        return [s for s in self.statements if s.lstrip().upper().startswith("SELECT")]
+
+class TestQueryCounts(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.tmpdir = tempfile.mkdtemp()
+        self.engines = []
+
+    def tearDown(self):
+        SessionLocal.configure(bind=models.engine)
+        for engine in self.engines:
+            engine.dispose()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _run_against(self, size, make_request):
+        """Seed a fresh database of the given size, run one request and return its QueryCounter."""
+        path = os.path.join(self.tmpdir, f"db_{len(self.engines)}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        self.engines.append(engine)
+        build_dataset(engine, **size)
+        SessionLocal.configure(bind=engine)
+
+        with engine.connect() as conn:
+            ids = {
+                "customer_id": conn.scalar(select(Customer.id).order_by(Customer.id)),
+                "invoice_id": conn.scalar(select(Invoice.id).order_by(Invoice.id)),
+            }
+
+        with contextlib.redirect_stdout(io.StringIO()), QueryCounter(engine) as counter:
+            response = make_request(self.client, ids)
+        self.assertLess(response.status_code, 400, response.data[:500])
+        return counter
+
+    def assertConstantQueries(self, make_request):
+        """
+        Fail if the route issues more SELECTs against the large portfolio than the small one.
+        Writes are allowed to scale with the rows being written (SQLite can't batch
+        INSERT ... RETURNING), so only reads are compared.
+        """
+        small = self._run_against(SMALL, make_request)
+        large = self._run_against(LARGE, make_request)
+        self.assertEqual(
+            len(small.reads), len(large.reads),
+            f"SELECT count grew with data size ({len(small.reads)} -> {len(large.reads)}):\n"
+            + "\n".join(large.statements)
+        )
+
+    def test_list_customers(self):
+        self.assertConstantQueries(lambda client, ids: client.get('/customers'))
+
+    def test_list_invoices(self):
+        self.assertConstantQueries(lambda client, ids: client.get('/invoices'))
+
+    def test_revenue_report(self):
+        self.assertConstantQueries(lambda client, ids: client.get('/reports/revenue'))
+
+    def test_aging_report(self):
+        self.assertConstantQueries(lambda client, ids: client.get('/reports/aging'))
+
+    def test_generate_invoice_form(self):
+        self.assertConstantQueries(lambda client, ids: client.get('/generate-invoice'))
+
+    def test_generate_invoice_submit(self):
+        def submit(client, ids):
+            return client.post('/generate-invoice', data={
+                "customer_id": ids["customer_id"],
+                "invoice_date": date.today().isoformat(),
+                "template_name": "base_invoice_template.docx",
+                "fee_2_type": "Late Fee",
+                "fee_2_amount": "25.00",
+            })
+        self.assertConstantQueries(submit)
+
+    def test_download_invoice(self):
+        self.assertConstantQueries(
+            lambda client, ids: client.get(f'/invoices/{ids["invoice_id"]}/download')
+        )
+
+    def test_run_today(self):
+        self.assertConstantQueries(lambda client, ids: client.get('/run-today'))
+
+    def test_edit_customer_form(self):
+        self.assertConstantQueries(
+            lambda client, ids: client.get(f'/customers/{ids["customer_id"]}/edit')
+        )
+
+    def test_edit_customer_submit(self):
+        def submit(client, ids):
+            return client.post(f'/customers/{ids["customer_id"]}/edit', data={
+                "name": "Renamed Owner",
+                "email": "renamed@example.com",
+                "property_address": "1 Renamed St",
+                "property_city": "Milwaukee",
+                "property_state": "WI",
+                "property_zip": "53202",
+                "rate": "300.00",
+                "cadence": "monthly",
+                "fee_type": "Management Fee",
+                "next_bill_date": date.today().isoformat(),
+            })
+        self.assertConstantQueries(submit)
+
+    def test_add_property(self):
+        def submit(client, ids):
+            return client.post(f'/customers/{ids["customer_id"]}/add-property', data={
+                "address": "77 New Property Rd",
+                "city": "Madison",
+                "state": "WI",
+                "zip_code": "53703",
+                "fee_amount": "60.00",
+            })
+        self.assertConstantQueries(submit)
+
+if __name__ == '__main__':
+    unittest.main()
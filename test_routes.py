@@ -75,6 +75,9 @@ class TestRoutes(unittest.TestCase):
             print(response.data.decode('utf-8'))
         self.assertEqual(response.status_code, 200)
 
+        response = self.client.get('/invoices?period_from=2025-13-01')
+        self.assertEqual(response.status_code, 400)
+
     def test_delete_invoice(self):
         print("\nTesting DELETE /invoices/<id>/delete...")
         # Create an invoice to delete
@@ -221,6 +224,363 @@ class TestRoutes(unittest.TestCase):
         self.assertEqual(total_amount, 550.0)
         session.close()
 
+    def test_download_uses_render_snapshot(self):
+        """Re-downloading renders from the invoice's snapshot, unaffected by later customer edits."""
+        from docx import Document
+        from invoice_generator import generate_invoice_buffer
+
+        session = SessionLocal()
+        c = Customer(
+            name="Snapshot Owner",
+            email="snapshot@example.com",
+            property_address="12 Snapshot Way",
+            rate=300.0,
+            cadence="monthly",
+            next_bill_date=date.today()
+        )
+        session.add(c)
+        session.commit()
+        c_id = c.id
+        session.close()
+
+        response = self.client.post('/generate-invoice', data={
+            "customer_id": c_id,
+            "invoice_date": "2025-03-01",
+            "template_name": "base_invoice_template.docx",
+        }, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+
+        session = SessionLocal()
+        inv = session.query(Invoice).filter_by(customer_id=c_id, period_label="March 2025").one()
+        self.assertIsNotNone(inv.render_snapshot)
+        session.query(Customer).get(c_id).name = "Renamed Owner"
+        session.commit()
+        filename, buffer = generate_invoice_buffer(inv)
+        session.close()
+
+        text = "\n".join(p.text for p in Document(buffer).paragraphs)
+        self.assertIn("Snapshot Owner", text)
+        self.assertNotIn("Renamed Owner", text)
+        self.assertIn("03/01/2025 - 03/31/2025", text)
+
+    def test_bulk_invoice_actions(self):
+        """Selected invoices are marked paid, regenerated into a zip and deleted in one request each."""
+        import io
+        import zipfile
+
+        session = SessionLocal()
+        c = session.query(Customer).filter_by(email="test@example.com").first()
+        invoices = [
+            Invoice(customer_id=c.id, invoice_date=date(2025, month, 1), period_label=f"Bulk {month}",
+                    amount=100.0, file_path="bulk.docx", email_subject="Bulk", email_body="Bulk", status="Unpaid")
+            for month in (1, 2, 3)
+        ]
+        session.add_all(invoices)
+        session.commit()
+        ids = [inv.id for inv in invoices]
+        session.close()
+
+        response = self.client.post('/invoices/bulk', data={
+            "action": "mark_paid", "invoice_ids": ids[:2], "paid_date": "2025-04-01"
+        }, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        session = SessionLocal()
+        statuses = {inv.id: (inv.status, inv.paid_date) for inv in session.query(Invoice).filter(Invoice.id.in_(ids))}
+        session.close()
+        self.assertEqual(statuses[ids[0]], ("Paid", date(2025, 4, 1)))
+        self.assertEqual(statuses[ids[1]], ("Paid", date(2025, 4, 1)))
+        self.assertEqual(statuses[ids[2]], ("Unpaid", None))
+
+        response = self.client.post('/invoices/bulk', data={"action": "regenerate", "invoice_ids": ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(zipfile.ZipFile(io.BytesIO(response.data)).namelist()), 3)
+
+        response = self.client.post('/invoices/bulk', data={"action": "delete", "invoice_ids": ids}, follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        session = SessionLocal()
+        self.assertEqual(session.query(Invoice).filter(Invoice.id.in_(ids)).count(), 0)
+        session.close()
+
+    def test_print_period_merges_invoices(self):
+        """A period's invoices come back as one .docx, one section each, with the logo stored once."""
+        import io
+        import re
+        import zipfile
+        from docx import Document
+
+        session = SessionLocal()
+        c = session.query(Customer).filter_by(email="test@example.com").first()
+        invoices = [
+            Invoice(customer_id=c.id, invoice_date=date(2031, month, 1), period_label=f"Print {month}",
+                    period_start=date(2031, month, 1), period_end=date(2031, month, 28),
+                    amount=100.0 * month, file_path="print.docx", email_subject="Print", email_body="Print")
+            for month in (1, 2, 3)
+        ]
+        session.add_all(invoices)
+        session.commit()
+        ids = [inv.id for inv in invoices]
+        session.close()
+
+        try:
+            response = self.client.get('/invoices/print?period_from=2031-01-01&period_to=2031-12-31')
+            self.assertEqual(response.status_code, 200)
+            package = zipfile.ZipFile(io.BytesIO(response.data))
+            self.assertEqual(len([name for name in package.namelist() if name.startswith("word/media/")]), 1)
+            xml = package.read("word/document.xml").decode("utf-8")
+            self.assertEqual(xml.count("<w:sectPr"), 3)
+            drawing_ids = re.findall(r'<wp:docPr [^>]*?id="(\d+)"', xml)
+            self.assertEqual(len(set(drawing_ids)), len(drawing_ids))
+            text = "\n".join(p.text for p in Document(io.BytesIO(response.data)).paragraphs)
+            self.assertEqual(text.count("Test Customer"), 3)
+
+            response = self.client.get('/invoices/print?period_from=2032-01-01&period_to=2032-12-31')
+            self.assertEqual(response.status_code, 404)
+        finally:
+            session = SessionLocal()
+            session.query(Invoice).filter(Invoice.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+            session.close()
+
+    def test_download_etag_revalidation(self):
+        """Downloads are byte-identical and carry an ETag; a matching If-None-Match gets a 304 without rendering."""
+        from unittest import mock
+
+        session = SessionLocal()
+        c = session.query(Customer).filter_by(email="test@example.com").first()
+        inv = Invoice(customer_id=c.id, invoice_date=date(2034, 1, 1), period_label="Etag",
+                      period_start=date(2034, 1, 1), period_end=date(2034, 1, 31),
+                      amount=100.0, file_path="etag.docx", email_subject="Etag", email_body="Etag")
+        session.add(inv)
+        session.commit()
+        inv_id = inv.id
+        session.close()
+
+        try:
+            first = self.client.get(f'/invoices/{inv_id}/download')
+            second = self.client.get(f'/invoices/{inv_id}/download')
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(first.data, second.data)
+            etag = first.headers["ETag"]
+            self.assertEqual(etag, second.headers["ETag"])
+            self.assertIn("no-cache", first.headers["Cache-Control"])
+
+            with mock.patch("app.stored_invoice") as render:
+                response = self.client.get(f'/invoices/{inv_id}/download', headers={"If-None-Match": etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.data, b"")
+                self.assertEqual(response.headers["ETag"], etag)
+                render.assert_not_called()
+
+            pdf = self.client.get(f'/invoices/{inv_id}/download?format=pdf')
+            self.assertNotEqual(pdf.headers["ETag"], etag)
+
+            session = SessionLocal()
+            session.query(Invoice).get(inv_id).amount = 150.0
+            session.commit()
+            session.close()
+            response = self.client.get(f'/invoices/{inv_id}/download', headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+        finally:
+            session = SessionLocal()
+            session.query(Invoice).filter_by(id=inv_id).delete()
+            session.commit()
+            session.close()
+
+    def test_billing_run_stores_documents_after_commit(self):
+        """Documents are stored only once the billing run is committed, so storage can't hold it open or undo it."""
+        from unittest import mock
+
+        session = SessionLocal()
+        c = Customer(name="Store Billing", email="store-billing@example.com", property_address="5 Store St",
+                     rate=80.0, cadence="monthly", next_bill_date=date.today())
+        session.add(c)
+        session.commit()
+        c_id = c.id
+        session.close()
+
+        committed = []
+        def store(render_snapshots):
+            session = SessionLocal()
+            committed.append(session.query(Invoice).filter_by(customer_id=c_id).count())
+            session.close()
+            self.assertTrue(all(render_snapshots))
+            return 0
+
+        try:
+            with mock.patch("app.store_invoice_documents", side_effect=store):
+                response = self.client.get('/run-today')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(committed, [1])
+        finally:
+            session = SessionLocal()
+            session.query(Invoice).filter_by(customer_id=c_id).delete()
+            session.query(Customer).filter_by(id=c_id).delete()
+            session.commit()
+            session.close()
+
+    def test_pdf_download_and_print_run(self):
+        """PDFs are written directly: valid xref, filled text, and the logo stored once per file."""
+        import re
+        from unittest.mock import patch
+        import zlib
+
+        session = SessionLocal()
+        c = session.query(Customer).filter_by(email="test@example.com").first()
+        invoices = [
+            Invoice(customer_id=c.id, invoice_date=date(2033, month, 1), period_label=f"Pdf {month}",
+                    period_start=date(2033, month, 1), period_end=date(2033, month, 28),
+                    amount=100.0 * month, file_path="pdf.docx", email_subject="Pdf", email_body="Pdf")
+            for month in (1, 2)
+        ]
+        session.add_all(invoices)
+        session.commit()
+        ids = [inv.id for inv in invoices]
+        session.close()
+
+        def page_text(data):
+            text = b""
+            for stream in re.findall(rb"/Filter /FlateDecode[^>]*>>\nstream\n(.*?)\nendstream", data, re.S):
+                try:
+                    text += zlib.decompress(stream)
+                except zlib.error:
+                    pass
+            return b"".join(re.findall(rb"\((.*?)\) Tj", text))
+
+        try:
+            response = self.client.get(f'/invoices/{ids[0]}/download?format=pdf')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, "application/pdf")
+            data = response.data
+            self.assertTrue(data.startswith(b"%PDF-"))
+            start = int(re.search(rb"startxref\n(\d+)", data).group(1))
+            self.assertTrue(data[start:].startswith(b"xref"))
+            for offset, number in zip(re.findall(rb"(\d{10}) 00000 n", data), range(1, 1000)):
+                self.assertTrue(data[int(offset):].startswith(b"%d 0 obj" % number))
+            self.assertIn(b"Test Customer", page_text(data))
+            self.assertIn(b"100.00", page_text(data))
+
+            response = self.client.get(f'/invoices/{ids[0]}/download?format=rtf')
+            self.assertEqual(response.status_code, 404)
+
+            response = self.client.get('/invoices/print?period_from=2033-01-01&period_to=2033-12-31&format=pdf')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data.count(b"/Type /Page "), 2)
+            self.assertEqual(response.data.count(b"/Subtype /Image"), 1)
+
+            # Past the spool size the print run is written to a temporary file, not memory
+            with patch("app.PRINT_SPOOL_SIZE", 1024):
+                spooled = self.client.get('/invoices/print?period_from=2033-01-01&period_to=2033-12-31&format=pdf')
+            self.assertEqual(spooled.status_code, 200)
+            self.assertEqual(spooled.data, response.data)
+        finally:
+            session = SessionLocal()
+            session.query(Invoice).filter(Invoice.id.in_(ids)).delete(synchronize_session=False)
+            session.commit()
+            session.close()
+
+    def test_invoice_preview_skips_document_rendering(self):
+        """Previews show the lines and total as HTML without rendering a document."""
+        from unittest.mock import patch
+
+        session = SessionLocal()
+        c = session.query(Customer).filter_by(email="test@example.com").first()
+        inv_id = session.query(Invoice).filter_by(customer_id=c.id).first().id
+        c_id = c.id
+        session.close()
+
+        with patch("invoice_generator.build_invoice_document") as build_document:
+            response = self.client.get(f'/invoices/{inv_id}/preview')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"Test Customer", response.data)
+
+            response = self.client.post('/generate-invoice/preview', data={
+                "customer_id": c_id, "invoice_date": "2025-10-01", "fee_2_type": "Lawn Care", "fee_2_amount": "25",
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"4th quarter 2025 Lawn Care (10/01/2025 - 12/31/2025)", response.data)
+            self.assertIn(b"$125.00", response.data)
+            build_document.assert_not_called()
+
+        response = self.client.post('/generate-invoice/preview', data={
+            "customer_id": c_id, "invoice_date": "2025-10-01", "fee_2_amount": "lots",
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_template_upload_compiles_and_validates(self):
+        """Uploaded templates are compiled beside the template; ones with unknown placeholders are rejected."""
+        import io
+        import os
+        import tempfile
+        from unittest.mock import patch
+        from docx import Document
+        import template_registry
+
+        def docx_bytes(text):
+            doc = Document()
+            doc.add_paragraph("TO: {{CUSTOMER_NAME}}")
+            doc.add_paragraph(text)
+            buffer = io.BytesIO()
+            doc.save(buffer)
+            return buffer.getvalue()
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(template_registry, "TEMPLATE_DIR", tmp):
+            template_registry.clear_cache()
+            try:
+                response = self.client.post("/templates", data={"file": (io.BytesIO(docx_bytes("Total: {{TOTAL_AMOUNT}}")), "Commercial.docx")},
+                                            content_type="multipart/form-data")
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b"Uploaded Commercial.docx", response.data)
+                self.assertTrue(os.path.exists(os.path.join(tmp, "Commercial.docx")))
+                self.assertTrue(os.path.exists(os.path.join(tmp, ".compiled", "Commercial.docx.json")))
+                self.assertIn(b"CUSTOMER_NAME, TOTAL_AMOUNT", response.data)
+
+                response = self.client.post("/templates", data={"file": (io.BytesIO(docx_bytes("Total: {{TOTAL}}")), "typo.docx")},
+                                            content_type="multipart/form-data")
+                self.assertIn(b"Unknown placeholder {{TOTAL}}", response.data)
+                self.assertFalse(os.path.exists(os.path.join(tmp, "typo.docx")))
+            finally:
+                template_registry.clear_cache()
+
+    def test_export_streams_filtered_rows(self):
+        """Exports stream CSV/JSONL and honor the status and customer filters."""
+        import csv
+        import io
+        import json
+
+        session = SessionLocal()
+        c = session.query(Customer).filter_by(email="test@example.com").first()
+        c_id = c.id
+        inv = Invoice(customer_id=c_id, invoice_date=date(2024, 5, 1), period_label="Export Paid", amount=10.0,
+                      file_path="e.docx", email_subject="e", email_body="e", status="Paid")
+        session.add(inv)
+        session.commit()
+        inv_id = inv.id
+        session.close()
+
+        try:
+            response = self.client.get(f'/export/invoices?status=Paid&customer_id={c_id}&date_from=2024-05-01&date_to=2024-05-31')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_streamed)
+            rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+            self.assertEqual([r["period_label"] for r in rows], ["Export Paid"])
+            self.assertEqual(rows[0]["customer_name"], "Test Customer")
+
+            response = self.client.get(f'/export/customers?format=jsonl&customer_id={c_id}')
+            self.assertEqual(response.status_code, 200)
+            lines = response.get_data(as_text=True).splitlines()
+            self.assertEqual([json.loads(line)["email"] for line in lines], ["test@example.com"])
+
+            self.assertEqual(self.client.get('/export/payments').status_code, 404)
+            # A malformed filter is rejected rather than dropped, which would export everything
+            self.assertEqual(self.client.get('/export/invoices?customer_id=abc').status_code, 400)
+            self.assertEqual(self.client.get('/export/invoices?date_from=2024-13-01').status_code, 400)
+        finally:
+            session = SessionLocal()
+            session.query(Invoice).filter_by(id=inv_id).delete()
+            session.commit()
+            session.close()
+
     def test_delete_customer_preserves_invoices(self):
         """Test that deleting a customer does NOT delete their invoices."""
         print("\nTesting Customer Deletion Preserves Invoices...")